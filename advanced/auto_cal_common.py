@@ -0,0 +1,1354 @@
+# Printer code shared by auto_cal_p5.py and auto_cal_generic.py
+#
+# Serial transport with the windowed, checksummed sender and its reader
+# thread, reply parsing, the host-side settings shadow, transcripts, printer
+# discovery and baud negotiation, plus the session timer, ETA, latency
+# statistics and the timing and metrics reports written after a run.
+#
+# auto_cal_generic.py imports it from this folder, auto_cal_p5.py adds this
+# folder to sys.path first.
+
+from serial import Serial, SerialException, PARITY_ODD, PARITY_NONE
+import sys
+import math
+import os
+import glob
+import hashlib
+import json
+import re
+import threading
+import bisect
+import cProfile
+import contextlib
+import time
+from collections import deque, namedtuple
+try:
+    import numpy as np
+except ImportError:
+    # heatmap_p5_numpy() needs it, the scripts then fill the heatmap point by point
+    np = None
+
+# -----------------------------------------------------------------------------
+# Get Serial Connection
+# -----------------------------------------------------------------------------
+
+def establish_serial_connection(port, speed=115200, timeout=10, writeTimeout=10000, parity_hack=True, dtr=None, rts=False):
+    # Hack for USB connection
+    # There must be a way to do it cleaner, but I can't seem to find it
+    # parity_hack = False opens the port only once.  dtr = False keeps DTR low
+    # while opening, which stops most Marlin boards from rebooting (the hack
+    # itself opens the port with DTR high, so turn both off for that).
+    # dtr/rts = None leaves the line to the driver.
+    try:
+        temp = None
+        if parity_hack:
+            temp = Serial(port, speed, timeout=timeout, writeTimeout=writeTimeout, parity=PARITY_ODD)
+            if sys.platform == 'win32':
+                temp.close()
+        conn = Serial(None, speed, timeout=timeout, writeTimeout=writeTimeout, parity=PARITY_NONE)
+        conn.port = port
+        if dtr is not None:
+            conn.dtr = dtr
+        conn.open()
+        if rts is not None:
+            conn.rts = rts#needed on mac
+        if temp is not None and sys.platform != 'win32':
+            temp.close()
+        return conn
+    except SerialException as e:
+        print ("Could not connect to {0} at baudrate {1}\nSerial error: {2}".format(port, str(speed), e))
+        return None
+    except IOError as e:
+        print ("Could not connect to {0} at baudrate {1}\nIO error: {2}".format(port, str(speed), e))
+        return None
+
+# Printer replies parsed straight from the raw serial bytes
+ProbeResult = namedtuple('ProbeResult', 'x y z')
+G33Result = namedtuple('G33Result', 'height ex ey ez radius tx ty tz std_dev')
+SettingsLine = namedtuple('SettingsLine', 'code values')
+ReadyInfo = namedtuple('ReadyInfo', 'firmware wait latency discarded')
+
+NUMBER = rb'([-+]?[0-9]+\.?[0-9]*)'
+PROBE_RE = re.compile(rb'Bed X: *' + NUMBER + rb' +Y: *' + NUMBER + rb' +Z: *' + NUMBER)
+PROBE_FIELDS = [b'X:', b'Y:', b'Z:']
+G33_RE = re.compile(rb'(Height|Ex|Ey|Ez|Radius|Tx|Ty|Tz|std dev) *: *' + NUMBER)
+TEMPERATURE_RE = re.compile(rb'(?<![A-Z@])([TB][0-9]?):' + NUMBER)
+SETTINGS_RE = re.compile(rb'^(?:echo:)? *(M92|M206|M665|M666|M851)((?: +[A-Z]' + NUMBER + rb')*) *$')
+PARAM_RE = re.compile(rb'([A-Z])' + NUMBER)
+SHADOW_COMMAND_RE = re.compile(rb'(M92|M206|M665|M666|M851|M501|M502)(?![0-9])')
+G33_INDEX = {b'Height': 0, b'Ex': 1, b'Ey': 2, b'Ez': 3, b'Radius': 4,
+             b'Tx': 5, b'Ty': 6, b'Tz': 7, b'std dev': 8}
+
+def parse_probe(raw):
+    # "Bed X: -25.00 Y: -50.00 Z: 0.123" from G30 or G29 V4.  Splitting that
+    # layout is several times faster than PROBE_RE, which covers the rest.
+    fields = raw.split()
+    if len(fields) == 7 and fields[1::2] == PROBE_FIELDS:
+        try:
+            return ProbeResult(float(fields[2]), float(fields[4]), float(fields[6]))
+        except ValueError:
+            pass
+    m = PROBE_RE.search(raw)
+    if m is None:
+        return None
+    x, y, z = m.groups()
+    return ProbeResult(float(x), float(y), float(z))
+
+def parse_G33(raw):
+    # Fields reported by G33 V3, fields not on this line are None
+    fields = G33_RE.findall(raw)
+    if not fields:
+        return None
+    values = [None]*9
+    for name, num in fields:
+        values[G33_INDEX[name]] = float(num)
+    return G33Result._make(values)
+
+def parse_settings(raw):
+    # "echo:  M665 L123.00 R63.50" from M503 or a command we sent
+    m = SETTINGS_RE.match(raw.strip())
+    if m is None:
+        return None
+    values = dict((p.decode(), float(num)) for p, num in PARAM_RE.findall(m.group(2)))
+    return SettingsLine(m.group(1).decode(), values)
+
+def parse_line(raw):
+    # Typed record for a reply line, or None for lines we have no use for
+    return parse_probe(raw) or parse_settings(raw) or parse_G33(raw)
+
+# Kinds of lines the printer sends back, see classify_line()
+LINE_PROBE = 'probe'
+LINE_ACK = 'ack'
+LINE_TEMPERATURE = 'temperature'
+LINE_ERROR = 'error'
+LINE_SETTINGS = 'settings'
+LINE_OTHER = 'other'
+LINE_KINDS = (LINE_PROBE, LINE_ACK, LINE_TEMPERATURE, LINE_ERROR, LINE_SETTINGS, LINE_OTHER)
+
+def classify_line(out):
+    text = out.strip()
+    if text.startswith(b'ok'):
+        return LINE_ACK
+    # Parsed later by whoever takes the line, get_points() then says if it is unreadable
+    if b'Bed X:' in text:
+        return LINE_PROBE
+    if text.startswith(b'T:') or text.startswith(b'B:'):
+        return LINE_TEMPERATURE
+    if text.startswith(b'Error') or text.startswith(b'!!') or text.startswith(b'Resend:') or text.startswith(b'rs '):
+        return LINE_ERROR
+    # M503 dumps: "echo:  M92 X57.14 Y57.14 Z57.14", "echo:Steps per unit:"
+    echo = text.startswith(b'echo:')
+    if echo:
+        text = text[5:].strip()
+    if re.match(b'(M[0-9]+|G2[01]) ', text + b' ') or b'Steps per' in text or (echo and text.endswith(b':')):
+        return LINE_SETTINGS
+    return LINE_OTHER
+
+class SettingsShadow(object):
+    """Host-side copy of the M92/M206/M665/M666/M851 settings.
+
+    Filled from the lines of any M503 dump the printer sends and updated by
+    every one of those commands we send, so the current values can be shown
+    without asking the printer for a full M503 dump each time.  Commands that
+    cannot be parsed, and M501/M502 which reload the settings, drop what we
+    know, so the next request goes to the printer again.  Until a real dump
+    has been read (loaded) the shadow only holds what we sent and does not
+    answer for the printer.  verify = True makes get_M503_text() always read
+    the real values.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+        self.verify = False
+        self.loaded = False
+
+    def update(self, raw):
+        # Settings line from an M503 dump or a command on its way out
+        setting = parse_settings(raw)
+        if setting is None:
+            return False
+        # Without parameters the command only reports the current values
+        if setting.values:
+            with self.lock:
+                self.values.setdefault(setting.code, {}).update(setting.values)
+        return True
+
+    def update_command(self, data):
+        gcode = data.split(b';')[0].strip()
+        match = SHADOW_COMMAND_RE.match(gcode)
+        if match is None or self.update(gcode):
+            return
+        with self.lock:
+            if match.group(1) in (b'M501', b'M502'):
+                self.values.clear()
+                self.loaded = False
+            else:
+                self.values.pop(match.group(1).decode(), None)
+
+    def has(self, *codes):
+        with self.lock:
+            return all(code in self.values for code in codes)
+
+    def line(self, code):
+        # Setting as M503 prints it, "echo:  M665 L123.00 R63.50"
+        with self.lock:
+            values = dict(self.values.get(code, {}))
+        params = ' '.join('{0}{1:.2f}'.format(p, v) for p, v in values.items())
+        return 'echo:  {0} {1}\n'.format(code, params)
+
+class SessionTimer(object):
+    """Wall clock time spent in each phase of a calibration session.
+
+    phase() adds the time spent inside it to the current pass and
+    next_pass() starts a new one.  Time before the first pass goes to
+    "setup", time outside every phase (prompts, setup commands) only shows
+    up as "other" in the session totals.  After start_profile() the compute
+    phases run under cProfile and everything else stays out of the profile.
+
+    It also counts the probe results, keeps the latest value of every
+    counter() and the CalibrationETA of the session.  After start_trace()
+    it keeps a Chrome trace-event timeline for save_trace(), viewable in
+    Perfetto or chrome://tracing: the phases on the host track, every
+    command from write to ok and every probe on the printer track, and
+    counters for the temperatures and calibration errors.
+    """
+
+    PHASES = ('heating', 'homing', 'probing', 'G33', 'contour', 'calibrate', 'settings', 'output')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.labels = ['setup']
+        self.passes = [{}]
+        self.profiler = None
+        self.events = None
+        self.commands = 0
+        self.probes = 0
+        self.values = {}
+        self.pass_starts = [self.start]
+        self.eta = CalibrationETA(self)
+
+    def start_profile(self):
+        self.profiler = cProfile.Profile()
+
+    def start_trace(self):
+        self.events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': name}}
+                       for tid, name in ((1, 'host'), (2, 'printer'))]
+
+    def _us(self, t):
+        # Trace timestamps are microseconds since the session started
+        return (t - self.start)*1e6
+
+    def command(self, code, gcode, sent, done, lost=False):
+        # Commands overlap when pipelined, so each gets its own async span
+        if self.events is None:
+            return
+        self.commands += 1
+        args = {'gcode': gcode, 'lost': True} if lost else {'gcode': gcode}
+        self.events.append({'name': code, 'cat': 'command', 'ph': 'b', 'id': self.commands, 'pid': 1, 'tid': 2, 'ts': self._us(sent), 'args': args})
+        self.events.append({'name': code, 'cat': 'command', 'ph': 'e', 'id': self.commands, 'pid': 1, 'tid': 2, 'ts': self._us(done)})
+
+    def line(self, kind, raw):
+        # Probe results and temperature reports from the reader thread
+        if kind == LINE_PROBE:
+            self.probes += 1
+        if self.events is None:
+            return
+        now = time.perf_counter()
+        if kind == LINE_PROBE:
+            probe = parse_probe(raw)
+            if probe is not None:
+                self.events.append({'name': 'probe', 'cat': 'probe', 'ph': 'i', 's': 't', 'pid': 1, 'tid': 2, 'ts': self._us(now),
+                                    'args': {'x': probe.x, 'y': probe.y, 'z': probe.z}})
+        elif kind == LINE_TEMPERATURE:
+            temperatures = dict((name.decode(), float(value)) for name, value in TEMPERATURE_RE.findall(raw))
+            if temperatures:
+                self.counter('temperature', now, **temperatures)
+
+    def counter(self, name, t=None, **values):
+        # The latest values of every counter are kept for write_metrics()
+        self.values[name] = values
+        if self.events is not None:
+            self.events.append({'name': name, 'ph': 'C', 'pid': 1, 'ts': self._us(t or time.perf_counter()), 'args': values})
+
+    @contextlib.contextmanager
+    def phase(self, name, compute=False):
+        profiler = self.profiler if compute else None
+        if profiler is not None:
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+            times = self.passes[-1]
+            times[name] = times.get(name, 0.0) + elapsed
+            if self.events is not None:
+                self.events.append({'name': name, 'cat': 'compute' if compute else 'phase', 'ph': 'X', 'pid': 1, 'tid': 1,
+                                    'ts': self._us(start), 'dur': elapsed*1e6, 'args': {'pass': self.labels[-1]}})
+
+    def next_pass(self, label):
+        self.labels.append(label)
+        self.passes.append({})
+        self.pass_starts.append(time.perf_counter())
+        if self.events is not None:
+            self.events.append({'name': label, 'cat': 'pass', 'ph': 'i', 's': 'g', 'pid': 1, 'tid': 1, 'ts': self._us(time.perf_counter())})
+
+    def phases(self):
+        # Known phases in session order, then any others
+        seen = set(name for times in self.passes for name in times)
+        return [name for name in self.PHASES if name in seen] + sorted(seen.difference(self.PHASES))
+
+    def totals(self):
+        totals = dict((name, sum(times.get(name, 0.0) for times in self.passes)) for name in self.phases())
+        session = time.perf_counter() - self.start
+        return totals, session - sum(totals.values()), session
+
+    def report(self):
+        names = self.phases()
+        totals, other, session = self.totals()
+        print ('\nSession timing (s)')
+        print ('{0:<10} {1} {2:>9}'.format('pass', ' '.join('{0:>9}'.format(name) for name in names), 'total'))
+        for label, times in zip(self.labels, self.passes):
+            if times:
+                print ('{0:<10} {1} {2:9.3f}'.format(label, ' '.join('{0:9.3f}'.format(times.get(name, 0.0)) for name in names), sum(times.values())))
+        print ('{0:<10} {1} {2:9.3f}'.format('all', ' '.join('{0:9.3f}'.format(totals[name]) for name in names), sum(totals.values())))
+        print ('Outside the phases {0:.3f} s, session {1:.3f} s\n'.format(other, session))
+
+    def save(self, path, **extra):
+        totals, other, session = self.totals()
+        data = {'session': session, 'other': other, 'phases': totals,
+                'passes': [{'pass': label, 'phases': times, 'total': sum(times.values())}
+                           for label, times in zip(self.labels, self.passes) if times]}
+        data.update(extra)
+        with open(path, 'w') as timing_file:
+            json.dump(data, timing_file, indent=1)
+
+    def save_trace(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': self.events or [], 'displayTimeUnit': 'ms'}, trace_file)
+
+    def dump_profile(self, path):
+        # Read with python3 -m pstats <path>
+        if self.profiler is not None:
+            self.profiler.dump_stats(path)
+
+class CalibrationETA(object):
+    """Time left in a calibration, from the passes measured so far.
+
+    Another pass costs what the passes before it cost on this printer
+    (homing, moves, probes and the math), or what the current one has cost
+    so far while it is the first.  The errors of a converging calibration
+    shrink by about the same ratio every pass, so the passes left are how
+    many more of those ratios it takes to bring the largest error under the
+    target the calibration stops at.  Until two passes have been measured
+    the ratio is GUESS_RATIO.  Loops that stop once their results repeat
+    (G33) pass stall: errors shrinking slower than STALL_RATIO are at the
+    noise floor, and `stall` passes are left.  at_least covers passes a
+    loop always runs.
+
+    Every estimate is kept, and save() appends them with the actual time and
+    passes that were left as one JSON line, for planning printer downtime.
+    """
+
+    GUESS_RATIO = 0.3
+    STALL_RATIO = 0.7
+
+    def __init__(self, timer):
+        self.timer = timer
+        self.errors = []
+        self.calibrations = []
+        self.predictions = []
+
+    def new_calibration(self):
+        self.errors = []
+        self.calibrations.append(time.perf_counter())
+
+    def update(self, errors, runs_left, target=0.02, at_least=0, stall=None):
+        # Called once a pass has its errors.  Returns (passes left, seconds left).
+        now = time.perf_counter()
+        error = max(abs(e) for e in errors)
+        self.errors.append(error)
+        ratio = self.GUESS_RATIO
+        if len(self.errors) > 1 and self.errors[-2] > 0:
+            ratio = min(max(self.errors[-1]/self.errors[-2], 0.05), 0.95)
+        if error < target:
+            passes_left = 0
+        elif stall is not None and len(self.errors) > 1 and ratio >= self.STALL_RATIO:
+            passes_left = stall
+        else:
+            passes_left = max(int(math.ceil(math.log(target/error)/math.log(ratio))), 1)
+        passes_left = min(max(passes_left, at_least), runs_left)
+        starts = self.timer.pass_starts
+        durations = [b - a for a, b in zip(starts[1:-1], starts[2:])]
+        pass_time = sum(durations)/len(durations) if durations else now - starts[-1]
+        seconds_left = passes_left*pass_time
+        self.predictions.append({'calibration': len(self.calibrations) - 1, 'pass': self.timer.labels[-1],
+                                 'elapsed': now - self.timer.start, 'error': error, 'ratio': ratio,
+                                 'pass_time': pass_time, 'passes_left': passes_left, 'seconds_left': seconds_left})
+        return passes_left, seconds_left
+
+    def report(self, passes_left, seconds_left):
+        if passes_left > 0:
+            print ('Estimated {0} more pass{1}, {2:.0f} s, done at about {3}'.format(str(passes_left), 'es' if passes_left > 1 else '',
+                   seconds_left, time.strftime('%H:%M:%S', time.localtime(time.time() + seconds_left))))
+
+    def save(self, path, **info):
+        # Compare every estimate with what actually happened after it
+        end = time.perf_counter()
+        ends = [start - self.timer.start for start in self.calibrations[1:]] + [end - self.timer.start]
+        for prediction in self.predictions:
+            later = [p for p in self.predictions if p['calibration'] == prediction['calibration'] and p['elapsed'] > prediction['elapsed']]
+            prediction['actual_seconds_left'] = ends[prediction['calibration']] - prediction['elapsed']
+            prediction['actual_passes_left'] = len(later)
+        record = {'time': time.time(), 'session': end - self.timer.start, 'predictions': self.predictions}
+        record.update(info)
+        with open(path, 'a') as eta_file:
+            eta_file.write(json.dumps(record) + '\n')
+        if self.predictions:
+            first = self.predictions[0]
+            print ('Estimated {0:.0f} s after {1}, took {2:.0f} s'.format(first['seconds_left'], first['pass'], first['actual_seconds_left']))
+
+class CommandLatency(object):
+    """Time from write() to the ok of every command, one histogram per G-code.
+
+    Each histogram is a fixed list of bucket counts, so a session of any
+    length costs the same few integers per command type.  Percentiles are
+    the upper edge of the bucket they fall in, capped at the slowest command
+    seen.  Commands whose ok never came, written off by the reader thread
+    once their deadline passed in silence, are counted as lost.
+    """
+
+    # Bucket upper edges in seconds, the last bucket takes everything slower
+    BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+    def __init__(self):
+        self.codes = {}
+
+    def _entry(self, code):
+        entry = self.codes.get(code)
+        if entry is None:
+            entry = self.codes[code] = {'buckets': [0]*(len(self.BOUNDS) + 1), 'count': 0, 'total': 0.0, 'max': 0.0, 'lost': 0}
+        return entry
+
+    def add(self, code, seconds):
+        entry = self._entry(code)
+        entry['buckets'][bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        entry['count'] += 1
+        entry['total'] += seconds
+        entry['max'] = max(entry['max'], seconds)
+
+    def lost(self, code):
+        self._entry(code)['lost'] += 1
+
+    def percentile(self, code, p):
+        entry = self.codes[code]
+        rank = p/100.0*entry['count']
+        seen = 0
+        for bound, count in zip(self.BOUNDS + (entry['max'],), entry['buckets']):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, entry['max'])
+        return entry['max']
+
+    def summary(self):
+        return dict((code, {'count': entry['count'], 'lost': entry['lost'],
+                            'mean': entry['total']/entry['count'] if entry['count'] else None,
+                            'p50': self.percentile(code, 50), 'p90': self.percentile(code, 90),
+                            'p99': self.percentile(code, 99), 'max': entry['max'],
+                            'bounds': list(self.BOUNDS), 'buckets': entry['buckets']})
+                    for code, entry in sorted(self.codes.items()))
+
+    def report(self, timeout=None):
+        if not self.codes:
+            return
+        print ('\nCommand latency, write to ok (ms)')
+        print ('{0:<8} {1:>6} {2:>9} {3:>9} {4:>9} {5:>9} {6:>5}'.format('code', 'count', 'p50', 'p90', 'p99', 'max', 'lost'))
+        for code, entry in sorted(self.codes.items()):
+            if entry['count']:
+                print ('{0:<8} {1:6d} {2:9.1f} {3:9.1f} {4:9.1f} {5:9.1f} {6:5d}'.format(code, entry['count'],
+                       1000*self.percentile(code, 50), 1000*self.percentile(code, 90), 1000*self.percentile(code, 99),
+                       1000*entry['max'], entry['lost']))
+            else:
+                print ('{0:<8} {1:6d} {2:>9} {3:>9} {4:>9} {5:>9} {6:5d}'.format(code, 0, '-', '-', '-', '-', entry['lost']))
+        lost = sum(entry['lost'] for entry in self.codes.values())
+        if lost and timeout is not None:
+            print ('{0} commands got no ok within their deadline ({1} s port timeout, longer for slow commands)'.format(str(lost), str(timeout)))
+        print ('')
+
+# Seconds a command may take on top of the port timeout before its ok is
+# written off.  Homing, probing and heating often stay silent for longer
+# than the port timeout, on stock firmware without any busy: keepalive.
+SLOW_COMMANDS = {'G28': 120, 'G29': 600, 'G30': 60, 'G33': 900, 'G4': 600,
+                 'M109': 900, 'M190': 900, 'M400': 600}
+
+class PrinterLink(object):
+    """Serial port wrapper that keeps up to `window` G-code commands in flight.
+
+    Marlin acknowledges every command it takes out of its command buffer with
+    an "ok", so counting those replies tells us how many commands the printer
+    still holds.  write() only blocks once `window` commands are unacknowledged,
+    which keeps the planner fed instead of waiting on the host round-trip.
+    window = 0 turns flow control off and writes never block.
+
+    A background thread reads every line from the printer and files it under
+    one of the LINE_* kinds, so callers wait for the replies they care about
+    with wait_for() instead of polling readline() and throwing the rest away.
+    Oks and temperature reports are used up once they have been counted, and
+    only stay queued while a caller holds their kind (wait_ready() holds the
+    oks).  readline() hands out every other line in arrival order.
+
+    With checksum = True every command goes out as "N<line> <gcode>*<xor>".
+    When Marlin answers "Resend: <line>", only that line and the ones sent
+    after it are sent again instead of losing the whole calibration session.
+
+    An ok only counts as lost once the oldest command has gone unanswered
+    for its deadline (the port timeout plus SLOW_COMMANDS) since it was sent
+    or the printer last showed progress: an ok, a probe result or a busy:
+    keepalive.
+    """
+
+    def __init__(self, conn, window=0, checksum=False, timer=None, latency=None):
+        self.conn = conn
+        self.timer = timer if timer is not None else SessionTimer()
+        self.latency = latency if latency is not None else CommandLatency()
+        self.window = window
+        self.timeout = conn.timeout
+        self.in_flight = 0
+        self.pending = deque()
+        self.progress = time.perf_counter()
+        self.cond = threading.Condition()
+        self.queues = dict((kind, deque()) for kind in LINE_KINDS)
+        self.held = set()
+        self.seq = 0
+        self.last_seq = 0
+        self.closed = False
+        self.checksum = checksum
+        self.line_number = 0
+        self.history = deque(maxlen=128)
+        self.resend_from = -1
+        self.resend_skip = 0
+        self.shadow = SettingsShadow()
+        self.reader = threading.Thread(target=self._read_loop)
+        self.reader.daemon = True
+        self.reader.start()
+        if checksum:
+            self.reset_line_numbers()
+
+    def reset_line_numbers(self):
+        with self.cond:
+            self.line_number = -1
+            self.history.clear()
+        self.write(b'M110 N0\n')
+
+    def _number_line(self, gcode):
+        self.line_number += 1
+        line = 'N{0} {1}'.format(self.line_number, gcode)
+        cs = 0
+        for c in line.encode():
+            cs ^= c
+        line = '{0}*{1}\n'.format(line, cs).encode()
+        self.history.append((self.line_number, line))
+        return line
+
+    def _resend(self, n):
+        # Every Resend is followed by an ok that does not acknowledge a command
+        if n == self.resend_from and self.resend_skip > 0:
+            # Lines sent before the first request ask for the same line again
+            self.resend_skip -= 1
+            self.in_flight += 1
+            return
+        lines = [line for num, line in self.history if num >= n]
+        if not lines:
+            print('Printer requested line {0}, which is no longer available'.format(n))
+            return
+        # Everything after line n was dropped, but lines before it may still
+        # be queued in the printer and owe us their ok
+        waiting = sum(1 for entry in self.pending if entry[3] is not None and entry[3] < n)
+        self.resend_from = n
+        self.resend_skip = len(lines) - 1
+        self.in_flight = waiting + len(lines) + 1
+        for line in lines:
+            self.conn.write(line)
+
+    def _settle(self, lost=False):
+        # Every command beyond what in_flight still counts has its ok.  The
+        # extra oks that follow a Resend raise in_flight, not pending.
+        now = time.perf_counter()
+        while len(self.pending) > self.in_flight:
+            code, sent, gcode, number, deadline = self.pending.popleft()
+            if code and lost:
+                self.latency.lost(code)
+            elif code:
+                self.latency.add(code, now - sent)
+            if code:
+                self.timer.command(code, gcode, sent, now, lost)
+
+    def _read_loop(self):
+        while not self.closed:
+            try:
+                out = self.conn.readline()
+            except Exception:
+                if not self.closed:
+                    print('Lost the serial connection to the printer')
+                    self.closed = True
+                    with self.cond:
+                        self.cond.notify_all()
+                return
+            with self.cond:
+                if not out:
+                    if self.in_flight > 0 and self._overdue():
+                        # The oldest command is past its deadline, assume its ok was lost
+                        self.in_flight -= 1
+                        self._settle(lost=True)
+                        self.progress = time.perf_counter()
+                        self.cond.notify_all()
+                    continue
+                kind = classify_line(out)
+                if kind in (LINE_ACK, LINE_PROBE) or b'busy:' in out:
+                    self.progress = time.perf_counter()
+                if kind == LINE_OTHER and b'busy:' in out:
+                    # Keepalives only move the deadline, nobody waits for them
+                    continue
+                if kind == LINE_SETTINGS:
+                    self.shadow.update(out)
+                elif kind in (LINE_PROBE, LINE_TEMPERATURE):
+                    self.timer.line(kind, out)
+                if kind == LINE_ACK:
+                    self.in_flight = max(self.in_flight - 1, 0)
+                    self._settle()
+                elif out.startswith(b'Resend:') or out.startswith(b'rs '):
+                    self._resend(int(out.split(b':' if b':' in out else b'N')[-1]))
+                if kind in (LINE_ACK, LINE_TEMPERATURE) and kind not in self.held:
+                    # Nobody waits for these, queueing them would only grow
+                    # the backlog _oldest() walks on every read
+                    self.cond.notify_all()
+                    continue
+                self.seq += 1
+                self.queues[kind].append((self.seq, out))
+                self.cond.notify_all()
+
+    def _overdue(self):
+        # Deadline of the oldest command, counted from when it was sent or the
+        # last progress.  The extra oks after a Resend get the port timeout.
+        deadline = self.pending[0][4] if self.pending else self.timeout
+        since = max(self.pending[0][1], self.progress) if self.pending else self.progress
+        return time.perf_counter() - since >= deadline
+
+    def write(self, data):
+        gcode = data.decode().split(';')[0].strip()
+        if self.checksum and not gcode:
+            return 0
+        code = gcode.split()[0].upper() if gcode else None
+        with self.cond:
+            while self.window > 0 and self.in_flight >= self.window and not self.closed:
+                self.cond.wait()
+            self.in_flight += 1
+            self.shadow.update_command(data)
+            number = None
+            if self.checksum:
+                data = self._number_line(gcode)
+                number = self.line_number
+            self.pending.append((code, time.perf_counter(), gcode, number, self.timeout + SLOW_COMMANDS.get(code, 0)))
+            return self.conn.write(data)
+
+    def _wait(self, pick, timeout):
+        # Wait until pick() finds a queued line, then take it off its queue
+        with self.cond:
+            found = pick()
+            if found is None and not self.closed:
+                self.cond.wait_for(lambda: pick() is not None or self.closed, timeout)
+                found = pick()
+            if found is None:
+                return b''
+            kind, i = found
+            self.last_seq, out = self.queues[kind][i]
+            del self.queues[kind][i]
+            return out
+
+    def _oldest(self, kinds, after=0):
+        oldest = None
+        for kind in kinds:
+            for i, (seq, out) in enumerate(self.queues[kind]):
+                if seq > after:
+                    if oldest is None or seq < oldest[0]:
+                        oldest = (seq, kind, i)
+                    break
+        return None if oldest is None else oldest[1:]
+
+    def readline(self, timeout=-1):
+        # Oldest line of any kind, b'' after `timeout` (default: port timeout)
+        timeout = self.timeout if timeout == -1 else timeout
+        return self._wait(lambda: self._oldest(LINE_KINDS), timeout)
+
+    def next_line(self, timeout=-1):
+        # Line of any kind that arrived after the last one handed out
+        timeout = self.timeout if timeout == -1 else timeout
+        return self._wait(lambda: self._oldest(LINE_KINDS, self.last_seq), timeout)
+
+    def wait_for(self, kinds, match=None, timeout=None):
+        # Next line of the given kind(s), skipping lines of those kinds that
+        # do not contain `match`.  Lines of other kinds stay queued.
+        if not isinstance(kinds, tuple):
+            kinds = (kinds,)
+        while True:
+            out = self._wait(lambda: self._oldest(kinds), timeout)
+            if not out or match is None or match in out:
+                return out
+
+    def drain(self, timeout=None):
+        # Wait until the printer has acknowledged everything we sent
+        with self.cond:
+            return self.cond.wait_for(lambda: self.in_flight == 0 or self.closed, timeout)
+
+    def wait_ready(self, timeout=30, interval=1, samples=3):
+        # Send M115 until the firmware acknowledges one.  Whatever arrives
+        # before that is the boot banner, not a reply to our commands.  A few
+        # more M115 round trips then show how quickly the printer answers.
+        # Returns a ReadyInfo, or None if nothing answered within `timeout`.
+        with self.cond:
+            self.held.add(LINE_ACK)
+        start = time.monotonic()
+        ready = False
+        sent_M115 = 0
+        while time.monotonic() - start < timeout and not self.closed:
+            self.conn.write(b'M115\n')
+            sent_M115 += 1
+            if self.wait_for(LINE_ACK, timeout=interval):
+                ready = True
+                break
+        if not ready:
+            with self.cond:
+                self.held.discard(LINE_ACK)
+                self.queues[LINE_ACK].clear()
+            return None
+        wait = time.monotonic() - start
+        # A board that buffered the M115s sent while it was booting answers
+        # all of them now.  Take those oks until the line goes quiet, or they
+        # would be counted as latency samples and acknowledge later commands.
+        while sent_M115 > 1 and self.wait_for(LINE_ACK, timeout=interval):
+            sent_M115 -= 1
+        latency = []
+        for ii in range(samples):
+            sent = time.monotonic()
+            self.conn.write(b'M115\n')
+            if self.wait_for(LINE_ACK, timeout=self.timeout):
+                latency.append(time.monotonic() - sent)
+        with self.cond:
+            lines = sorted(line for kind in LINE_KINDS for line in self.queues[kind])
+            for kind in LINE_KINDS:
+                self.queues[kind].clear()
+            self.held.discard(LINE_ACK)
+            # Banner and M115 replies are not answers to anything sent with write()
+            self.in_flight = 0
+            self.pending.clear()
+        firmware = b''
+        for seq, out in lines:
+            if b'FIRMWARE_NAME' in out:
+                firmware = out.strip()
+        if self.checksum:
+            self.reset_line_numbers()
+            self.drain()
+        return ReadyInfo(firmware.decode(errors='replace'), wait,
+                         sorted(latency)[len(latency)//2] if latency else None, len(lines))
+
+    def close(self):
+        self.closed = True
+        self.conn.close()
+
+class PrinterSession(object):
+    """One printer connection kept open across calibrations.
+
+    Opening the serial port reboots most Marlin boards, so every script start
+    used to pay for a firmware boot before the first command.  A session opens
+    the port once and hands the same PrinterLink to every calibration,
+    verification pass or mesh dump run through it.  open() only reconnects
+    when the link was closed or lost, and waits for the firmware to answer
+    before handing a fresh link out (ready_timeout = 0 skips the wait).
+
+    record = path logs the session with TranscriptRecorder, replay = path
+    plays a recorded session back instead of opening the serial port.
+    Every link it opens shares one SessionTimer and one CommandLatency, so the
+    phase timings and latency histograms of a session survive a reconnect.
+    """
+
+    def __init__(self, port, speed=115200, window=0, checksum=False, parity_hack=True, dtr=None, rts=False, timeout=10, ready_timeout=30,
+                 record=None, replay=None, replay_scale=0):
+        self.port = port
+        self.speed = speed
+        self.window = window
+        self.checksum = checksum
+        self.parity_hack = parity_hack
+        self.dtr = dtr
+        self.rts = rts
+        self.timeout = timeout
+        self.ready_timeout = ready_timeout
+        self.record = record
+        self.replay = replay
+        self.replay_scale = replay_scale
+        self.ready = None
+        self.link = None
+        self.opens = 0
+        self.timer = SessionTimer()
+        self.latency = CommandLatency()
+
+    def open(self):
+        if self.link is not None and not self.link.closed:
+            return self.link
+        if self.replay:
+            conn = TranscriptReplay(self.replay, self.replay_scale, self.timeout)
+        else:
+            conn = establish_serial_connection(self.port, self.speed, self.timeout,
+                                               parity_hack=self.parity_hack, dtr=self.dtr, rts=self.rts)
+        if conn is None:
+            return None
+        if self.record:
+            # A reconnect adds to the transcript instead of replacing it
+            conn = TranscriptRecorder(conn, self.record, 'a' if self.opens else 'w', port=self.port, speed=self.speed)
+        self.link = PrinterLink(conn, self.window, self.checksum, self.timer, self.latency)
+        self.opens += 1
+        if self.ready_timeout > 0:
+            self.ready = self.link.wait_ready(self.ready_timeout)
+        return self.link
+
+    def start_recording(self, path):
+        # Log the link that is already open, and every reconnect after it
+        self.record = path
+        if self.link is not None and not self.link.closed:
+            self.link.conn = TranscriptRecorder(self.link.conn, path, port=self.port, speed=self.speed)
+
+    def close(self):
+        if self.link is not None:
+            self.link.close()
+            self.link = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class TranscriptRecorder(object):
+    """Serial port wrapper that logs every byte in both directions.
+
+    Each line of the JSONL file is {"t": seconds, "dir": "tx" or "rx",
+    "data": text}.  t counts time.monotonic() from the moment the port
+    opened, and data is decoded as latin-1 so every byte survives the round
+    trip.  The first line holds the port, baud rate and command line.  The
+    file is line buffered, so a crash still leaves everything up to it.
+    """
+
+    def __init__(self, conn, path, mode='w', **header):
+        self.conn = conn
+        self.timeout = conn.timeout
+        self.port = conn.port
+        self.lock = threading.Lock()
+        self.file = open(path, mode, buffering=1)
+        self.start = time.monotonic()
+        header.update(transcript=1, time=time.time(), argv=sys.argv[1:])
+        self.file.write(json.dumps(header) + '\n')
+
+    def _record(self, direction, data):
+        if data:
+            with self.lock:
+                self.file.write(json.dumps({'t': round(time.monotonic() - self.start, 6), 'dir': direction,
+                                            'data': data.decode('latin-1')}) + '\n')
+
+    def write(self, data):
+        self._record('tx', data)
+        return self.conn.write(data)
+
+    def readline(self):
+        data = self.conn.readline()
+        self._record('rx', data)
+        return data
+
+    def close(self):
+        self.conn.close()
+        with self.lock:
+            self.file.close()
+
+class TranscriptReplay(object):
+    """Stands in for the serial port and plays a TranscriptRecorder file back.
+
+    Every recorded line from the printer is held back until the host has
+    written as many commands as had been written when it arrived, so the
+    calibration runs through the same session without a printer attached.
+    time_scale = 1 also keeps the recorded delay between the last command and
+    each reply (2 = twice as fast), time_scale = 0 hands replies out as soon
+    as they are due.  The first command that differs from the recording is
+    reported, the replies are played as recorded either way.
+    """
+
+    def __init__(self, path, time_scale=0, timeout=10):
+        self.port = path
+        self.timeout = timeout
+        self.time_scale = time_scale
+        self.cond = threading.Condition()
+        self.header = {}
+        self.expected = []
+        self.lines = deque()
+        self.sent = []
+        self.diverged = False
+        self.closed = False
+        self._load(path)
+        self.opened = time.monotonic()
+
+    def _load(self, path):
+        # Split the rx data into lines: (commands written before it, seconds after the last of them, line)
+        last_tx = 0.0
+        pending = b''
+        with open(path) as data_file:
+            for text in data_file:
+                record = json.loads(text)
+                if 'dir' not in record:
+                    self.header = self.header or record
+                    continue
+                data = record['data'].encode('latin-1')
+                if record['dir'] == 'tx':
+                    self.expected.append(data)
+                    last_tx = record['t']
+                    continue
+                pending += data
+                while b'\n' in pending:
+                    line, pending = pending.split(b'\n', 1)
+                    self.lines.append((len(self.expected), record['t'] - last_tx, line + b'\n'))
+
+    def write(self, data):
+        with self.cond:
+            n = len(self.sent)
+            if not self.diverged and (n >= len(self.expected) or data != self.expected[n]):
+                self.diverged = True
+                print('Replay differs from the recording at command {0}: sent {1}, recorded {2}'.format(
+                    str(n + 1), repr(data), repr(self.expected[n]) if n < len(self.expected) else 'nothing'))
+            self.sent.append(time.monotonic())
+            self.cond.notify_all()
+        return len(data)
+
+    def _due(self):
+        # When the next line may be handed out, None until its command is written
+        after, delay, line = self.lines[0]
+        if after > len(self.sent):
+            return None
+        if self.time_scale <= 0:
+            return 0
+        return (self.sent[after - 1] if after else self.opened) + delay/self.time_scale
+
+    def readline(self):
+        deadline = time.monotonic() + self.timeout
+        with self.cond:
+            while not self.closed:
+                due = self._due() if self.lines else None
+                now = time.monotonic()
+                if due is not None and due <= now:
+                    return self.lines.popleft()[2]
+                wait = deadline - now if due is None else min(due, deadline) - now
+                if wait <= 0:
+                    return b''
+                self.cond.wait(wait)
+        raise SerialException('Replay closed')
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+def line_flag(value):
+    # CLI value for DTR/RTS: -1 = leave to the driver, 0 = low, 1 = high
+    return None if value < 0 else value == 1
+
+# Serial ports scanned by discover_printers() and where fingerprints are kept
+PORT_PATTERNS = ('/dev/ttyACM*', '/dev/ttyUSB*')
+PORT_CACHE = os.path.join(os.path.expanduser('~'), '.mpmd_autocal_ports.json')
+OPERATOR_CACHE = os.path.join(os.path.expanduser('~'), '.mpmd_autocal_operators.json')
+FIRMWARE_NAMES = {0: 'stock', 1: 'Marlin4MPMD', 2: 'Odyssey'}
+
+def classify_firmware(m115, m503):
+    # firmFlag for an M115 reply and M503 dump: 0 = stock, 1 = Marlin4MPMD, 2 = Odyssey
+    if 'odyssey' in m115.lower():
+        return 2
+    if 'Marlin' in m115:
+        return 1
+    # Marlin builds without FIRMWARE_NAME still dump their delta settings
+    if not m115 and any(line.startswith('M665') for line in m503):
+        return 1
+    return 0
+
+def fingerprint_link(link, m115=None, timeout=2):
+    # Ask an open link for M115 (unless the readiness handshake already got
+    # it) and M503, and work out which firmware answered
+    if not m115:
+        link.write(b'M115\n')
+        m115 = link.wait_for(LINE_OTHER, b'FIRMWARE_NAME', timeout).decode(errors='replace').strip()
+    link.write(b'M503\n')
+    m503 = []
+    while True:
+        out = link.wait_for(LINE_SETTINGS, timeout=timeout)
+        if not out:
+            break
+        m503.append(out.decode(errors='replace').replace('echo:', '').strip())
+    link.drain(timeout)
+    firmFlag = classify_firmware(m115, m503)
+    return {'firmFlag': firmFlag, 'firmware': FIRMWARE_NAMES[firmFlag], 'm115': m115,
+            'm503': m503, 'updated': time.time()}
+
+def fingerprint_printer(port, **session_args):
+    session = PrinterSession(port, **session_args)
+    link = session.open()
+    if link is None:
+        return None
+    try:
+        if session.ready_timeout > 0 and session.ready is None:
+            return None
+        return fingerprint_link(link, session.ready.firmware if session.ready else None)
+    finally:
+        session.close()
+
+def load_port_cache(cache_file=PORT_CACHE):
+    try:
+        with open(cache_file) as data_file:
+            return json.load(data_file)
+    except (IOError, ValueError):
+        return {}
+
+def save_port_cache(cache, cache_file=PORT_CACHE):
+    with open(cache_file, 'w') as data_file:
+        json.dump(cache, data_file, indent=2, sort_keys=True)
+
+def update_port_cache(port, info, cache_file=PORT_CACHE):
+    cache = load_port_cache(cache_file)
+    cache.setdefault(port, {}).update(info)
+    save_port_cache(cache, cache_file)
+
+def load_operator_cache(cache_file=OPERATOR_CACHE):
+    # The contour operators only save time, a damaged file counts as empty
+    try:
+        with open(cache_file) as data_file:
+            cache = json.load(data_file)
+    except (IOError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+def load_operator(key, rows, points, cache_file=OPERATOR_CACHE):
+    # Cached weight matrix for key as a list of rows, None unless it is there
+    # with rows x points numbers
+    try:
+        weights = [[float(w) for w in row] for row in load_operator_cache(cache_file)[key]['weights']]
+    except (KeyError, TypeError, ValueError):
+        return None
+    if len(weights) != rows or any(len(row) != points for row in weights):
+        return None
+    return weights
+
+def save_operator(key, entry, cache_file=OPERATOR_CACHE):
+    # Add one operator to the cache file.  The file is replaced in one step,
+    # so a crash cannot leave half of it.  False if it could not be written.
+    cache = load_operator_cache(cache_file)
+    cache[key] = entry
+    temp_path = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+    try:
+        with open(temp_path, 'w') as data_file:
+            json.dump(cache, data_file, indent=2, sort_keys=True)
+        os.replace(temp_path, cache_file)
+    except IOError:
+        return False
+    return True
+
+# Everything the contour metrics need is linear in dz_list except the OR
+# median, so for a probe pattern and contour method they are a weight matrix:
+# one column per probe point, one row per CONTOUR_ROWS entry.  Both scripts
+# share the cache file and this version, so bump OPERATOR_VERSION whenever
+# contour_samples() in auto_cal_p5.py or contour_samples_p5() in
+# auto_cal_generic.py changes.
+CONTOUR_ROWS = ('TN', 'TW', 'TE', 'BowlCenter', 'ntower', 'wtower', 'etower') + tuple('OR{0}'.format(ii) for ii in range(12))
+OPERATOR_VERSION = 2
+
+def operator_key(method, x_list, y_list):
+    pattern = ' '.join('{0:.3f},{1:.3f}'.format(float(x), float(y)) for x, y in zip(x_list, y_list))
+    return '{0} v{1} {2}'.format(method, OPERATOR_VERSION, hashlib.sha1(pattern.encode()).hexdigest()[:16])
+
+def build_contour_operator(x_list, y_list, contour_rows):
+    # Column ii is contour_rows() for a unit height at probe point ii
+    columns = []
+    for ii in range(len(x_list)):
+        unit = [0.0]*len(x_list)
+        unit[ii] = 1.0
+        columns.append([float(w) for w in contour_rows(unit)])
+    return [list(row) for row in zip(*columns)]
+
+def cached_operator(method, x_list, y_list, contour_rows, cache_file=OPERATOR_CACHE, build=None):
+    # Weight matrix for this pattern and method as a list of rows, from the
+    # cache file or built and saved there.  build(x_list, y_list) can stand
+    # in for one contour_rows() call per probe point.
+    key = operator_key(method, x_list, y_list)
+    weights = load_operator(key, len(CONTOUR_ROWS), len(x_list), cache_file)
+    if weights is None:
+        # Built in memory also when the cache file is damaged or read-only
+        if build is not None:
+            weights = [[float(w) for w in row] for row in build(x_list, y_list)]
+        else:
+            weights = build_contour_operator(x_list, y_list, contour_rows)
+        entry = {'method': method, 'points': [[float(x), float(y)] for x, y in zip(x_list, y_list)],
+                 'rows': list(CONTOUR_ROWS), 'weights': weights}
+        if not save_operator(key, entry, cache_file):
+            print('Could not save the contour operator to ' + cache_file)
+    return weights
+
+# Heatmap (irow, icol) of the TN, TW, TE, BC and OR samples, in the order
+# contour_samples_p5() in auto_cal_generic.py and contour_samples() in
+# auto_cal_p5_v0.py list them
+P5_SAMPLE_CELLS = ([(9, 0), (8, 0), (9, 1), (10, 1), (8, 1)] +
+                   [(9, 12), (8, 12), (8, 11), (9, 11), (10, 11)] +
+                   [(0, 6), (0, 7), (0, 5), (1, 6), (1, 7), (1, 5)] +
+                   [(5, 6), (5, 7), (5, 5), (6, 6), (6, 7), (6, 5), (7, 6), (7, 7), (7, 5)] +
+                   [(3, 0), (6, 0), (9, 0), (3, 12), (6, 12), (9, 12), (0, 3), (0, 6), (0, 9), (12, 3), (12, 6), (12, 9)])
+
+def heatmap_p5_numpy(x_list, y_list, dz_list):
+    # Dennis's G29 P5 Heatmap as a 13 x 13 array, see contour_samples_p5() in
+    # auto_cal_generic.py.  Every [-] point only depends on [P] and [?]
+    # points, so each kind of point is filled for the whole grid at once.
+    # dz_list may also be a (sets, points) array, giving a (sets, 13, 13)
+    # array.
+    n = 13 # Number of rows/columns
+    xStart = -50.0 # icol = 0, x increases with icol
+    yStart = 50.0 # irow = 0, y decreases with irow
+    dprobe = 25.0 # Distance between known probe points
+    idprobe = 3 # probe point index increment
+    dx = dprobe/float(idprobe) # Distance Between adjacent heatmap points
+    dy = dx
+    
+    # x of every column, y of every row and the known columns/rows either side
+    index = np.arange(n)
+    xgrid = xStart + index.astype(float)*dx
+    ygrid = yStart - index.astype(float)*dy
+    lo = np.minimum(index - index%idprobe, n-1-idprobe)
+    hi = lo + idprobe
+    known = index[index%idprobe == 0]
+    unknown = index[index%idprobe != 0]
+    
+    # Probe points
+    dz = np.asarray(dz_list, dtype=float)
+    heatmap = np.full(dz.shape[:-1] + (n, n), np.nan)
+    irow = np.rint(np.abs(np.asarray(y_list, dtype=float) - yStart)/dy).astype(int)
+    icol = np.rint(np.abs(np.asarray(x_list, dtype=float) - xStart)/dx).astype(int)
+    heatmap[..., irow, icol] = dz
+    
+    # Corners, weighted average of the three nearest probe points
+    dd = math.sqrt(dprobe*dprobe + dprobe*dprobe)
+    w0 = (dprobe + 0.5*(dd-dprobe)) / (dprobe+dprobe+dd)
+    w2 = 1.0 - w0 - w0
+    crow = np.array([0, 0, n-1, n-1])
+    ccol = np.array([0, n-1, n-1, 0])
+    srow = np.where(crow == 0, idprobe, -idprobe)
+    scol = np.where(ccol == 0, idprobe, -idprobe)
+    heatmap[..., crow, ccol] = (w0*heatmap[..., crow+srow, ccol] + w0*heatmap[..., crow, ccol+scol] +
+                                w2*heatmap[..., crow+srow, ccol+scol])
+    
+    # Linear Interpolation - Horizontal
+    rows = known[:, None]
+    z0 = heatmap[..., rows, lo[unknown]]
+    z1 = heatmap[..., rows, hi[unknown]]
+    heatmap[..., rows, unknown] = z0 + (xgrid[unknown]-xgrid[lo[unknown]])*(z1-z0)/(xgrid[hi[unknown]]-xgrid[lo[unknown]])
+    
+    # Linear Interpolation - Vertical
+    rows = unknown[:, None]
+    z0 = heatmap[..., lo[rows], known]
+    z1 = heatmap[..., hi[rows], known]
+    heatmap[..., rows, known] = z0 + (ygrid[rows]-ygrid[lo[rows]])*(z1-z0)/(ygrid[hi[rows]]-ygrid[lo[rows]])
+    
+    # Bilinear Interpolation, (x1, y1) is the low x, low y corner
+    x = xgrid[unknown]
+    x1 = xgrid[lo[unknown]]
+    x2 = xgrid[hi[unknown]]
+    y = ygrid[rows]
+    y1 = ygrid[hi[rows]]
+    y2 = ygrid[lo[rows]]
+    q11 = heatmap[..., hi[rows], lo[unknown]]
+    q21 = heatmap[..., hi[rows], hi[unknown]]
+    q12 = heatmap[..., lo[rows], lo[unknown]]
+    q22 = heatmap[..., lo[rows], hi[unknown]]
+    heatmap[..., rows, unknown] = (q11 * (x2 - x) * (y2 - y) +
+                                   q21 * (x - x1) * (y2 - y) +
+                                   q12 * (x2 - x) * (y - y1) +
+                                   q22 * (x - x1) * (y - y1)
+                                  ) / ((x2 - x1) * (y2 - y1) + 0.0)
+    
+    return heatmap
+
+def discover_printers(cache_file=PORT_CACHE, patterns=PORT_PATTERNS, **session_args):
+    # Fingerprint every matching port at once, each on its own thread, since
+    # most of the time goes into waiting for boards to boot and answer
+    ports = sorted(set(name for pattern in patterns for name in glob.glob(pattern)))
+    found = {}
+    def scan(port):
+        info = fingerprint_printer(port, **session_args)
+        if info is not None:
+            found[port] = info
+    threads = [threading.Thread(target=scan, args=(port,)) for port in ports]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for port, info in found.items():
+        update_port_cache(port, info, cache_file)
+    return found
+
+def print_discovered(found):
+    if not found:
+        print ('No printers found on {0}'.format(', '.join(PORT_PATTERNS)))
+    for port in sorted(found):
+        info = found[port]
+        print ('{0}: {1} firmware (-ff {2}) {3}'.format(port, info['firmware'], str(info['firmFlag']), info['m115']))
+    print ('')
+
+def cached_firmware(session, cache_file=PORT_CACHE):
+    # firmFlag for the session's port, fingerprinting the open link if the
+    # port has not been seen before
+    cache = load_port_cache(cache_file)
+    info = cache.get(session.port)
+    if info is None or 'firmFlag' not in info:
+        info = fingerprint_link(session.open(), session.ready.firmware if session.ready else None)
+        update_port_cache(session.port, info, cache_file)
+    return int(info['firmFlag'])
+
+BAUD_RATES = (250000, 230400, 115200)
+
+def baud_self_test(link, burst=20, timeout=5):
+    # Send a burst of M118 echoes with ok counting and check that every one
+    # is acknowledged without errors.  Returns the line rate in bytes/s, or
+    # None when the firmware did not understand us at this baud rate.
+    window = link.window
+    link.window = window or 4
+    errors = len(link.queues[LINE_ERROR])
+    lines = ['M118 E1 baudtest {0}\n'.format(ii).encode() for ii in range(burst)]
+    try:
+        start = time.monotonic()
+        for line in lines:
+            link.write(line)
+        if not link.drain(timeout):
+            return None
+        elapsed = time.monotonic() - start
+    finally:
+        link.window = window
+    echoes = 0
+    while link.wait_for(LINE_OTHER, b'baudtest', timeout=0):
+        echoes += 1
+    # Firmware without M118 only acknowledges, otherwise every echo must arrive
+    if len(link.queues[LINE_ERROR]) > errors or echoes not in (0, burst):
+        return None
+    return sum(len(line) for line in lines) / max(elapsed, 1e-6)
+
+def negotiate_baud(port, rates=BAUD_RATES, cache_file=PORT_CACHE, **session_args):
+    # Try the rates from fastest to slowest and keep the first one that
+    # passes baud_self_test().  The session at that rate is left open and
+    # returned with the measured line rate, and the rate is cached per port.
+    # A wrong rate never answers M115, so do not wait the full ready timeout.
+    session_args['ready_timeout'] = min(session_args.get('ready_timeout') or 10, 10)
+    for speed in sorted(rates, reverse=True):
+        print ('Trying {0} baud'.format(str(speed)))
+        session = PrinterSession(port, speed=speed, **session_args)
+        link = session.open()
+        if link is None:
+            continue
+        throughput = baud_self_test(link) if session.ready is not None else None
+        if throughput is None:
+            session.close()
+            continue
+        update_port_cache(port, {'baud': speed, 'throughput': throughput}, cache_file)
+        return session, throughput
+    return None, None
+
+def get_points(port):
+    # wait_for() only comes back empty once the connection is gone
+    out = port.wait_for(LINE_PROBE)
+    if not out:
+        sys.exit('Lost connection to printer while probing')
+    probe = parse_probe(out)
+    if probe is None:
+        sys.exit('Unreadable probe result: {0}'.format(out.decode(errors='replace').strip()))
+    return probe
+
+def report_timing(session, timing_json=None, profile=None, trace=None):
+    session.timer.report()
+    session.latency.report(session.timeout)
+    if timing_json:
+        session.timer.save(timing_json, latency=session.latency.summary())
+        print ('Phase timings and command latency written to {0}'.format(timing_json))
+    if trace:
+        session.timer.save_trace(trace)
+        print ('Trace written to {0}, open it in https://ui.perfetto.dev or chrome://tracing'.format(trace))
+    if profile:
+        session.timer.dump_profile(profile)
+        print ('Profile written to {0}, read it with python3 -m pstats {0}'.format(profile))
+
+def metric_labels(labels):
+    # {port="/dev/ttyACM0",firmware="Marlin4MPMD"} with the values escaped
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{0}="{1}"'.format(k, escape(v)) for k, v in labels) + '}'
+
+# The reason label of mpmd_autocal_failed has to stay a small fixed set for
+# Prometheus, the full failure message goes to the console and the -eta log
+FAILURE_LABELS = {'Could not open the port': 'port',
+                  'Lost connection to printer while probing': 'port',
+                  'Too many calibration attempts': 'max_runs'}
+
+def failure_label(reason):
+    # port, timeout, max_runs or error for a sys.exit() message or a
+    # "ExceptionType: message" string
+    if reason in FAILURE_LABELS:
+        return FAILURE_LABELS[reason]
+    kind = reason.split(':')[0]
+    if 'Timeout' in kind:
+        return 'timeout'
+    if kind in ('SerialException', 'PortNotOpenError', 'OSError', 'BrokenPipeError'):
+        return 'port'
+    return 'error'
+
+def write_metrics(path, session, firmware, pattern, calibrated, reason=''):
+    # node_exporter textfile collector format.  The file is replaced in one
+    # step so the collector never reads half of it.
+    labels = [('port', session.port), ('firmware', firmware), ('pattern', pattern)]
+    if calibrated:
+        reason = ''
+    elif session.link is not None and session.link.closed:
+        reason = 'port'
+    else:
+        reason = failure_label(reason)
+    timer = session.timer
+    metrics = [
+        ('calibrated', 'gauge', '1 if the calibration finished within the error limits', [([], int(bool(calibrated)))]),
+        ('passes', 'gauge', 'Calibration passes (G33 runs) used', [([], len([l for l in timer.labels if l != 'setup']))]),
+        ('session_seconds', 'gauge', 'Wall clock length of the session', [([], timer.totals()[2])]),
+        ('probes', 'gauge', 'Probe results the printer reported', [([], timer.probes)]),
+        ('commands_lost', 'gauge', 'Commands without an ok within their deadline',
+         [([], sum(entry['lost'] for entry in session.latency.codes.values()))]),
+        ('last_run_timestamp_seconds', 'gauge', 'Unix time the session ended', [([], time.time())]),
+        ('failed', 'gauge', '1 if the calibration stopped without finishing, reason is port, timeout, max_runs or error', [([('reason', reason)], int(not calibrated))]),
+    ]
+    errors = timer.values.get('error', {})
+    if errors:
+        metrics.append(('error_mm', 'gauge', 'Errors of the last pass (determine_error)',
+                        [([('axis', axis)], errors[axis]) for axis in sorted(errors)]))
+    if 'std dev' in timer.values:
+        metrics.append(('g33_std_dev_mm', 'gauge', 'Standard deviation reported by the last G33', [([], timer.values['std dev']['std_dev'])]))
+    # What the printer was last told, from the settings shadow
+    settings = {}
+    if session.link is not None:
+        with session.link.shadow.lock:
+            settings = dict((code, dict(values)) for code, values in session.link.shadow.values.items())
+    for code, name, text in (('M666', 'm666', 'Endstop offsets sent with M666'), ('M665', 'm665', 'Delta settings sent with M665')):
+        if settings.get(code):
+            metrics.append((name, 'gauge', text, [([('param', p)], v) for p, v in sorted(settings[code].items())]))
+    lines = []
+    for name, kind, text, samples in metrics:
+        lines.append('# HELP mpmd_autocal_{0} {1}'.format(name, text))
+        lines.append('# TYPE mpmd_autocal_{0} {1}'.format(name, kind))
+        for extra, value in samples:
+            lines.append('mpmd_autocal_{0}{1} {2}'.format(name, metric_labels(labels + extra), repr(float(value))))
+    temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'w') as metrics_file:
+        metrics_file.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
@@ -5,42 +5,16 @@
 # This script is kind of a sandbox right now.
 # https://github.com/PurpleHullPeas/MPMD-AutoBedLevel-Cal
 
-from serial import Serial, SerialException, PARITY_ODD, PARITY_NONE
 import sys
 import argparse
 import math
 import os
+from auto_cal_common import (PrinterSession, parse_G33, LINE_PROBE, LINE_ERROR, LINE_SETTINGS, LINE_OTHER, line_flag,
+                             PORT_CACHE, FIRMWARE_NAMES, BAUD_RATES, load_port_cache,
+                             OPERATOR_CACHE, operator_key, cached_operator, np, P5_SAMPLE_CELLS, heatmap_p5_numpy,
+                             discover_printers, print_discovered, cached_firmware, negotiate_baud, get_points,
+                             report_timing, write_metrics)
 
-# -----------------------------------------------------------------------------
-# Get Serial Connection
-# -----------------------------------------------------------------------------
-
-def establish_serial_connection(port, speed=115200, timeout=10, writeTimeout=10000):
-    # Hack for USB connection
-    # There must be a way to do it cleaner, but I can't seem to find it
-    try:
-        temp = Serial(port, speed, timeout=timeout, writeTimeout=writeTimeout, parity=PARITY_ODD)
-        if sys.platform == 'win32':
-            temp.close()
-        conn = Serial(port, speed, timeout=timeout, writeTimeout=writeTimeout, parity=PARITY_NONE)
-        conn.setRTS(False)#needed on mac
-        if sys.platform != 'win32':
-            temp.close()
-        return conn
-    except SerialException as e:
-        print ("Could not connect to {0} at baudrate {1}\nSerial error: {2}".format(port, str(speed), e))
-        return None
-    except IOError as e:
-        print ("Could not connect to {0} at baudrate {1}\nIO error: {2}".format(port, str(speed), e))
-        return None
-
-def get_points(port):
-    while True:
-        out = port.readline().decode()
-        if 'Bed ' in out:
-            break
-
-    return out.split(' ')
 
 # -----------------------------------------------------------------------------
 # Generic Math Functions
@@ -244,7 +218,7 @@ def output_odyssey_BEDLEVEL_TXT(port):
     
     # Clear old data
     while True:
-        out = port.readline().decode()
+        out = port.wait_for((LINE_PROBE, LINE_OTHER)).decode()
         #print("{0}\n".format(out))
         if 'G29 Auto Bed Leveling' in out:
             break
@@ -254,14 +228,14 @@ def output_odyssey_BEDLEVEL_TXT(port):
     file_object.write(out) 
             
     while True:
-        out = port.readline().decode()
+        out = port.wait_for((LINE_PROBE, LINE_OTHER)).decode()
         #print("{0}\n".format(out))
         if 'Bed X:' in out: 
             file_object.write(out) 
         elif 'Leveling Grid' in out:
             file_object.write(out) 
             for ii in range(8): 
-                out = port.readline().decode()
+                out = port.next_line().decode()
                 file_object.write(out) 
             break
 
@@ -280,7 +254,7 @@ def output_odyssey_M503(port):
     
     # Clear old data
     while True:
-        out = port.readline().decode()
+        out = port.wait_for(LINE_SETTINGS).decode()
         #print("{0}\n".format(out))
         if 'Steps per unit' in out:
             break
@@ -293,16 +267,21 @@ def output_odyssey_M503(port):
         file_object.write(out) 
         if 'M851' in out:
             break
-        out = port.readline().decode()
+        out = port.wait_for(LINE_SETTINGS).decode()
         
 def get_M503_text(port): 
 
+    # Current values from the settings shadow once it has read the printer,
+    # unless verifying the printer
+    if not port.shadow.verify and port.shadow.loaded and port.shadow.has('M92', 'M666', 'M665'):
+        return port.shadow.line('M92'), port.shadow.line('M666'), port.shadow.line('M665')
+
     # Send M503
     port.write(('M503 ;\n').encode())
 
     # Clear old data
     while True:
-        out = port.readline().decode()
+        out = port.wait_for(LINE_SETTINGS).decode()
         #print("{0}\n".format(out))
         if 'Steps per unit' in out:
             break
@@ -315,7 +294,7 @@ def get_M503_text(port):
     M665_line = ""
     count = 0
     while count < 3:
-        out = port.readline().decode()
+        out = port.wait_for(LINE_SETTINGS).decode()
         #print("{0}\n".format(out))
         if 'M92' in out:
             count = count + 1
@@ -329,11 +308,8 @@ def get_M503_text(port):
             break
             
     # Clear remaining data
-    while True:
-        out = port.readline().decode()
-        #print("{0}\n".format(out))
-        if 'M851' in out:
-            break
+    port.wait_for(LINE_SETTINGS, b'M851')
+    port.shadow.loaded = True
     
     return M92_line, M666_line, M665_line
     
@@ -362,16 +338,12 @@ def output_M421(port):
     port.write(('M421 ;\n').encode())
     
     # Clear port data until we reach M421
-    while True:
-        out = port.readline().decode()
-        #print("{0}\n".format(out))
-        if 'Grid spacing' in out:
-            break
+    out = port.wait_for((LINE_SETTINGS, LINE_OTHER), b'Grid spacing').decode()
             
     # Write Data to the text file
     file_object.write(out) 
     for ii in range(len(M421_Data)): 
-        out = port.readline().decode()
+        out = port.next_line().decode()
         file_object.write(out) 
         
     return
@@ -567,68 +539,82 @@ def get_current_values(port, firmFlag, calibration_pattern):
             y_list[ii] = y_tmp
             theta = theta + dtheta
 
-    # Send Gcodes
-    port.write(('G28\n').encode()) # Home
-    
-    if firmFlag == 1: 
-        # Marlin
-        port.write(('G1 Z15 F6000\n').encode()) # Move to safe distance
-    else:
-        # Stock Firmware
-        if calibration_pattern == 5:
-            port.write(('G29 P5 V4\n').encode())
-        else: 
-            port.write(('G29 P2 V4\n').encode())
+    # Pipelined Marlin: queue every move and probe up front. The port only
+    # blocks when the printer's command buffer is full, so the Bed lines
+    # stream back while later commands are still being sent.
+    pipelined = firmFlag == 1 and port.window > 0
 
-        while True:
-            out = port.readline().decode()
-            #print("{0}\n".format(out))
-            if 'G29 Auto Bed Leveling' in out:
-                break
-        
-    # Loop through all 
-    for ii in range(len(x_list)):
+    # Send Gcodes
+    with port.timer.phase('homing'):
+        port.write(('G28\n').encode()) # Home
         
         if firmFlag == 1: 
             # Marlin
-            
-            # Move to desired position
-            port.write(('G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii])).encode()) 
-            #print('Sending G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii]))
-            
-            # Probe Z values
-            port.write(('G30\n').encode())
-            z_axis_1 = get_points(port)
-            #print(z_axis_1)
-            port.write(('G30\n').encode())
-            z_axis_2 = get_points(port)
-            #print(z_axis_2)
+            port.write(('G1 Z15 F6000\n').encode()) # Move to safe distance
+            # Pipelined homing is timed with the probing, waiting here would
+            # empty the command buffer
+            if not pipelined:
+                port.drain()
         else:
             # Stock Firmware
-            z_axis_1 = get_points(port)
-            z_axis_2 = get_points(port)
+            if calibration_pattern == 5:
+                port.write(('G29 P5 V4\n').encode())
+            else: 
+                port.write(('G29 P2 V4\n').encode())
+            port.wait_for(LINE_OTHER, b'G29 Auto Bed Leveling')
         
-        # Populate most of the table values
-        z1_list[ii] = float(z_axis_1[6])
-        #print(z1_list[ii])
-        z2_list[ii] = float(z_axis_2[6])
-        #print(z2_list[ii])
-        z_avg_list[ii] = float("{0:.4f}".format((z1_list[ii] + z2_list[ii]) / 2.0))
-        dtap_list[ii] = z2_list[ii] - z1_list[ii]
-        #print('Received: X:{0} X:{1} Y:{2} Y:{3} Z1:{4} Z2:{5}\n\n'.format(str(x_list[ii]), str(z_axis_1[2]), str(y_list[ii]), str(z_axis_1[4]), z1_list[ii], z2_list[ii]))
-    
+    with port.timer.phase('probing'):
+        if pipelined:
+            for ii in range(len(x_list)):
+                port.write(('G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii])).encode()) 
+                port.write(('G30\n').encode())
+                port.write(('G30\n').encode())
+
+        # Loop through all 
+        for ii in range(len(x_list)):
+        
+            if pipelined:
+                z_axis_1 = get_points(port)
+                z_axis_2 = get_points(port)
+            elif firmFlag == 1: 
+                # Marlin
+            
+                # Move to desired position
+                port.write(('G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii])).encode()) 
+                #print('Sending G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii]))
+            
+                # Probe Z values
+                port.write(('G30\n').encode())
+                z_axis_1 = get_points(port)
+                #print(z_axis_1)
+                port.write(('G30\n').encode())
+                z_axis_2 = get_points(port)
+                #print(z_axis_2)
+            else:
+                # Stock Firmware
+                z_axis_1 = get_points(port)
+                z_axis_2 = get_points(port)
+        
+            # Populate most of the table values
+            z1_list[ii] = z_axis_1.z
+            #print(z1_list[ii])
+            z2_list[ii] = z_axis_2.z
+            #print(z2_list[ii])
+            z_avg_list[ii] = float("{0:.4f}".format((z1_list[ii] + z2_list[ii]) / 2.0))
+            dtap_list[ii] = z2_list[ii] - z1_list[ii]
+            #print('Received: X:{0} X:{1} Y:{2} Y:{3} Z1:{4} Z2:{5}\n\n'.format(str(x_list[ii]), str(z_axis_1[2]), str(y_list[ii]), str(z_axis_1[4]), z1_list[ii], z2_list[ii]))
+
+        # Let the stock firmware finish G29 before sending anything else
+        if firmFlag == 0: 
+            port.drain()
+
     # Find the Median Reference
     z_med = median(z_avg_list)
     
     # Calculate z diff
     for ii in range(len(x_list)):
         dz_list[ii] = z_avg_list[ii] - z_med
-        
-    # Empty out remaining lines for stock firmware
-    if firmFlag == 0: 
-        for ii in range(6):
-            out = port.readline().decode()
-    
+
     return x_list, y_list, z1_list, z2_list, z_avg_list, dtap_list, dz_list
 
 def calculate_contour_experimental(dz_list, tower_flag, calibration_pattern):
@@ -699,7 +685,8 @@ def findProbePoints(ii, idprobe, n):
     
     return ip1, ip2, ip3
     
-def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
+def contour_samples_p5(x_list, y_list, dz_list):
+    # The 37 heatmap values the tower and bowl metrics are taken from
     
     # Dennis's G29 P5 Heatmap
     # [ ],[?] = outside of circular bed area
@@ -764,7 +751,6 @@ def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
     extrapFlag = 0 # 0 = Weighted Average, 1 = Linear Extrapolation
     zvals = [0.0, 0.0, 0.0]
     dd = math.sqrt(dprobe*dprobe + dprobe*dprobe) # Diagonal distance from [?] to known point
-    d_test = math.sqrt(dx*dx+dy*dy)
     #
     # Weighted Average Values
     dnorm = dprobe+dprobe+dd # Normalizing factor
@@ -827,7 +813,6 @@ def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
     zvals[0] = heatmap[irow-idprobe][icol]
     zvals[1] = heatmap[irow][icol-idprobe]
     zvals[2] = heatmap[irow-idprobe][icol-idprobe]
-    test_y = linear_interp(0.0, dd, zvals[0], zvals[1], d_test)
     if extrapFlag == 0: 
         heatmap[irow][icol] = w[0]*zvals[0] + w[1]*zvals[1] + w[2]*zvals[2]
     elif extrapFlag == 1: 
@@ -843,7 +828,6 @@ def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
     zvals[0] = heatmap[irow-idprobe][icol]
     zvals[1] = heatmap[irow][icol+idprobe]
     zvals[2] = heatmap[irow-idprobe][icol+idprobe]
-    test_x = linear_interp(0.0, dd, zvals[0], zvals[1], d_test)
     if extrapFlag == 0: 
         heatmap[irow][icol] = w[0]*zvals[0] + w[1]*zvals[1] + w[2]*zvals[2]
     elif extrapFlag == 1: 
@@ -933,41 +917,34 @@ def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
     x0 = xmin
     y0 = ymin/2.0
     irow, icol = gridval2idx(x0, y0, xStart, yStart, dx, dy)
-    ntower = heatmap[irow][icol]
     TN_list = [None]*5
     TN_list[0] = heatmap[irow][icol]
     TN_list[1] = heatmap[irow-1][icol]
     TN_list[2] = heatmap[irow][icol+1]
     TN_list[3] = heatmap[irow+1][icol+1]
-    TN_list[3] = test_x #DEBUGGING
     TN_list[4] = heatmap[irow-1][icol+1]
     #print("TN Values\n")
     #print(*TN_list, sep='\n\n')
     #print("\n")
-    TN = float(mean(TN_list))
     
     # West Tilt (left of LCD)
     x0 = xmax
     y0 = ymin/2
     irow, icol = gridval2idx(x0, y0, xStart, yStart, dx, dy)
-    wtower = heatmap[irow][icol]
     TW_list = [None]*5
     TW_list[0] = heatmap[irow][icol]
     TW_list[1] = heatmap[irow-1][icol]
     TW_list[2] = heatmap[irow-1][icol-1]
     TW_list[3] = heatmap[irow][icol-1]
     TW_list[4] = heatmap[irow+1][icol-1]
-    TW_list[4] = test_y #DEBUGGING
     #print("TW Values\n")
     #print(*TW_list, sep='\n\n')
     #print("\n")
-    TW = float(mean(TW_list))
     
     # East Tilt (right of LCD)
     x0 = 0.0
     y0 = ymax
     irow, icol = gridval2idx(x0, y0, xStart, yStart, dx, dy)
-    etower = heatmap[irow][icol]
     TE_list = [None]*6
     TE_list[0] = heatmap[irow][icol]
     TE_list[1] = heatmap[irow][icol+1]
@@ -978,7 +955,6 @@ def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
     #print("TE Values\n")
     #print(*TE_list, sep='\n\n')
     #print("\n")
-    TE = float(mean(TE_list))
     
     # Bowl Stats - Center
     x0 = 0.0
@@ -997,7 +973,6 @@ def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
     #print("Bowl Center: \n")
     #print(*BC_list, sep='\n\n')
     #print("\n")
-    BowlCenter = float(mean(BC_list))
     
     # Bowl Stats - Outside Ring
     OR_list = [None]*12
@@ -1021,12 +996,56 @@ def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
     OR_list[9]  = heatmap[irow][icol-idprobe]
     OR_list[10]  = heatmap[irow][icol]
     OR_list[11]  = heatmap[irow][icol+idprobe]
-    #
-    BowlOR = float(median(OR_list))
     #print("Outer Ring Values: \n")
     #print(*OR_list, sep='\n\n')
     #print("\n")
-    #print("BowlOR = {0:.4f}".format(BowlOR))
+
+    return TN_list + TW_list + TE_list + BC_list + OR_list
+
+def contour_rows_p5(samples):
+    # Tower and bowl rows from the heatmap samples, BowlOR is the median of the OR rows
+    TN_list = samples[0:5]
+    TW_list = samples[5:10]
+    TE_list = samples[10:16]
+    BC_list = samples[16:25]
+    OR_list = samples[25:37]
+    
+    # Tower heights are the first sample of each tower
+    return [mean(TN_list), mean(TW_list), mean(TE_list), mean(BC_list),
+            TN_list[0], TW_list[0], TE_list[0]] + OR_list
+
+# calculate_contour_p5() is one product with the weight matrix of the probe
+# pattern, see CONTOUR_ROWS in auto_cal_common.py
+contour_operators = {}
+
+def build_contour_operator_p5(x_list, y_list):
+    # Every column at once: the heatmaps of a unit height at each probe point
+    # stacked into one array
+    rows, cols = zip(*P5_SAMPLE_CELLS)
+    samples = heatmap_p5_numpy(x_list, y_list, np.eye(len(x_list)))[:, list(rows), list(cols)]
+    columns = [contour_rows_p5(column) for column in samples.tolist()]
+    return [list(row) for row in zip(*columns)]
+
+def contour_operator(x_list, y_list, cache_file=OPERATOR_CACHE):
+    # Weight matrix for this pattern, from memory, the cache file or built
+    # (with numpy when it is installed)
+    key = operator_key('generic-p5', x_list, y_list)
+    if key not in contour_operators:
+        contour_operators[key] = cached_operator('generic-p5', x_list, y_list, lambda dz_list:
+            contour_rows_p5(contour_samples_p5(x_list, y_list, dz_list)), cache_file,
+            build_contour_operator_p5 if np is not None else None)
+    return contour_operators[key]
+
+def apply_contour_operator(weights, dz_list):
+    # TN, TW, TE, BowlCenter, ntower, wtower, etower, BowlOR for one probe set
+    rows = [sum(w*float(dz) for w, dz in zip(row, dz_list)) for row in weights]
+    return tuple(rows[:7]) + (float(median(rows[7:])),)
+
+def calculate_contour_p5(x_list, y_list, dz_list, tower_flag):
+    
+    # One product with the precompiled operator for this pattern
+    weights = contour_operator(x_list, y_list)
+    TN, TW, TE, BowlCenter, ntower, wtower, etower, BowlOR = apply_contour_operator(weights, dz_list)
 
     # Rotate the towers according to M665 X Y Z
     TX, TY, TZ, xtower, ytower, ztower = rotate_tower_values(TN, TW, TE, ntower, wtower, etower, tower_flag)
@@ -1144,7 +1163,8 @@ def calibrate(port, z_error, x_error, y_error, c_error, trial_x, trial_y, trial_
     if calibrated:
         print ("Final values\nM666 Z{0} X{1} Y{2} \nM665 L{3} R{4}".format(str(new_z),str(new_x),str(new_y),str(new_l),str(new_r)))
     else:
-        set_M_values(port, new_z, new_x, new_y, new_l, new_r)
+        with port.timer.phase('settings'):
+            set_M_values(port, new_z, new_x, new_y, new_l, new_r)
 
     return calibrated, new_z, new_x, new_y, new_l, new_r
 
@@ -1153,9 +1173,11 @@ def set_M_values(port, z, x, y, l, r):
     print ("Setting values M666 X{0} Y{1} Z{2}, M665 L{3} R{4}".format(str(x),str(y),str(z),str(l),str(r)))
 
     port.write(('M666 X{0} Y{1} Z{2}\n'.format(str(x), str(y), str(z))).encode())
-    out = port.readline().decode()
+    if port.window == 0:
+        port.drain()
     port.write(('M665 L{0} R{1}\n'.format(str(l),str(r))).encode())
-    out = port.readline().decode()
+    if port.window == 0:
+        port.drain()
     
     return
 
@@ -1165,34 +1187,45 @@ def run_calibration(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value,
     if runs > max_runs:
         sys.exit("Too many calibration attempts")
     print('\nCalibration pass {1}, run {2} out of {0}'.format(str(max_runs), str(runs-1), str(runs)))
+    port.timer.next_pass('pass {0}'.format(str(runs-1)))
+    if runs == 1:
+        port.timer.eta.new_calibration()
     
-    # Make sure the bed doesn't go cold
-    if bed_temp >= 0: 
-        port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
+    with port.timer.phase('heating'):
+        # Make sure the bed doesn't go cold
+        if bed_temp >= 0: 
+            port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
 
-    # Make sure the hotend doesn't go cold
-    if hotend_temp >= 0: 
-        port.write('M109 S{0}\n'.format(str(hotend_temp)).encode())
+        # Make sure the hotend doesn't go cold
+        if hotend_temp >= 0: 
+            port.write('M109 S{0}\n'.format(str(hotend_temp)).encode())
+            port.drain()
     
     # Read G30 or G29 probe values
     x_list, y_list, z1_list, z2_list, z_avg_list, dtap_list, dz_list = get_current_values(port, firmFlag, calibration_pattern)
     
-    if calibration_pattern == 5: 
-        # Generate the P5 contour map
-        TX, TY, TZ, xtower, ytower, ztower, BowlCenter, BowlOR = calculate_contour_p5(x_list, y_list, dz_list, tower_flag)
-    else: 
-        # Either P2 or Experimental Calibration
-        TX, TY, TZ, xtower, ytower, ztower, BowlCenter, BowlOR = calculate_contour_experimental(dz_list, tower_flag, calibration_pattern)
+    with port.timer.phase('contour', compute=True):
+        if calibration_pattern == 5: 
+            # Generate the P5 contour map
+            TX, TY, TZ, xtower, ytower, ztower, BowlCenter, BowlOR = calculate_contour_p5(x_list, y_list, dz_list, tower_flag)
+        else: 
+            # Either P2 or Experimental Calibration
+            TX, TY, TZ, xtower, ytower, ztower, BowlCenter, BowlOR = calculate_contour_experimental(dz_list, tower_flag, calibration_pattern)
 
-    # Determine the highest tower
-    iHighTower, THigh = determine_high_tower(xtower, ytower, ztower, TX, TY, TZ, iHighTower)
+    with port.timer.phase('calibrate', compute=True):
+        # Determine the highest tower
+        iHighTower, THigh = determine_high_tower(xtower, ytower, ztower, TX, TY, TZ, iHighTower)
     
     # Output current pass results
     if calibration_pattern == 5: 
-        output_pass_text_p5(runs, port, x_list, y_list, z1_list, z2_list)
+        with port.timer.phase('output'):
+            output_pass_text_p5(runs, port, x_list, y_list, z1_list, z2_list)
     
     # Calculate Error
-    z_error, x_error, y_error, c_error = determine_error(TX, TY, TZ, THigh, BowlCenter, BowlOR)
+    with port.timer.phase('calibrate', compute=True):
+        z_error, x_error, y_error, c_error = determine_error(TX, TY, TZ, THigh, BowlCenter, BowlOR)
+    port.timer.counter('error', x=x_error, y=y_error, z=z_error, c=c_error)
+    port.timer.eta.report(*port.timer.eta.update([z_error, x_error, y_error, c_error], max_runs - runs))
     
     if abs(max([z_error, x_error, y_error, c_error], key=abs)) > max_error and runs > 1:
         sys.exit("Calibration error on non-first run exceeds set limit")
@@ -1234,66 +1267,77 @@ def run_G33(port, max_runs, bed_temp, hotend_temp, r_value, l_value, Lratio, cal
     L_old = l_value
     L_new = l_value
         
+    port.timer.eta.new_calibration()
     for ii in range(max_runs): 
+        port.timer.next_pass('run {0}'.format(str(ii)))
     
         # Calculate M665 L
         L_new = float("{0:.4f}".format(Lratio*(R_new-R_old) + L_old))
         R_old = R_new # Set for next iteration
-        port.write(('M665 L{0}\n'.format(str(L_new))).encode())
-    
-        # Make sure the bed doesn't go cold
-        if bed_temp >= 0: 
-            port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
-
-        # Make sure the hotend doesn't go cold
-        if hotend_temp >= 0: 
-            port.write('M109 S{0}\n'.format(str(hotend_temp)).encode())
+        with port.timer.phase('settings'):
+            port.write(('M665 L{0}\n'.format(str(L_new))).encode())
+    
+        with port.timer.phase('heating'):
+            # Make sure the bed doesn't go cold
+            if bed_temp >= 0: 
+                port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
+
+            # Make sure the hotend doesn't go cold
+            if hotend_temp >= 0: 
+                port.write('M109 S{0}\n'.format(str(hotend_temp)).encode())
+                port.drain()
         
         # Run G33
         tower_text = '' # Rotate towers by default
         if tower_flag == 0: 
             tower_text = 'T' # Do not rotate the towers
-        port.write('G33 C{0} V3 P{1} {2}\n'.format(str(G33_C_tmp),str(G33_P),str(tower_text)).encode())
-
-        # Extract Data
-        while True:
-            out = port.readline().decode()
-            #print(out)
-            if 'Save with M500' in out:
-                break
-            elif ('std dev' in out or 'rolling back' in out): 
-                # Parse standard deviation
-                if 'std dev' in out: 
-                    std_dev = parse_G33(out, 'dev:')
-                else: 
-                    std_dev = std_dev_best - 0.00001
-                # Parse M666 XYZ and M665 RH
-                out = port.readline().decode()
-                Height = parse_G33(out, 'Height:')
-                Ex = parse_G33(out, 'Ex:')
-                Ey = parse_G33(out, 'Ey:')
-                Ez = parse_G33(out, 'Ez:')
-                Radius = parse_G33(out, 'Radius:')
-                # Parse M665 XYZ
-                if tower_flag > 0: 
-                    out = port.readline().decode()
-                    Tx = parse_G33(out, 'Tx:')
-                    Ty = parse_G33(out, 'Ty:')
-                    Tz = parse_G33(out, 'Tz:')
-                else: 
-                    Tx = 0.0
-                    Ty = 0.0
-                    Tz = 0.0
-            elif 'Correct delta settings with M665 and M666' in out: 
-                print('Firmware reported a G33 problem: ')
-                print('Correct delta settings with M665 and M666')
-                return False
+        with port.timer.phase('G33'):
+            port.write('G33 C{0} V3 P{1} {2}\n'.format(str(G33_C_tmp),str(G33_P),str(tower_text)).encode())
+
+            # Extract Data
+            while True:
+                raw = port.wait_for((LINE_OTHER, LINE_ERROR))
+                out = raw.decode()
+                #print(out)
+                if 'Save with M500' in out:
+                    break
+                elif ('std dev' in out or 'rolling back' in out): 
+                    # Parse standard deviation
+                    if 'std dev' in out: 
+                        std_dev = parse_G33(raw).std_dev
+                    else: 
+                        std_dev = std_dev_best - 0.00001
+                    # Parse M666 XYZ and M665 RH
+                    values = parse_G33(port.wait_for(LINE_OTHER))
+                    Height = values.height
+                    Ex = values.ex
+                    Ey = values.ey
+                    Ez = values.ez
+                    Radius = values.radius
+                    # Parse M665 XYZ
+                    if tower_flag > 0: 
+                        values = parse_G33(port.wait_for(LINE_OTHER))
+                        Tx = values.tx
+                        Ty = values.ty
+                        Tz = values.tz
+                    else: 
+                        Tx = 0.0
+                        Ty = 0.0
+                        Tz = 0.0
+                elif 'Correct delta settings with M665 and M666' in out: 
+                    print('Firmware reported a G33 problem: ')
+                    print('Correct delta settings with M665 and M666')
+                    return False
         
         # Set for next iteration
         R_new = Radius
+        port.timer.counter('std dev', std_dev=std_dev)
+        # The loop below never stops before run 3, then stops once the best result repeats
+        port.timer.eta.report(*port.timer.eta.update([std_dev], max_runs - ii - 1, G33_C_Final, at_least=max(3 - ii, 0), stall=1))
         
         # Save data to memory and display to terminal
-        G33_SetData(port, Ex, Ey, Ez, Tx, Ty, Tz, Height, Radius, L_new, std_dev, tower_flag, ii)
+        with port.timer.phase('settings'):
+            G33_SetData(port, Ex, Ey, Ez, Tx, Ty, Tz, Height, Radius, L_new, std_dev, tower_flag, ii)
         
         # Save best results
         if (std_dev <= std_dev_best): 
@@ -1330,36 +1374,25 @@ def run_G33(port, max_runs, bed_temp, hotend_temp, r_value, l_value, Lratio, cal
             
     # Save the best results
     print('\n\nFinal Results: \n')
-    G33_SetData(port, Ex_best, Ey_best, Ez_best, Tx_best, Ty_best, Tz_best, Height_best, Radius_best, L_best, std_dev_best, tower_flag, ii)
+    with port.timer.phase('settings'):
+        G33_SetData(port, Ex_best, Ey_best, Ez_best, Tx_best, Ty_best, Tz_best, Height_best, Radius_best, L_best, std_dev_best, tower_flag, ii)
 
     return True
     
-def parse_G33(input_str, pattern): 
-    #print(input_str)
-    str_split = input_str.split(' ')
-    for ii in range(len(str_split)): 
-        #print('{0}: {1}\n'.format(str(ii),str(str_split[ii])))
-        if pattern in str_split[ii]: 
-            new_split = str_split[ii].split(':')
-            output = float(new_split[1])
-            break
-            
-    return output
-        
 def G33_SetData(port, Ex, Ey, Ez, Tx, Ty, Tz, Height, Radius, L_new, std_dev, tower_flag, ii): 
     temp = '\nrun {0}\n\nstd dev = {1}\n'.format(str(ii), str(std_dev))
     print(temp)
     temp = 'M666 X{0} Y{1} Z{2}\n'.format(str(Ex), str(Ey), str(Ez))
     print(temp)
     port.write((temp).encode())
-    out = port.readline().decode()
+    port.drain()
     if tower_flag > 0: 
         temp = 'M665 L{0} R{1} H{2} X{3} Y{4} Z{5}\n'.format(str(L_new),str(Radius),str(Height),str(Tx),str(Ty),str(Tz))
     else: 
         temp = 'M665 L{0} R{1} H{2}\n'.format(str(L_new),str(Radius),str(Height))
     print(temp)
     port.write((temp).encode())
-    out = port.readline().decode()
+    port.drain()
     
 # -----------------------------------------------------------------------------
 # Main Entry Function
@@ -1420,7 +1453,7 @@ def main():
             
     # Parse command line inputs
     parser = argparse.ArgumentParser(description='Auto-Bed Cal. for Monoprice Mini Delta')
-    parser.add_argument('-p','--port',default=port_default,help='Serial port',required=False)
+    parser.add_argument('-p','--port',default=port_default,help='Serial port, auto = the only printer found by -dp',required=False)
     parser.add_argument('-x','--x0',type=float,default=x0,help='Starting M666 X-value')
     parser.add_argument('-y','--y0',type=float,default=y0,help='Starting M666 Y-value')
     parser.add_argument('-z','--z0',type=float,default=z0,help='Starting M666 Z-value')
@@ -1431,10 +1464,30 @@ def main():
     parser.add_argument('-mr','--max_runs',type=int,default=max_runs,help='Maximum attempts to calibrate printer')
     parser.add_argument('-bt','--bed_temp',type=int,default=bed_temp,help='Bed Temperature')
     parser.add_argument('-ht','--hotend_temp',type=int,default=hotend_temp,help='Hotend Temperature')
-    parser.add_argument('-ff','--firmFlag',type=int,default=firmFlag,help='Firmware Flag (0 = Stock; 1 = Marlin)')
+    parser.add_argument('-ff','--firmFlag',type=int,default=firmFlag,help='Firmware Flag (0 = Stock; 1 = Marlin; 2 = Odyssey; -1 = detect with M115/M503, cached per port)')
     parser.add_argument('-tf','--tower_flag',type=int,default=tower_flag,help='Tower Flag (0 = Stock and old Marlin4MPMD; 1 = Marlin4MPMD 1.3.3, 2 = experimental)')
     parser.add_argument('-patt','--calibration_pattern',type=int,default=calibration_pattern,help='Calibration Pattern (2 = Stock G29 P2 Pattern, 5 = Stock G29 P5 Pattern, -2 = P2 Pattern at 25 mm radius, 2550 = Experimental for Marlin4MPMD, 2537.5 = Experimental for Marlin4MPMD')
     parser.add_argument('-ratio','--Lratio',type=float,default=Lratio,help='Experimental M665 L adjustment ratio')
+    parser.add_argument('-w','--window',type=int,default=0,help='Marlin commands kept in flight, counted by ok replies (0 = wait on every reply, 4 = default Marlin BUFSIZE)')
+    parser.add_argument('-cs','--checksum',type=int,default=0,help='Send line numbers and checksums and resend corrupted lines (0 = off, 1 = on, Marlin only)')
+    parser.add_argument('-ph','--parity_hack',type=int,default=1,help='Open the port with odd parity first, needed by some USB drivers (0 = off, 1 = on)')
+    parser.add_argument('-dtr','--dtr',type=int,default=-1,help='DTR while opening the port (-1 = driver default, 0 = low, avoids the Marlin reboot with -ph 0, 1 = high)')
+    parser.add_argument('-rts','--rts',type=int,default=0,help='RTS after opening the port (-1 = driver default, 0 = low, needed on mac, 1 = high)')
+    parser.add_argument('-rt','--ready_timeout',type=float,default=30,help='Seconds to wait for the firmware to answer M115 after the port opens (0 = do not wait)')
+    parser.add_argument('-dp','--discover',type=int,default=0,help='Scan /dev/ttyACM* and /dev/ttyUSB* in parallel, list the printers and their firmware, then exit (0 = off, 1 = on)')
+    parser.add_argument('-pc','--port_cache',type=str,default=PORT_CACHE,help='File with the firmware fingerprint of every port seen so far')
+    parser.add_argument('-bd','--baud',type=int,default=115200,help='Baud rate (0 = the rate cached by -nb for this port)')
+    parser.add_argument('-nb','--negotiate_baud',type=int,default=0,help='Try the -br baud rates fastest first and keep the first that passes an M118 burst test (0 = off, 1 = on)')
+    parser.add_argument('-br','--baud_rates',type=str,default=','.join(str(rate) for rate in BAUD_RATES),help='Comma separated baud rates tried by -nb')
+    parser.add_argument('-vm','--verify_M503',type=int,default=0,help='Read M92/M665/M666 back with M503 on every pass instead of using the values sent (0 = off, 1 = on)')
+    parser.add_argument('-rec','--record',type=str,default=None,help='Record every byte sent and received, with timestamps, to this JSONL transcript')
+    parser.add_argument('-rp','--replay',type=str,default=None,help='Run against a transcript recorded with -rec instead of a printer, -p is not needed')
+    parser.add_argument('-rps','--replay_scale',type=float,default=0,help='Replay speed (1 = recorded printer timing, 2 = twice as fast, 0 = no waiting)')
+    parser.add_argument('-tj','--timing_json',type=str,default=None,help='Write the time spent in each phase of every pass, and the command latency histograms, to this JSON file')
+    parser.add_argument('-prof','--profile',type=str,default=None,help='Profile the contour and calibration math with cProfile and write the stats to this file')
+    parser.add_argument('-pm','--prometheus',type=str,default=None,help='Write the result as node_exporter textfile metrics (passes, errors, M665/M666, failure reason) to this .prom file')
+    parser.add_argument('-eta','--eta_log',type=str,default=None,help='Append the time left estimated after every pass, and what it really was, as a JSON line to this file')
+    parser.add_argument('-tr','--trace',type=str,default=None,help='Write a trace-event timeline of the session (commands, probes, phases, temperatures) to this JSON file')
     parser.add_argument('-aaa','--aaa',type=float,default=aaa,help='Trial M665 A-value (Marlin4MPMD Only)')
     parser.add_argument('-bbb','--bbb',type=float,default=bbb,help='Trial M665 B-value (Marlin4MPMD Only)')
     parser.add_argument('-ccc','--ccc',type=float,default=ccc,help='Trial M665 C-value (Marlin4MPMD Only)')
@@ -1450,7 +1503,46 @@ def main():
     
     args = parser.parse_args()
 
-    port = establish_serial_connection(args.port)        
+    session_args = dict(window=args.window, checksum=args.checksum == 1, parity_hack=args.parity_hack == 1,
+                        dtr=line_flag(args.dtr), rts=line_flag(args.rts), ready_timeout=args.ready_timeout)
+
+    # Port discovery
+    port_name = args.port
+    if args.replay:
+        port_name = args.replay
+    elif args.discover == 1 or port_name == 'auto':
+        found = discover_printers(args.port_cache, **session_args)
+        print_discovered(found)
+        if args.discover == 1:
+            return
+        if len(found) != 1:
+            sys.exit('Found {0} printers, choose one with -p'.format(str(len(found))))
+        port_name = list(found)[0]
+
+    # Baud rate
+    session = None
+    speed = args.baud
+    if args.negotiate_baud == 1 and not args.replay:
+        rates = [int(rate) for rate in args.baud_rates.split(',')]
+        session, throughput = negotiate_baud(port_name, rates, args.port_cache, **session_args)
+        if session is not None:
+            print ('Using {0} baud, {1:.0f} bytes/s in the M118 burst\n'.format(str(session.speed), throughput))
+        else:
+            print ('No baud rate passed the M118 burst test\n')
+    elif speed == 0:
+        speed = int(load_port_cache(args.port_cache).get(port_name, {}).get('baud', 115200))
+    if session is None:
+        session = PrinterSession(port_name, speed=speed, record=args.record, replay=args.replay,
+                                 replay_scale=args.replay_scale, **session_args)
+    elif args.record:
+        session.start_recording(args.record)
+    if args.profile:
+        session.timer.start_profile()
+    if args.trace:
+        session.timer.start_trace()
+    port = session.open()
+    if port:
+        port.shadow.verify = args.verify_M503 == 1
     tower_flag = args.tower_flag
     firmFlag = args.firmFlag
     bed_temp = args.bed_temp
@@ -1479,13 +1571,24 @@ def main():
     Lratio = args.Lratio
     calibration_pattern = args.calibration_pattern
         
-    if args.port == port_error:
+    if args.port == port_error and not args.replay:
         print ('auto_cal_generic.py: error: the following arguments are required: -p/--port\n')
         
     elif port:
     
+        # Firmware readiness
+        if session.ready is not None:
+            print ('Printer ready after {0:.1f} s, M115 round trip {1:.0f} ms'.format(session.ready.wait, (session.ready.latency or 0)*1000))
+            if session.ready.firmware:
+                print (session.ready.firmware)
+            print ('')
+        elif session.ready_timeout > 0:
+            print ('No reply to M115 within {0} s, sending setup anyway\n'.format(str(session.ready_timeout)))
+
         # Firmware
         odyssey_flag = 0
+        if firmFlag < 0:
+            firmFlag = cached_firmware(session, args.port_cache)
         if firmFlag == 0:
             print("Using Monoprice/Malyan Firmware\n")
         elif firmFlag > 0:
@@ -1502,6 +1605,11 @@ def main():
                 if (calibration_pattern < 334): 
                     tower_flag = 0
                     
+        # Fill the settings shadow from the printer before it answers for it,
+        # the stock firmware has no M503 dump
+        if firmFlag == 1:
+            get_M503_text(port)
+
         # Check tower flag in aegean-odyssey's firmware
         if odyssey_flag == 1:
             if ((calibration_pattern < 334) or (calibration_pattern > 340)) : 
@@ -1521,46 +1629,46 @@ def main():
         if bed_temp >= 0:
             print ('Setting bed temperature to {0} C\n'.format(str(bed_temp)))
             port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
-            out = port.readline().decode()
+            port.drain()
 
         # Set Hotend Temperature
         if hotend_temp >= 0:
             print ('Setting hotend temperature to {0} C\n'.format(str(hotend_temp)))
             port.write('M109 S{0}\n'.format(str(hotend_temp)).encode())
-            out = port.readline().decode()
+            port.drain()
             
         # Set the proper step/mm
         print ('Setting up M92 X{0} Y{0} Z{0}\n'.format(str(step_mm)))
         port.write(('M92 X{0} Y{0} Z{0}\n'.format(str(step_mm))).encode())
-        out = port.readline().decode()
+        port.drain()
         
         print ('Setting up M665 L{0} R{1}\n'.format(str(l_value),str(r_value)))
         port.write(('M665 L{0} R{1}\n'.format(str(l_value),str(r_value))).encode())
-        out = port.readline().decode()
+        port.drain()
 
         if firmFlag == 1:
 
             if odyssey_flag == 0: 
                 print ('Setting up M206 X0 Y0 Z0\n')
                 port.write('M206 X0 Y0 Z0 ;\n'.encode())
-                out = port.readline().decode()
+                port.drain()
                 print ('Clearing mesh with M421 C\n')
                 port.write('M421 C\n'.encode())
-                out = port.readline().decode()
+                port.drain()
             else: 
                 print ('Setting Calibration Radius M665 V{0}\n'.format(str(vvv)))
                 port.write(('M665 V{0}\n'.format(str(vvv))).encode())
-                out = port.readline().decode()
+                port.drain()
                 print ('Disabling Probe Compensation with M111 S128')
-                port.write('M111 S128'.encode())
-                out = port.readline().decode()
+                port.write('M111 S128\n'.encode())
+                port.drain()
                 print ('Setting Delta Height M665 H{0}\n'.format(str(hhh)))
                 port.write(('M665 H{0}\n'.format(str(hhh))).encode())
-                out = port.readline().decode()
+                port.drain()
                 if ((calibration_pattern < 33) or (calibration_pattern > 340)): 
                     print ('Correcting Delta Height with G33 V3 P1\n')
                     port.write(('G33 V3 P1\n'.encode()))
-                    out = port.readline().decode()
+                    port.drain()
 
             print ('Setting Trial M665 ABCDEF Values\n')
             print ('M665 A{0} B{1} C{2} D{3} E{4} F{5} ;\n'.format(str(aaa), str(bbb), str(ccc), str(ddd), str(eee), str(fff)))
@@ -1581,12 +1689,30 @@ def main():
         # Run Calibration
         print ('\nStarting calibration')
         calibrated = False
-        if max_runs <= 0: 
-            calibrated = True # Output debugging logs
-        elif (calibration_pattern == 33 or (calibration_pattern >= 330 and calibration_pattern <= 340)): 
-            calibrated = run_G33(port, max_runs, bed_temp, hotend_temp, r_value, l_value, Lratio, calibration_pattern, tower_flag)
-        else: 
-            calibrated, new_z, new_x, new_y, new_l, new_r, iHighTower = run_calibration(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, max_runs, args.max_error, bed_temp, hotend_temp, tower_flag, Lratio, calibration_pattern)
+        reason = ''
+        try:
+            if max_runs <= 0: 
+                calibrated = True # Output debugging logs
+            elif (calibration_pattern == 33 or (calibration_pattern >= 330 and calibration_pattern <= 340)): 
+                calibrated = run_G33(port, max_runs, bed_temp, hotend_temp, r_value, l_value, Lratio, calibration_pattern, tower_flag)
+                if not calibrated:
+                    reason = 'Firmware reported a G33 problem'
+            else: 
+                calibrated, new_z, new_x, new_y, new_l, new_r, iHighTower = run_calibration(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, max_runs, args.max_error, bed_temp, hotend_temp, tower_flag, Lratio, calibration_pattern)
+        except SystemExit as e:
+            reason = str(e.code)
+            raise
+        except Exception as e:
+            reason = '{0}: {1}'.format(type(e).__name__, str(e))
+            raise
+        finally:
+            # Before the questions below, and also when the calibration
+            # gives up with sys.exit()
+            report_timing(session, args.timing_json, args.profile, args.trace)
+            if args.prometheus:
+                write_metrics(args.prometheus, session, FIRMWARE_NAMES.get(2 if odyssey_flag == 1 else firmFlag, 'unknown'), str(calibration_pattern), calibrated, reason)
+            if args.eta_log:
+                session.timer.eta.save(args.eta_log, port=session.port, pattern=str(calibration_pattern), calibrated=calibrated, reason=reason)
 
         # Post Calibration Actions/Logging
         if calibrated:
@@ -1624,10 +1750,12 @@ def main():
                 port.write(('M500 ;\n').encode()) # Save to memory
                 
         # Close the com port
-        port.close()
+        session.close()
 
     else: 
         print ('There was an unknown error with the port.\n')
+        if args.prometheus:
+            write_metrics(args.prometheus, session, FIRMWARE_NAMES.get(firmFlag, 'unknown'), str(calibration_pattern), False, 'Could not open the port')
         
     # This next line does not work in Python2. 
     # Uncomment it when making the executable.
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+# End-to-end calibration benchmark on the virtual printer
+#
+# Runs complete calibrations, the same command lines a user would type,
+# against virtual_printer.py for every combination of firmware, pattern,
+# tower flag, starting error, ok window (-w) and checksums (-cs), and
+# reports what each one cost:
+#
+#   passes   calibration passes (G33 runs) until the script stopped
+#   done     whether it reported a finished calibration
+#   probes   probe touches the printer made
+#   cmds     commands the printer answered
+#   rs       lines the printer asked for again (Resend)
+#   bytes    bytes sent to / received from the printer
+#   time     printer time from PrinterTiming, moves, probing, heating, serial
+#            and the round trips it sat idle waiting for the next command
+#   flat     range of the noise free P5 probe heights afterwards (mm)
+#   host     wall clock seconds the run took here
+#
+# Patterns: P2 = auto_cal_generic.py -patt 2, P5 = auto_cal_p5.py,
+# ring = auto_cal_generic.py -patt 2550, G33 = auto_cal_generic.py -patt 33.
+# Combinations the firmware cannot run (ring on stock, G33 without Odyssey,
+# windows and checksums on stock) are skipped.  With checksums, -le of the
+# numbered lines arrive corrupted so the resend path runs too.
+#
+# python3 benchmark_calibration.py
+# python3 benchmark_calibration.py -ff 1,2 -patt P5,G33 -se 0.5,1,2 -o results.json
+# python3 benchmark_calibration.py -ff 1 -patt P5 -w 0,1,4,8 -cs 0,1
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from virtual_printer import P5_POINTS, FIRMWARE_NAMES, DeltaGeometry, PrinterTiming, VirtualPrinter, start_virtual_printer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+P5_SCRIPT = os.path.join(ROOT, 'auto_cal_p5.py')
+GENERIC_SCRIPT = os.path.join(ROOT, 'advanced', 'auto_cal_generic.py')
+
+# pattern: (script, extra arguments, lowest firmware, highest firmware)
+PATTERNS = {
+    'P2': (GENERIC_SCRIPT, ['-patt', '2'], 0, 2),
+    'P5': (P5_SCRIPT, [], 0, 2),
+    'ring': (GENERIC_SCRIPT, ['-patt', '2550'], 1, 2),
+    'G33': (GENERIC_SCRIPT, ['-patt', '33'], 2, 2),
+}
+
+# Machine errors at starting error 1: rod, radius, height, endstops, tower angles
+BASE_ERRORS = (-0.4, 0.4, 0.3, (0.25, -0.15, 0.0), (0.3, -0.2, 0.0))
+
+PASS_RE = re.compile(r'^(Calibration pass [0-9]+|run [0-9]+)', re.M)
+
+def starting_machine(error):
+    rod, radius, height, endstops, angles = BASE_ERRORS
+    return DeltaGeometry(123.0 + rod*error, 63.5 + radius*error, 120.0 + height*error,
+                         [e*error for e in endstops], [a*error for a in angles])
+
+def flatness(printer):
+    # Spread of the probe heights over the P5 points with the final settings
+    noise, position = printer.noise, list(printer.position)
+    printer.noise = 0.0
+    z = [printer.probe(x, y) for x, y in P5_POINTS]
+    printer.noise, printer.position = noise, position
+    return max(z) - min(z)
+
+def run_case(firmFlag, pattern, tower_flag, error, window, checksum, args):
+    script, options, lowest, highest = PATTERNS[pattern]
+    printer = VirtualPrinter(firmFlag, starting_machine(error), bed_tilt=(args.tilt, 0.0), bed_bowl=args.bowl,
+                             noise=args.noise, seed=args.seed, timing=PrinterTiming(), bufsize=args.bufsize,
+                             line_errors=args.line_errors)
+    port_name = start_virtual_printer(printer)
+    # auto_cal_p5.py drives Odyssey like Marlin4MPMD
+    ff = min(firmFlag, 1) if script == P5_SCRIPT else firmFlag
+    command = [sys.executable, script, '-p', port_name, '-ff', str(ff), '-tf', str(tower_flag),
+               '-mr', str(args.max_runs), '-rt', '5', '-rts', '-1', '-w', str(window), '-cs', str(checksum)] + options
+    start = time.monotonic()
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            # Answer no to every question asked after the calibration
+            result = subprocess.run(command, input='n\n'*10, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True, cwd=work_dir, timeout=args.timeout)
+            output = result.stdout
+        except subprocess.TimeoutExpired as e:
+            output = e.stdout.decode(errors='replace') if e.stdout else ''
+    host = time.monotonic() - start
+    for fd in printer.pty:
+        os.close(fd)
+    output = output.split('Final Results')[0]
+    return {'firmware': FIRMWARE_NAMES[firmFlag], 'pattern': pattern, 'tower_flag': tower_flag, 'error': error,
+            'window': window, 'checksum': checksum, 'passes': len(PASS_RE.findall(output)),
+            'done': 'Calibration complete' in output or (pattern == 'G33' and 'std dev' in output),
+            'probes': printer.probes, 'commands': printer.commands, 'resends': printer.resends,
+            'bytes_received': printer.bytes_received, 'bytes_sent': printer.bytes_sent,
+            'printer_time': printer.clock, 'flatness': flatness(printer), 'host_time': host}
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end calibration benchmark on the virtual printer')
+    parser.add_argument('-ff','--firmFlag',type=str,default='0,1,2',help='Comma separated firmware flags (0 = Stock; 1 = Marlin4MPMD; 2 = Odyssey)')
+    parser.add_argument('-patt','--patterns',type=str,default='P2,P5,ring,G33',help='Comma separated patterns (P2, P5, ring, G33)')
+    parser.add_argument('-tf','--tower_flag',type=str,default='0',help='Comma separated tower flags')
+    parser.add_argument('-se','--starting_error',type=str,default='1',help='Comma separated multiples of the default machine errors')
+    parser.add_argument('-w','--window',type=str,default='0,4',help='Comma separated ok windows passed to the scripts (0 = wait on every reply)')
+    parser.add_argument('-cs','--checksum',type=str,default='0,1',help='Comma separated checksum settings passed to the scripts (0 = off, 1 = on)')
+    parser.add_argument('-bs','--bufsize',type=int,default=4,help='Command slots of the virtual printer, Marlin BUFSIZE')
+    parser.add_argument('-le','--line_errors',type=float,default=0.01,help='Share of the numbered lines that arrive corrupted')
+    parser.add_argument('-mr','--max_runs',type=int,default=14,help='Maximum attempts to calibrate printer')
+    parser.add_argument('-tx','--tilt',type=float,default=0.02,help='Bed rise from X0 to X50 (mm)')
+    parser.add_argument('-bw','--bowl',type=float,default=0.03,help='Bed rise from the center to 50 mm out (mm)')
+    parser.add_argument('-n','--noise',type=float,default=0.005,help='Probe repeatability, standard deviation (mm)')
+    parser.add_argument('-sd','--seed',type=int,default=1,help='Random seed for the probe noise')
+    parser.add_argument('-to','--timeout',type=float,default=600,help='Seconds before a calibration run is given up')
+    parser.add_argument('-o','--output',type=str,default=None,help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    cases = []
+    for firmFlag in [int(v) for v in args.firmFlag.split(',')]:
+        for pattern in args.patterns.split(','):
+            script, options, lowest, highest = PATTERNS[pattern]
+            if firmFlag < lowest or firmFlag > highest:
+                print('Skipping {0} on {1}'.format(pattern, FIRMWARE_NAMES[firmFlag]))
+                continue
+            for tower_flag in [int(v) for v in args.tower_flag.split(',')]:
+                for error in [float(v) for v in args.starting_error.split(',')]:
+                    for window in [int(v) for v in args.window.split(',')]:
+                        for checksum in [int(v) for v in args.checksum.split(',')]:
+                            # The stock firmware gets neither, see -cs "Marlin only"
+                            if firmFlag == 0 and (window > 0 or checksum > 0):
+                                continue
+                            cases.append((firmFlag, pattern, tower_flag, error, window, checksum))
+
+    print('\n{0:<12} {1:<5} {2:>2} {3:>5} {4:>2} {5:>2} {6:>6} {7:>5} {8:>6} {9:>5} {10:>3} {11:>13} {12:>9} {13:>7} {14:>7}'.format(
+        'firmware', 'patt', 'tf', 'error', 'w', 'cs', 'passes', 'done', 'probes', 'cmds', 'rs', 'bytes tx/rx', 'time', 'flat', 'host'))
+    results = []
+    for firmFlag, pattern, tower_flag, error, window, checksum in cases:
+        r = run_case(firmFlag, pattern, tower_flag, error, window, checksum, args)
+        results.append(r)
+        minutes, seconds = divmod(r['printer_time'], 60)
+        print('{0:<12} {1:<5} {2:>2} {3:>5.2f} {4:>2} {5:>2} {6:>6} {7:>5} {8:>6} {9:>5} {10:>3} {11:>13} {12:>9} {13:>7.3f} {14:>6.1f}s'.format(
+            r['firmware'], pattern, tower_flag, error, window, checksum, r['passes'], 'yes' if r['done'] else 'no', r['probes'],
+            r['commands'], r['resends'], '{0}/{1}'.format(r['bytes_received'], r['bytes_sent']),
+            '{0:.0f}:{1:04.1f}'.format(minutes, seconds), r['flatness'], r['host_time']))
+
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            json.dump(results, results_file, indent=1)
+
+if __name__ == '__main__':
+    main()
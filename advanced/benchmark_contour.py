@@ -0,0 +1,206 @@
+#!/usr/bin/python
+
+# Benchmark for the contour engines that turn a G29 P5 probe set into the
+# tower heights and bowl values the calibration works from:
+#
+#   p5-griddata    calculate_contour() in auto_cal_p5.py, -im 0
+#   p5-spreadsheet calculate_contour() in auto_cal_p5.py, -im 1
+#   v0             calculate_contour() in auto_cal_p5_v0.py
+#   v0-python      the same without numpy, heatmap filled point by point
+#   generic-p5     calculate_contour_p5() in auto_cal_generic.py
+#   generic-4pt    calculate_contour_experimental() in auto_cal_generic.py,
+#                  fed the P5 points nearest the -patt 2 pattern
+#   p5-batch-*     calculate_contour_batch() in auto_cal_p5.py, -im 0 and
+#                  -im 1, one call per probe pattern for the whole corpus
+#
+# Runs every engine over the same corpus and reports time per call, peak
+# memory per call (tracemalloc) and the largest difference from the
+# reference engine for each output.  The corpus is synthetic P5 sets from
+# virtual_printer.py, plus any auto_cal_p5_pass*.txt files or -rec
+# transcripts given with -d.
+#
+# check_spreadsheet.py checks the -im 1 stencil against the original loop.
+#
+# python3 benchmark_contour.py -c 20
+# python3 benchmark_contour.py -d ../auto_cal_p5_pass*.txt -d session.jsonl
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auto_cal_p5 as p5
+import auto_cal_p5_v0 as v0
+import auto_cal_generic as generic
+from virtual_printer import DeltaGeometry, VirtualPrinter
+
+OUTPUTS = ('TX', 'TY', 'TZ', 'BowlCenter', 'BowlOR')
+
+# P5 points standing in for the -patt 2 pattern: Z tower, X tower, Y tower, center
+FOUR_POINTS = [(0.0, 50.0), (-50.0, -25.0), (50.0, -25.0), (0.0, 0.0)]
+
+def run_p5(x_list, y_list, dz_list, tower_flag, minterp):
+    TX, TY, TZ, THigh, BowlCenter, BowlOR, xhigh, yhigh, zhigh, iHighTower = p5.calculate_contour(
+        x_list, y_list, dz_list, 1, [0]*2, [0]*2, [0]*2, minterp, tower_flag)
+    return TX, TY, TZ, BowlCenter, BowlOR
+
+def run_v0(x_list, y_list, dz_list, tower_flag):
+    TX, TY, TZ, THigh, BowlCenter, BowlOR, xhigh, yhigh, zhigh, iHighTower = v0.calculate_contour(
+        x_list, y_list, dz_list, 1, [0]*2, [0]*2, [0]*2, tower_flag)
+    return TX, TY, TZ, BowlCenter, BowlOR
+
+def run_v0_python(x_list, y_list, dz_list, tower_flag):
+    numpy, v0.np = v0.np, None
+    try:
+        return run_v0(x_list, y_list, dz_list, tower_flag)
+    finally:
+        v0.np = numpy
+
+def run_generic_p5(x_list, y_list, dz_list, tower_flag):
+    TX, TY, TZ, xtower, ytower, ztower, BowlCenter, BowlOR = generic.calculate_contour_p5(x_list, y_list, dz_list, tower_flag)
+    return TX, TY, TZ, BowlCenter, BowlOR
+
+def run_generic_4pt(x_list, y_list, dz_list, tower_flag):
+    points = list(zip(x_list, y_list))
+    dz_4pt = [dz_list[points.index(xy)] for xy in FOUR_POINTS]
+    TX, TY, TZ, xtower, ytower, ztower, BowlCenter, BowlOR = generic.calculate_contour_experimental(dz_4pt, tower_flag, 2)
+    return TX, TY, TZ, BowlCenter, BowlOR
+
+ENGINES = [
+    ('p5-griddata', lambda x, y, dz, tf: run_p5(x, y, dz, tf, 0)),
+    ('p5-spreadsheet', lambda x, y, dz, tf: run_p5(x, y, dz, tf, 1)),
+    ('v0', run_v0),
+    ('v0-python', run_v0_python),
+    ('generic-p5', run_generic_p5),
+    ('generic-4pt', run_generic_4pt),
+]
+
+BATCH_ENGINES = [('p5-batch-griddata', 0), ('p5-batch-spreadsheet', 1)]
+
+def run_batches(corpus, tower_flag, minterp):
+    # One calculate_contour_batch() call per probe pattern in the corpus
+    patterns = {}
+    for ii, (label, (x_list, y_list, dz_list)) in enumerate(corpus):
+        patterns.setdefault((tuple(x_list), tuple(y_list)), []).append(ii)
+    results = [None]*len(corpus)
+    for (x_list, y_list), members in patterns.items():
+        batch = p5.calculate_contour_batch(list(x_list), list(y_list), [corpus[ii][1][2] for ii in members], minterp, tower_flag)
+        for jj, ii in enumerate(members):
+            results[ii] = tuple(float(getattr(batch, out)[jj]) for out in OUTPUTS)
+    return results
+
+def probe_dataset(lines):
+    # 42 "Bed X: Y: Z:" lines, two taps per point, into x, y, dz lists
+    points = [p5.parse_probe(line) for line in lines]
+    x_list = [float(p.x) for p in points[0::2]]
+    y_list = [float(p.y) for p in points[0::2]]
+    z1_list = [p.z for p in points[0::2]]
+    z2_list = [p.z for p in points[1::2]]
+    z_avg_list, dtap_list, dz_list = p5.summarize_points(z1_list, z2_list)
+    return x_list, y_list, dz_list
+
+def synthetic_datasets(count, seed):
+    # Stock G29 P5 runs on virtual printers with random geometry and beds
+    rng = random.Random(seed)
+    datasets = []
+    for ii in range(count):
+        machine = DeltaGeometry(123.0 + rng.uniform(-1.5, 1.5), 63.5 + rng.uniform(-1.0, 1.0), 120.0,
+                                [rng.uniform(-0.4, 0.4) for jj in range(3)],
+                                [rng.uniform(-0.5, 0.5) for jj in range(3)])
+        printer = VirtualPrinter(0, machine, bed_tilt=(rng.uniform(-0.05, 0.05), rng.uniform(-0.05, 0.05)),
+                                 bed_bowl=rng.uniform(-0.1, 0.1), noise=0.005, seed=rng.random())
+        printer.handle('G28')
+        lines = [line.encode() for line in printer.handle('G29 P5 V4') if line.startswith('Bed ')]
+        datasets.append(('synthetic-{0}'.format(ii), probe_dataset(lines)))
+    return datasets
+
+def recorded_datasets(path):
+    # Every complete set of 42 probe lines in a pass file or -rec transcript
+    with open(path, 'rb') as data_file:
+        if path.endswith('.jsonl'):
+            records = [json.loads(line) for line in data_file]
+            text = ''.join(r['data'] for r in records if r.get('dir') == 'rx').encode('latin-1')
+        else:
+            text = data_file.read()
+    lines = [line for line in text.splitlines() if p5.parse_probe(line) is not None]
+    name = os.path.basename(path)
+    count = len(lines)//42
+    return [('{0}:{1}'.format(name, ii) if count > 1 else name, probe_dataset(lines[ii*42:(ii + 1)*42]))
+            for ii in range(count)]
+
+def quiet(func, *args):
+    # The engines print debugging output, keep it out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+def measure_batch(corpus, tower_flag, minterp, number):
+    # Per probe set, like measure()
+    call = lambda: run_batches(corpus, tower_flag, minterp)
+    seconds = min(timeit.repeat(call, number=number, repeat=3)) / number / len(corpus)
+    tracemalloc.start()
+    results = call()
+    peak = tracemalloc.get_traced_memory()[1] / len(corpus)
+    tracemalloc.stop()
+    return results, seconds, peak
+
+def measure(func, dataset, tower_flag, number):
+    x_list, y_list, dz_list = dataset
+    call = lambda: quiet(func, x_list, y_list, dz_list, tower_flag)
+    seconds = min(timeit.repeat(call, number=number, repeat=3)) / number
+    tracemalloc.start()
+    result = call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def main():
+    parser = argparse.ArgumentParser(description='Contour engine benchmark')
+    parser.add_argument('-c','--count',type=int,default=10,help='Synthetic P5 datasets from the virtual printer')
+    parser.add_argument('-sd','--seed',type=int,default=1,help='Random seed for the synthetic datasets')
+    parser.add_argument('-d','--data',type=str,action='append',default=[],help='auto_cal_p5_pass*.txt file or -rec transcript to add to the corpus, may be repeated')
+    parser.add_argument('-n','--number',type=int,default=3,help='Calls per timing run')
+    parser.add_argument('-tf','--tower_flag',type=int,default=0,help='Tower Flag passed to every engine')
+    parser.add_argument('-ref','--reference',type=str,default='p5-griddata',help='Engine the others are compared to')
+    parser.add_argument('-e','--engines',type=str,default=','.join([name for name, func in ENGINES] + [name for name, minterp in BATCH_ENGINES]),help='Comma separated engines to run')
+    args = parser.parse_args()
+
+    corpus = synthetic_datasets(args.count, args.seed)
+    for path in args.data:
+        corpus += recorded_datasets(path)
+    engines = [(name, func) for name, func in ENGINES if name in args.engines.split(',') or name == args.reference]
+    print('{0} datasets, {1} engines, reference {2}\n'.format(str(len(corpus)), str(len(engines)), args.reference))
+
+    results = dict((name, []) for name, func in engines)
+    times = dict((name, []) for name, func in engines)
+    peaks = dict((name, []) for name, func in engines)
+    for label, dataset in corpus:
+        for name, func in engines:
+            result, seconds, peak = measure(func, dataset, args.tower_flag, args.number)
+            results[name].append(result)
+            times[name].append(seconds)
+            peaks[name].append(peak)
+
+    for name, minterp in BATCH_ENGINES:
+        if name in args.engines.split(','):
+            results[name], seconds, peak = measure_batch(corpus, args.tower_flag, minterp, args.number)
+            times[name] = [seconds]
+            peaks[name] = [peak]
+            engines.append((name, None))
+
+    print('{0:<20} {1:>10} {2:>10} {3:>10}  {4}'.format('engine', 'ms/call', 'max ms', 'peak KiB', '  '.join('{0:>10}'.format('d' + out) for out in OUTPUTS)))
+    reference = results[args.reference]
+    for name, func in engines:
+        diffs = [max(abs(r[ii] - ref[ii]) for r, ref in zip(results[name], reference)) for ii in range(len(OUTPUTS))]
+        print('{0:<20} {1:10.3f} {2:10.3f} {3:10.1f}  {4}'.format(
+            name, 1000*sum(times[name])/len(times[name]), 1000*max(times[name]), max(peaks[name])/1024.0,
+            '  '.join('{0:10.5f}'.format(d) for d in diffs)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+# Micro-benchmark for the printer reply parser in auto_cal_common.py
+#
+# Compares the byte parsers (parse_probe/parse_G33) against the old
+# split-based code they replaced, on the reply lines the calibration loop
+# actually sees.  "probe line" is everything a G30 reply costs on its way
+# from the reader thread to get_points(): classify_line() and one parse.
+#
+# python3 benchmark_parser.py -n 200000
+
+import argparse
+import timeit
+
+from auto_cal_common import classify_line, parse_probe, parse_G33
+
+PROBE_LINE = b'Bed X: -25.00 Y: -50.00 Z: 0.123\n'
+G33_LINES = [b'Iteration : 01                                    std dev:0.123\n',
+             b'.Height:129.87    Ex:-0.12  Ey:+0.00  Ez:-0.05    Radius:63.40\n',
+             b'.Tower angle :    Tx:+0.00  Ty:+0.00  Tz:+0.00\n']
+G33_PATTERNS = [['dev:'],
+                ['Height:', 'Ex:', 'Ey:', 'Ez:', 'Radius:'],
+                ['Tx:', 'Ty:', 'Tz:']]
+
+def split_probe(raw):
+    # get_points() before the compiled parser
+    return float(raw.decode().split(' ')[6])
+
+def split_probe_line(raw):
+    # Reader loop and get_points() before the line kinds
+    out = raw.decode()
+    if 'Bed ' in out:
+        return float(out.split(' ')[6])
+
+def compiled_probe_line(raw):
+    if classify_line(raw) == 'probe':
+        return parse_probe(raw).z
+
+def split_G33(input_str, pattern):
+    # parse_G33() before the compiled parser
+    str_split = input_str.split(' ')
+    for ii in range(len(str_split)):
+        if pattern in str_split[ii]:
+            new_split = str_split[ii].split(':')
+            output = float(new_split[1])
+            break
+    return output
+
+def split_G33_lines():
+    values = []
+    for raw, patterns in zip(G33_LINES, G33_PATTERNS):
+        out = raw.decode()
+        for pattern in patterns:
+            values.append(split_G33(out, pattern))
+    return values
+
+def compiled_G33_lines():
+    values = []
+    for raw in G33_LINES:
+        values.extend(v for v in parse_G33(raw) if v is not None)
+    return values
+
+def report(name, old, new, number):
+    t_old = min(timeit.repeat(old, number=number, repeat=3)) / number * 1e9
+    t_new = min(timeit.repeat(new, number=number, repeat=3)) / number * 1e9
+    print('{0:<12} split: {1:8.0f} ns  compiled: {2:8.0f} ns  speed-up: {3:.2f}x'.format(name, t_old, t_new, t_old / t_new))
+
+def main():
+    parser = argparse.ArgumentParser(description='Reply parser micro-benchmark')
+    parser.add_argument('-n','--number',type=int,default=100000,help='Calls per timing run')
+    args = parser.parse_args()
+
+    # Both parsers have to agree before their speed means anything
+    assert split_probe(PROBE_LINE) == parse_probe(PROBE_LINE).z
+    assert split_probe_line(PROBE_LINE) == compiled_probe_line(PROBE_LINE)
+    assert sorted(split_G33_lines()) == sorted(compiled_G33_lines())
+
+    report('probe', lambda: split_probe(PROBE_LINE), lambda: parse_probe(PROBE_LINE).z, args.number)
+    report('probe line', lambda: split_probe_line(PROBE_LINE), lambda: compiled_probe_line(PROBE_LINE), args.number)
+    report('G33', split_G33_lines, compiled_G33_lines, args.number // 10)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+#!/usr/bin/python
+
+# Check that spreadsheet_points() in auto_cal_p5.py, the stencil version of
+# the -im 1 spreadsheet, still gives exactly the points and heights of the
+# loop it replaced.  spreadsheet_points_reference() below is that loop,
+# copied unchanged from calculate_contour() before the stencil, with a
+# griddata() call per point.
+#
+# The probe sets are fixed: the P5 pattern of auto_cal_p5.py and the stock
+# G29 P5 pattern of virtual_printer.py, with a flat bed and seeded random
+# heights.  The points have to match exactly.  The heights only to within
+# TOLERANCE, since interpolating a whole stage at once rounds the last bit
+# differently from one griddata() call per point.  Exits with 1 if any set
+# differs.
+#
+# python3 check_spreadsheet.py -c 50
+
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+from scipy.interpolate import griddata
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import auto_cal_p5 as p5
+from auto_cal_p5 import xyz_list2array, linear_interp
+from virtual_printer import DeltaGeometry, VirtualPrinter
+
+TOLERANCE = 1e-12 # mm
+
+def spreadsheet_points_reference(x_list, y_list, dz_list, minterp=1):
+    # Redefine Lists
+    x_list_new = x_list.copy()
+    y_list_new = y_list.copy()
+    dz_list_new = dz_list.copy()
+    
+    # Define contour boundaries and steps
+    xmin = min(x_list_new)
+    xmax = max(x_list_new)
+    ymin = min(y_list_new)
+    ymax = max(y_list_new)
+    dprobe = 25.0; # Distance Betqeen Probe Points
+    ngrid = 3.0 # Grid Cell Spacing for the Contour
+    dx = dprobe/ngrid
+    dy = dx
+    nmax = int(round((ymax-ymin)/dy))
+    
+    # Create Contour Lookup/Interpolation Function
+    coord_xy, coord_z = xyz_list2array(x_list_new,y_list_new,dz_list_new)
+    
+    # Copy Equations from Dennis's Spreadsheet and put them in the lookup grid
+    # Put inside if statement incase we want to try other interpolation methods
+    # Anything other than 1 simply uses Python's griddata with the probed points.
+    if minterp == 1: 
+    
+        # Fill in based on known values across the horizontal
+        iside = -1
+        nknown = int(round((ymax-ymin)/dprobe))
+        for iy in range(nknown):
+            # Current Fixed Value
+            ytmp = ymin + float(iy)*dprobe
+            y0 = ytmp
+            y1 = ytmp
+            yq = ytmp
+            # Set Start/End indices for circular base
+            if ytmp == ymin or ytmp == ymax:
+                iStart = int(round(ngrid))
+                iEnd = nmax-int(round(ngrid))
+            else:
+                iStart = 0
+                iEnd = nmax-1
+            # Loop through all x-values
+            for ix in range(nmax): 
+                xq = xmin + float(ix)*dx
+                #print("x={0} y={1} ix={2} iy={3} mod={4} iStart = {5} iEnd = {6}\n\n".format(str(xq),str(yq),str(ix),str(iy),str(ix%ngrid),str(iStart),str(iEnd)))
+                if ix >= iStart and ix <= iEnd:
+                    if int(round(ix%ngrid)) == 0: # Set Known Values
+                        if ix == iStart:
+                            x0 = xmin + dx*float(ix)
+                            x1 = x0 + dprobe
+                            #print("iStart={0}\n".format(str(iStart)))
+                            #print("Known Point x0 = {0}".format(str(x0)))
+                        else:
+                            x0 = x1
+                            x1 = x0 + dprobe
+                            #print("Known Point\n")
+                            #print("Known Point x0 = {0}".format(str(x0)))
+                        z0 = float(griddata(coord_xy, coord_z, (x0   , y0)))
+                        z1 = float(griddata(coord_xy, coord_z, (x1   , y1)))
+                    else: #  Interpolate Between Known Values
+                        zq = linear_interp(x0, x1, z0, z1, xq)
+                        x_list_new.append(xq)
+                        y_list_new.append(yq)
+                        dz_list_new.append(zq)
+                        #print("Interp Test: {0} {1} {2}\n".format(str(xq),str(yq),str(zq)))
+                        #print("z0={0} z1={1}".format(str(z0),str(z1)))
+                #else:
+                    #print("Outside of grid\n")
+            
+        # Fill in based on known values across the vertical
+        nknown = int(round((xmax-xmin)/dprobe))
+        for ix in range(nknown):
+            # Current Fixed Value
+            xtmp = xmin + float(ix)*dprobe
+            x0 = xtmp
+            x1 = xtmp
+            xq = xtmp
+            # Set Start/End indices for circular base
+            if xtmp == xmin or xtmp == xmax:
+                iStart = int(round(ngrid))
+                iEnd = nmax-int(round(ngrid))
+            else:
+                iStart = 0
+                iEnd = nmax-1
+            # Loop through all y-values
+            for iy in range(nmax): 
+                yq = ymin + float(iy)*dy
+                #print("x={0} y={1} ix={2} iy={3} mod={4} iStart = {5} iEnd = {6}\n\n".format(str(xq),str(yq),str(ix),str(iy),str(ix%ngrid),str(iStart),str(iEnd)))
+                if iy >= iStart and iy <= iEnd:
+                    if int(round(iy%ngrid)) == 0: # Set Known Values
+                        if iy == iStart:
+                            y0 = ymin + dy*float(iy)
+                            y1 = y0 + dprobe
+                            #print("iStart={0}\n".format(str(iStart)))
+                            #print("Known Point y0 = {0} y1 = {1} yq = {2}".format(str(y0), str(y1), str(yq)))
+                        else:
+                            y0 = y1
+                            y1 = y0 + dprobe
+                            #print("Known Point\n")
+                            #print("Known Point y0 = {0} y1 = {1} yq = {2}".format(str(y0), str(y1), str(yq)))
+                        z0 = float(griddata(coord_xy, coord_z, (x0   , y0)))
+                        #print("x0={0} y0={1} z0={2}".format(str(x0), str(y0), str(z0)))
+                        z1 = float(griddata(coord_xy, coord_z, (x1   , y1)))
+                        #print("x1={0} y1={1} z1={2}".format(str(x1), str(y1), str(z1)))
+                    else: #  Interpolate Between Known Values
+                        zq = linear_interp(y0, y1, z0, z1, yq)
+                        x_list_new.append(xq)
+                        y_list_new.append(yq)
+                        dz_list_new.append(zq)
+                        #if xtmp == 0.0:
+                            #print("Interp Test: {0} {1} {2}".format(str(xq),str(yq),str(zq)))
+                            #print("z0={0} z1={1}\n".format(str(z0),str(z1)))
+                #else:
+                    #print("Outside of grid\n")
+            
+  
+        # Manually set corner points
+        # Top Left
+        L6 = float(griddata(coord_xy, coord_z, (-50.0, 25.0)))
+        O3 = float(griddata(coord_xy, coord_z, (-25.0, 50.0)))
+        x_list_new.append(-50.0+dx)
+        y_list_new.append(25.0+dy)
+        dz_list_new.append((O3-L6)/3.0+L6)
+        x_list_new.append(-50.0+2.0*dx)
+        y_list_new.append(25.0+2.0*dy)
+        dz_list_new.append((L6-O3)/3+O3)
+        # Top Right
+        X6 = float(griddata(coord_xy, coord_z, (50.0, 25.0)))
+        U3 = float(griddata(coord_xy, coord_z, (25.0, 50.0)))
+        x_list_new.append(50.0-dx)
+        y_list_new.append(25.0+dy)
+        dz_list_new.append((U3-X6)/3+X6)
+        x_list_new.append(50.0-2.0*dx)
+        y_list_new.append(25.0+2.0*dy)
+        dz_list_new.append((X6-U3)/3+U3)
+        # Bottom Right
+        X12 = float(griddata(coord_xy, coord_z, (50.0, -25.0)))
+        U15 = float(griddata(coord_xy, coord_z, (25.0, -50.0)))
+        x_list_new.append(50.0-dx)
+        y_list_new.append(-25.0-dy)
+        dz_list_new.append((U15-X12)/3+X12)
+        x_list_new.append(50.0-2.0*dx)
+        y_list_new.append(-25.0-2.0*dy)
+        dz_list_new.append((X12-U15)/3+U15)
+        # Bottom Left
+        L12 = float(griddata(coord_xy, coord_z, (-50.0, -25.0)))
+        O15 = float(griddata(coord_xy, coord_z, (-25.0, -50.0)))
+        x_list_new.append(-50.0+dx)
+        y_list_new.append(-25.0-dy)
+        dz_list_new.append((O15-L12)/3+L12)
+        x_list_new.append(-50.0+2.0*dx)
+        y_list_new.append(-25.0-2.0*dy)
+        dz_list_new.append((L12-O15)/3+O15)
+        
+        # Reset gridddata arrays now that we're using calculated values
+        coord_xy, coord_z = xyz_list2array(x_list_new,y_list_new,dz_list_new)
+        
+        # Fill in remaining points used in actual calculations
+        
+        # Tower X
+        M9 = float(griddata(coord_xy, coord_z, (-50.0+dx, 0.0)))
+        M12 = float(griddata(coord_xy, coord_z, (-50.0+dx, -25.0)))
+        x_list_new.append(-50.0+dx)
+        y_list_new.append(-25.0+dy)
+        dz_list_new.append((M9-M12)/3.0+M12)
+        #print("M9={0} M12={1} x={2} y={3} z={4}".format(str(M9),str(M12),str(-50.0+dx),str(-25.0+dy),str((M9-M12)/3.0+M12)))
+        
+        # Tower Y
+        W9 = float(griddata(coord_xy, coord_z, (50.0-dx, 0.0)))
+        W12 = float(griddata(coord_xy, coord_z, (50.0-dx, -25.0)))
+        x_list_new.append(50.0-dx)
+        y_list_new.append(-25.0+dy)
+        dz_list_new.append((W9-W12)/3.0+W12)
+        #print("W9={0} W12={1} x={2} y={3} z={4}".format(str(W9),str(W12),str(50.0-dx),str(-25.0+dy),str((W9-W12)/3.0+W12)))
+        
+        # Tower Z
+        Q3 = float(griddata(coord_xy, coord_z, (0.0-dx, 50.0)))
+        Q6 = float(griddata(coord_xy, coord_z, (0.0-dx, 25.0)))
+        x_list_new.append(0.0-dx)
+        y_list_new.append(50.0-dy)
+        dz_list_new.append((Q6-Q3)/3.0+Q3)
+        #print("Q3={0} Q6={1} x={2} y={3} z={4}".format(str(Q3),str(Q6),str(0.0-dx),str(50.0-dy),str((Q6-Q3)/3.0+Q3)))
+        S3 = float(griddata(coord_xy, coord_z, (0.0+dx, 50.0)))
+        S6 = float(griddata(coord_xy, coord_z, (0.0+dx, 25.0)))
+        x_list_new.append(0.0+dx)
+        y_list_new.append(50.0-dy)
+        dz_list_new.append((S6-S3)/3.0+S3)
+        #print("S3={0} S6={1} x={2} y={3} z={4}".format(str(Q3),str(Q6),str(0.0+dx),str(50.0-dy),str((S6-S3)/3.0+S3)))
+        
+        # Outside Ring
+        # No additional points
+        
+        # Center
+        Q9 = float(griddata(coord_xy, coord_z, (0.0-dx, 0.0)))
+        S9 = float(griddata(coord_xy, coord_z, (0.0+dx, 0.0)))
+        Q7 = (Q9-Q6)/3.0+Q6
+        S7 = (S9-S6)/3.0+S6
+        Q12 = float(griddata(coord_xy, coord_z, (0.0-dx, -25.0)))
+        S12 = float(griddata(coord_xy, coord_z, (0.0+dx, -25.0)))
+        x_list_new.append(0.0-dx)
+        y_list_new.append(0.0+dy)
+        dz_list_new.append((Q7-Q9)/2.0+Q9)
+        x_list_new.append(0.0+dx)
+        y_list_new.append(0.0+dy)
+        dz_list_new.append((S7-S9)/2.0+S9)
+        x_list_new.append(0.0-dx)
+        y_list_new.append(0.0-dy)
+        dz_list_new.append((Q12-Q9)/3.0+Q9)
+        x_list_new.append(0.0+dx)
+        y_list_new.append(0.0-dy)
+        dz_list_new.append((S12-S9)/3+S9)
+        
+        # Convert final values to Array
+        coord_xy, coord_z = xyz_list2array(x_list_new,y_list_new,dz_list_new)
+
+    return coord_xy, coord_z
+
+def probe_patterns():
+    # (x_list, y_list) of every probe order the calibration meets
+    x_list, y_list = p5.get_probe_points()
+    patterns = [(x_list, y_list)]
+    printer = VirtualPrinter(0, DeltaGeometry(123.0, 63.5, 120.0, [0.0]*3, [0.0]*3), noise=0.0, seed=1)
+    printer.handle('G28')
+    probes = [p5.parse_probe(line.encode()) for line in printer.handle('G29 P5 V4') if line.startswith('Bed ')]
+    patterns.append(([p.x for p in probes[0::2]], [p.y for p in probes[0::2]]))
+    return patterns
+
+def main():
+    parser = argparse.ArgumentParser(description='Spreadsheet stencil check')
+    parser.add_argument('-c','--count',type=int,default=20,help='Random probe sets per pattern')
+    parser.add_argument('-sd','--seed',type=int,default=1,help='Random seed for the probe heights')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    checked = 0
+    differ = 0
+    largest = 0.0
+    for x_list, y_list in probe_patterns():
+        heights = [[0.0]*len(x_list)] + [[rng.uniform(-0.5, 0.5) for x in x_list] for ii in range(args.count)]
+        for dz_list in heights:
+            tri, z = p5.spreadsheet_points(x_list, y_list, dz_list)
+            xy_ref, z_ref = spreadsheet_points_reference(x_list, y_list, dz_list)
+            checked += 1
+            if not np.array_equal(tri.points, xy_ref):
+                differ += 1
+                print('Probe set {0}: the points differ'.format(str(checked)))
+                continue
+            error = float(np.max(np.abs(z - z_ref)))
+            largest = max(largest, error)
+            if error > TOLERANCE:
+                differ += 1
+                print('Probe set {0}: heights differ by up to {1:.3g} mm'.format(str(checked), error))
+    print('Spreadsheet stencil against the original loop: {0} of {1} probe sets differ, largest height difference {2:.3g} mm'.format(
+          str(differ), str(checked), largest))
+    if differ:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,917 @@
+#!/usr/bin/python
+
+# Virtual Monoprice Mini Delta for running the calibration scripts without
+# a printer attached.
+#
+# Creates a pseudo-terminal and answers G-code on it like the stock,
+# Marlin4MPMD or aegean-odyssey's MPMD Marlin 1.1.X firmware would.  The
+# printer behind it is a delta with its own (wrong) diagonal rod, radius,
+# endstop positions, tower angles and a bed surface, so the probe results
+# depend on the M665/M666 values the scripts send, just like the real thing.
+#
+# Linux/macOS only (needs pty).  The port has no modem lines, so start the
+# scripts with -rts -1:
+#
+# python3 virtual_printer.py -ff 1
+# python3 ../auto_cal_p5.py -p /dev/pts/3 -ff 1 -rts -1
+#
+# python3 virtual_printer.py -ff 2 -lk /tmp/ttyMPMD
+# python3 auto_cal_generic.py -p /tmp/ttyMPMD -ff 2 -patt 33 -rts -1
+#
+# Moves, probing, homing, heating and the serial link take printer time
+# (see PrinterTiming), reported when the printer stops.  -ts 1 answers in
+# real time, -ts 20 twenty times faster, the default -ts 0 never waits.
+# Commands queue in -bs command slots like Marlin's BUFSIZE, and -le
+# corrupts that share of the numbered lines to exercise checksum resends.
+
+import argparse
+import math
+import os
+import random
+import re
+import select
+import sys
+import threading
+import time
+from collections import deque
+
+# Tower order X, Y, Z, at the angles Marlin uses
+TOWER_ANGLES = (210.0, 330.0, 90.0)
+
+FIRMWARE_NAMES = {0: 'stock', 1: 'Marlin4MPMD', 2: 'Odyssey'}
+M115_REPLIES = {
+    0: 'FIRMWARE_NAME:Malyan VER:45.115.2 MODEL:M300',
+    1: 'FIRMWARE_NAME:Marlin 1.1.0-RC8 (Github) SOURCE_CODE_URL:https://github.com/mcheah/Marlin4MPMD PROTOCOL_VERSION:1.0 MACHINE_TYPE:Monoprice Mini Delta EXTRUDER_COUNT:1',
+    2: 'FIRMWARE_NAME:Marlin 1.1.9 (Odyssey) SOURCE_CODE_URL:https://github.com/aegean-odyssey/mpmd_marlin_1.1.x PROTOCOL_VERSION:1.0 MACHINE_TYPE:Mini Delta EXTRUDER_COUNT:1',
+}
+
+# Stock G29 P5 probe pattern, two taps per point
+P5_POINTS = [(-25, -50), (0, -50), (25, -50), (50, -25), (25, -25), (0, -25), (-25, -25),
+             (-50, -25), (-50, 0), (-25, 0), (0, 0), (25, 0), (50, 0), (50, 25), (25, 25),
+             (0, 25), (-25, 25), (-50, 25), (-25, 50), (0, 50), (25, 50)]
+
+# Mesh leveling grid, 7 x 7 points 20 mm apart
+MESH_POINTS = 7
+MESH_SPACING = 20.0
+PROBE_RADIUS = 55.0
+
+AMBIENT = 25.0
+
+LINE_RE = re.compile(r'^N(-?[0-9]+) +(.*)\*([0-9]+)$')
+PARAM_RE = re.compile(r'([A-Z])([-+]?[0-9]*\.?[0-9]*)')
+
+def rect(r, theta):
+    theta = math.radians(theta)
+    return r*math.cos(theta), r*math.sin(theta)
+
+def trilaterate(centers, rod):
+    # Nozzle position for three carriage pivots `centers` and equal rods,
+    # the solution below the carriages
+    p1, p2, p3 = centers
+    d21 = [p2[ii] - p1[ii] for ii in range(3)]
+    d31 = [p3[ii] - p1[ii] for ii in range(3)]
+    d = math.sqrt(sum(v*v for v in d21))
+    ex = [v/d for v in d21]
+    i = sum(ex[ii]*d31[ii] for ii in range(3))
+    ey = [d31[ii] - i*ex[ii] for ii in range(3)]
+    j = math.sqrt(sum(v*v for v in ey))
+    ey = [v/j for v in ey]
+    ez = [ex[1]*ey[2] - ex[2]*ey[1], ex[2]*ey[0] - ex[0]*ey[2], ex[0]*ey[1] - ex[1]*ey[0]]
+    x = d/2.0
+    y = (i*i + j*j - 2.0*i*x)/(2.0*j)
+    z = math.sqrt(max(rod*rod - x*x - y*y, 0.0))
+    if ez[2] > 0:
+        z = -z
+    return tuple(p1[ii] + x*ex[ii] + y*ey[ii] + z*ez[ii] for ii in range(3))
+
+class DeltaGeometry(object):
+    """Delta parameters, either the real machine's or the firmware's idea of them.
+
+    endstops are M666 style offsets, tower angles and radius trims are
+    per-tower corrections on top of TOWER_ANGLES and `radius`.
+    """
+
+    def __init__(self, rod=123.0, radius=63.5, height=120.0, endstops=(0.0, 0.0, 0.0),
+                 angles=(0.0, 0.0, 0.0), radius_trims=(0.0, 0.0, 0.0)):
+        self.rod = rod
+        self.radius = radius
+        self.height = height
+        self.endstops = list(endstops)
+        self.angles = list(angles)
+        self.radius_trims = list(radius_trims)
+
+    def copy(self):
+        return DeltaGeometry(self.rod, self.radius, self.height, self.endstops, self.angles, self.radius_trims)
+
+    def towers(self):
+        return [rect(self.radius + self.radius_trims[ii], TOWER_ANGLES[ii] + self.angles[ii]) for ii in range(3)]
+
+    def carriages(self, x, y, z):
+        # Carriage heights for a nozzle position (inverse kinematics)
+        heights = []
+        for tx, ty in self.towers():
+            heights.append(z + math.sqrt(max(self.rod**2 - (x - tx)**2 - (y - ty)**2, 0.0)))
+        return heights
+
+    def nozzle(self, heights):
+        # Nozzle position for carriage heights (forward kinematics)
+        return trilaterate([(tx, ty, h) for (tx, ty), h in zip(self.towers(), heights)], self.rod)
+
+    def top(self):
+        # Carriage height with the nozzle homed at X0 Y0 Z`height`
+        return self.height + math.sqrt(self.rod**2 - self.radius**2)
+
+class PrinterTiming(object):
+    """How long the simulated printer takes to do things, speeds in mm/s.
+
+    Moves follow a trapezoid profile: accelerate at `acceleration` up to the
+    feedrate, cruise, and slow down again.  Probing travels to
+    `probe_clearance` above the bed and descends at `probe_feedrate`.
+    Heaters ramp linearly at heat_rates (hotend, bed) in degrees/s and cool
+    at `cool_rate`.  Every line costs the time to send it at `baud` (10 bits
+    per byte).  A command the host only sends after reading a reply reaches
+    the printer `latency` seconds (the serial round trip) after that reply.
+    """
+
+    def __init__(self, feedrate=100.0, acceleration=1000.0, homing_feedrate=60.0, probe_feedrate=5.0,
+                 probe_clearance=5.0, heat_rates=(2.0, 0.4), cool_rate=0.5, latency=0.002, baud=115200):
+        self.feedrate = feedrate
+        self.acceleration = acceleration
+        self.homing_feedrate = homing_feedrate
+        self.probe_feedrate = probe_feedrate
+        self.probe_clearance = probe_clearance
+        self.heat_rates = {'T': heat_rates[0], 'B': heat_rates[1]}
+        self.cool_rate = cool_rate
+        self.latency = latency
+        self.baud = baud
+
+    def move(self, distance, feedrate=None):
+        # Seconds for a move of `distance` mm starting and ending at rest
+        feedrate = min(feedrate or self.feedrate, self.feedrate)
+        if distance <= 0 or feedrate <= 0:
+            return 0.0
+        if self.acceleration <= 0:
+            return distance/feedrate
+        if distance < feedrate**2/self.acceleration:
+            # Never reaches the feedrate
+            return 2.0*math.sqrt(distance/self.acceleration)
+        return distance/feedrate + feedrate/self.acceleration
+
+    def transfer(self, nbytes):
+        return nbytes*10.0/self.baud if self.baud > 0 else 0.0
+
+# No delays at all, the printer answers as fast as it can compute
+INSTANT = PrinterTiming(feedrate=0.0, homing_feedrate=0.0, probe_feedrate=0.0, heat_rates=(0.0, 0.0),
+                        cool_rate=0.0, latency=0.0, baud=0)
+
+class VirtualPrinter(object):
+    """G-code interpreter for a simulated Mini Delta.
+
+    `machine` is the real geometry and `firmware` what the firmware was
+    told with M665/M666.  After homing, each carriage sits at its real
+    endstop moved by the M666 offset, and every move the firmware makes
+    from there is worked out with its own geometry.  The real nozzle
+    position follows from the real geometry, so wrong settings show up in
+    the probe results.  The bed is bed_tilt/bed_bowl: a plane plus a bowl
+    that is `bowl` mm higher at 50 mm from the center.
+
+    `clock` is the printer's own time in seconds, advanced by `timing` for
+    every move, probe, heat up and reply.  G0/G1 only queue their move like
+    the planner does, commands that need the machine to stand still (G28,
+    G29, G30, G33, G4, M400) wait for the queued moves first.
+
+    Commands wait in `bufsize` slots like Marlin's BUFSIZE and free theirs
+    with the ok.  A host that waits for every reply leaves the printer idle
+    for a round trip before each command, one that keeps commands in flight
+    has the next one queued already.  A command that finds every slot taken
+    gets in when the oldest slot frees.  `line_errors` is the share of the
+    numbered lines (N<line> ... *<checksum>) that arrive corrupted and are
+    asked for again with Resend.
+    """
+
+    def __init__(self, firmFlag=1, machine=None, steps=57.14, bed_tilt=(0.0, 0.0), bed_bowl=0.0,
+                 noise=0.0, seed=None, timing=None, bufsize=4, line_errors=0.0):
+        self.firmFlag = firmFlag
+        self.machine = machine or DeltaGeometry()
+        self.true_steps = steps
+        self.bed_tilt = bed_tilt
+        self.bed_bowl = bed_bowl
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.timing = timing or INSTANT
+        self.clock = 0.0
+        self.motion_end = 0.0
+        self.feedrate = None
+        self.last_line = 0
+        # Command slots: clock of the ok that frees each taken slot, and when
+        # the last command arrived and the last reply went out
+        self.bufsize = bufsize
+        self.slots = deque()
+        self.arrived = 0.0
+        self.replied = 0.0
+        self.line_errors = line_errors
+        self.line_random = random.Random(seed)
+        # Totals for benchmarks
+        self.commands = 0
+        self.probes = 0
+        self.resends = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        # Heater: [temperature, clock when it was set, target]
+        self.heaters = {'T': [AMBIENT, 0.0, 0.0], 'B': [AMBIENT, 0.0, 0.0]}
+        # (clock, line) for the lines of the last reply, and the reports sent
+        # while the command was still running
+        self.timeline = []
+        self.reports = []
+        self.factory_reset()
+        self.position = [0.0, 0.0, self.firmware.height]
+
+    def factory_reset(self):
+        self.firmware = DeltaGeometry()
+        self.steps = self.true_steps
+        self.segments = 160.0 if self.firmFlag > 0 else 200.0
+        self.cal_radius = 50.0
+        self.extras = dict((p, 0.0) for p in 'DEF')
+        self.home_offset = [0.0, 0.0, 0.0]
+        self.probe_offset = 0.0
+        self.mesh = None
+
+    # -------------------------------------------------------------------------
+    # Geometry
+    # -------------------------------------------------------------------------
+
+    def bed(self, x, y):
+        return (self.bed_tilt[0]*x + self.bed_tilt[1]*y)/50.0 + self.bed_bowl*(x*x + y*y)/2500.0
+
+    def real_nozzle(self, x, y, z):
+        # Where the nozzle really is when the firmware thinks it is at x, y, z
+        scale = self.steps/self.true_steps
+        firm_top = self.firmware.top()
+        real_top = self.machine.top()
+        heights = [real_top + self.machine.endstops[ii] + self.firmware.endstops[ii] + (h - firm_top)*scale
+                   for ii, h in enumerate(self.firmware.carriages(x, y, z))]
+        return self.machine.nozzle(heights)
+
+    def probe(self, x, y):
+        # Lower the nozzle until it touches the bed, returns the firmware's
+        # Z at the trigger point
+        def gap(z):
+            nx, ny, nz = self.real_nozzle(x, y, z)
+            return nz - self.bed(nx, ny)
+        high = self.firmware.height + 20.0
+        low = -self.firmware.height
+        for ii in range(40):
+            mid = (high + low)/2.0
+            if gap(mid) > 0:
+                high = mid
+            else:
+                low = mid
+        z = (high + low)/2.0 + self.probe_offset
+        if self.noise > 0:
+            z += self.random.gauss(0.0, self.noise)
+        return z
+
+    def probe_point(self, x, y):
+        self.probes += 1
+        z = self.probe(x, y)
+        clearance = z + self.timing.probe_clearance
+        self.travel(x, y, clearance)
+        # Descend slowly until the probe triggers, then clear the bed again
+        self.spend(self.timing.move(self.timing.probe_clearance, self.timing.probe_feedrate))
+        self.spend(self.timing.move(self.timing.probe_clearance))
+        self.position = [x, y, clearance]
+        return z
+
+    # -------------------------------------------------------------------------
+    # Timing
+    # -------------------------------------------------------------------------
+
+    def spend(self, seconds):
+        # Time for something the printer does after its queued moves
+        self.clock = max(self.clock, self.motion_end) + seconds
+
+    def travel(self, x, y, z, feedrate=None, queued=False):
+        distance = math.sqrt(sum((a - b)**2 for a, b in zip(self.position, (x, y, z))))
+        seconds = self.timing.move(distance, feedrate)
+        self.position = [x, y, z]
+        if queued:
+            self.motion_end = max(self.motion_end, self.clock) + seconds
+        else:
+            self.spend(seconds)
+
+    def temperature(self, name):
+        temp, since, target = self.heaters[name]
+        target = max(target, AMBIENT)
+        if target > temp:
+            return min(temp + self.timing.heat_rates[name]*(self.clock - since), target)
+        return max(temp - self.timing.cool_rate*(self.clock - since), target)
+
+    def set_heater(self, name, target, wait):
+        self.heaters[name] = [self.temperature(name), self.clock, target]
+        if wait and target > self.heaters[name][0] and self.timing.heat_rates[name] > 0:
+            end = self.clock + (target - self.heaters[name][0])/self.timing.heat_rates[name]
+            # Marlin reports the temperatures once a second while it waits
+            while self.clock + 1.0 < end:
+                self.clock += 1.0
+                self.reports.append((self.clock, self.temperature_report() + ' W:?'))
+            self.clock = end
+
+    def temperature_report(self):
+        return 'T:{0:.1f} /{1:.1f} B:{2:.1f} /{3:.1f} @:0 B@:0'.format(
+            self.temperature('T'), self.heaters['T'][2], self.temperature('B'), self.heaters['B'][2])
+
+    # -------------------------------------------------------------------------
+    # Serial protocol
+    # -------------------------------------------------------------------------
+
+    def handle(self, raw, waited=False):
+        # One line from the host, returns everything the firmware answers.
+        # waited = True: the host only sent it after reading the last reply.
+        self.bytes_received += len(raw) + 1
+        arrival = self.arrived
+        if waited:
+            arrival = max(arrival, self.replied + self.timing.latency)
+        arrival += self.timing.transfer(len(raw) + 1)
+        # Slots freed by the oks sent before it got here, else wait for the oldest
+        while self.slots and self.slots[0] <= arrival:
+            self.slots.popleft()
+        if self.bufsize > 0 and len(self.slots) >= self.bufsize:
+            arrival = self.slots.popleft()
+        self.arrived = arrival
+        self.clock = max(self.clock, arrival)
+        self.reports = []
+        line = raw.split(';')[0].strip()
+        if line.startswith('N') and self.line_errors > 0 and self.line_random.random() < self.line_errors:
+            # Noise on the wire: one character of the line arrives changed
+            ii = self.line_random.randrange(len(line))
+            line = line[:ii] + chr(ord(line[ii]) ^ 0x04) + line[ii+1:]
+        out = self.respond(line)
+        if out:
+            nbytes = sum(len(l) + 1 for l in out)
+            self.commands += 1
+            self.resends += sum(1 for l in out if l.startswith('Resend:'))
+            self.bytes_sent += nbytes + sum(len(l) + 1 for t, l in self.reports)
+            self.clock += self.timing.transfer(nbytes)
+            self.replied = self.clock
+            self.slots.append(self.clock)
+        self.timeline = self.reports + [(self.clock, l) for l in out]
+        return [l for t, l in self.timeline]
+
+    def respond(self, line):
+        if not line:
+            return []
+        if line.startswith('N'):
+            m = LINE_RE.match(line)
+            if m is None:
+                return ['Error:No Checksum with line number, Last Line: {0}'.format(self.last_line),
+                        'Resend: {0}'.format(self.last_line + 1), 'ok']
+            number = int(m.group(1))
+            cs = 0
+            for c in line[:line.rindex('*')].encode():
+                cs ^= c
+            if cs != int(m.group(3)):
+                return ['Error:checksum mismatch, Last Line: {0}'.format(self.last_line),
+                        'Resend: {0}'.format(self.last_line + 1), 'ok']
+            line = m.group(2).strip()
+            if not line.startswith('M110') and number != self.last_line + 1:
+                return ['Error:Line Number is not Last Line Number+1, Last Line: {0}'.format(self.last_line),
+                        'Resend: {0}'.format(self.last_line + 1), 'ok']
+            self.last_line = number
+        code = line.split()[0].upper()
+        params = self.params(line[len(code):])
+        handler = getattr(self, 'cmd_' + code, None)
+        if handler is None:
+            out = ['echo:Unknown command: "{0}"'.format(line), 'ok']
+        else:
+            out = handler(params, line) + ['ok']
+        return out
+
+    def params(self, text):
+        values = {}
+        for p, num in PARAM_RE.findall(text.upper()):
+            try:
+                values[p] = float(num)
+            except ValueError:
+                values[p] = None
+        return values
+
+    def bed_line(self, x, y, z):
+        return 'Bed X: {0:.2f} Y: {1:.2f} Z: {2:.3f}'.format(x, y, z)
+
+    # Motion
+
+    def cmd_G0(self, params, line):
+        if params.get('F'):
+            self.feedrate = params['F']/60.0
+        target = list(self.position)
+        for ii, axis in enumerate('XYZ'):
+            if params.get(axis) is not None:
+                target[ii] = params[axis]
+        self.travel(target[0], target[1], target[2], self.feedrate, queued=True)
+        return []
+
+    cmd_G1 = cmd_G0
+
+    def cmd_G4(self, params, line):
+        seconds = (params.get('P') or 0.0)/1000.0 + (params.get('S') or 0.0)
+        self.spend(seconds)
+        return []
+
+    def cmd_G28(self, params, line):
+        # All three carriages go up to their endstops, back off and bump again
+        self.spend(self.timing.move(self.firmware.height - self.position[2] + 5.0, self.timing.homing_feedrate)
+                   + 2.0*self.timing.move(5.0, self.timing.homing_feedrate/2.0))
+        self.position = [0.0, 0.0, self.firmware.height]
+        return []
+
+    def cmd_G90(self, params, line):
+        return []
+
+    cmd_G21 = cmd_G90
+
+    def cmd_G30(self, params, line):
+        if self.firmFlag == 0:
+            return ['echo:Unknown command: "{0}"'.format(line)]
+        x = params.get('X', self.position[0])
+        y = params.get('Y', self.position[1])
+        return [self.bed_line(x, y, self.probe_point(x, y))]
+
+    def cmd_G29(self, params, line):
+        if self.firmFlag == 0:
+            # Stock firmware: P2 = towers and center, P5 = 21 point grid, two taps each
+            if params.get('P') == 2:
+                points = [rect(50.0, 90.0), rect(50.0, 210.0), rect(50.0, 330.0), (0.0, 0.0)]
+            else:
+                points = P5_POINTS
+            out = ['G29 Auto Bed Leveling']
+            for x, y in points:
+                out.append(self.bed_line(x, y, self.probe_point(x, y)))
+                out.append(self.bed_line(x, y, self.probe_point(x, y)))
+            return out
+        if params.get('C') is not None:
+            # Odyssey G29 C1 extrapolates the mesh that is already there
+            return []
+        self.travel(self.position[0], self.position[1], 15.0)
+        out = ['G29 Auto Bed Leveling'] if self.firmFlag == 2 else []
+        self.mesh = [[None]*MESH_POINTS for ii in range(MESH_POINTS)]
+        start = -MESH_SPACING*(MESH_POINTS - 1)/2.0
+        for iy in range(MESH_POINTS):
+            for ix in range(MESH_POINTS):
+                x = start + ix*MESH_SPACING
+                y = start + iy*MESH_SPACING
+                if math.hypot(x, y) <= PROBE_RADIUS:
+                    self.mesh[iy][ix] = self.probe_point(x, y)
+                    out.append(self.bed_line(x, y, self.mesh[iy][ix]))
+        self.extrapolate_mesh()
+        if self.firmFlag == 2:
+            out.append('Bilinear Leveling Grid:')
+            out.append('      ' + ''.join('{0:>7d}'.format(ix) for ix in range(MESH_POINTS)))
+            for iy in range(MESH_POINTS):
+                out.append(' {0} '.format(iy) + ''.join('{0:+7.3f}'.format(z) for z in self.mesh[iy]))
+        return out
+
+    def extrapolate_mesh(self):
+        # Points outside the probe radius take the nearest probed value
+        known = [(ix, iy) for iy in range(MESH_POINTS) for ix in range(MESH_POINTS) if self.mesh[iy][ix] is not None]
+        for iy in range(MESH_POINTS):
+            for ix in range(MESH_POINTS):
+                if self.mesh[iy][ix] is None:
+                    kx, ky = min(known, key=lambda p: (p[0] - ix)**2 + (p[1] - iy)**2)
+                    self.mesh[iy][ix] = self.mesh[ky][kx]
+
+    def cmd_G33(self, params, line):
+        if self.firmFlag != 2:
+            return ['echo:Unknown command: "{0}"'.format(line)]
+        return self.auto_calibrate(params, 'T' in line[3:].upper().split())
+
+    # Settings
+
+    def cmd_M92(self, params, line):
+        for axis in 'XYZ':
+            if params.get(axis) is not None:
+                self.steps = params[axis]
+        return []
+
+    def cmd_M665(self, params, line):
+        if params.get('L') is not None:
+            self.firmware.rod = params['L']
+        if params.get('R') is not None:
+            self.firmware.radius = params['R']
+        if params.get('H') is not None and self.firmFlag > 0:
+            self.firmware.height = params['H']
+        if params.get('S') is not None:
+            self.segments = params['S']
+        if params.get('V') is not None and self.firmFlag == 2:
+            self.cal_radius = params['V']
+        for ii, axis in enumerate('XYZ'):
+            if params.get(axis) is not None and self.firmFlag > 0:
+                self.firmware.angles[ii] = params[axis]
+        if self.firmFlag == 1:
+            for ii, p in enumerate('ABC'):
+                if params.get(p) is not None:
+                    self.firmware.radius_trims[ii] = params[p]
+            # Marlin4MPMD's D, E and F are only stored and reported
+            for p in 'DEF':
+                if params.get(p) is not None:
+                    self.extras[p] = params[p]
+        return []
+
+    def cmd_M666(self, params, line):
+        for ii, axis in enumerate('XYZ'):
+            if params.get(axis) is not None:
+                self.firmware.endstops[ii] = params[axis]
+        return []
+
+    def cmd_M206(self, params, line):
+        for ii, axis in enumerate('XYZ'):
+            if params.get(axis) is not None:
+                self.home_offset[ii] = params[axis]
+        return []
+
+    def cmd_M851(self, params, line):
+        if params.get('Z') is not None:
+            self.probe_offset = params['Z']
+        return []
+
+    def cmd_M421(self, params, line):
+        if self.firmFlag == 0:
+            return ['echo:Unknown command: "{0}"'.format(line)]
+        if 'C' in params:
+            self.mesh = None
+            return []
+        if 'I' in params and 'J' in params and 'Z' in params and self.mesh is not None:
+            self.mesh[int(params['J'])][int(params['I'])] = params['Z']
+            return []
+        if self.mesh is None:
+            return ['echo:Mesh is empty']
+        out = ['Grid spacing: X{0:.2f} Y{0:.2f}'.format(MESH_SPACING)]
+        for row in self.mesh:
+            out.append(' '.join('{0:+.3f}'.format(z) for z in row))
+        return out
+
+    def cmd_M503(self, params, line):
+        f = self.firmware
+        if self.firmFlag == 0:
+            return []
+        if self.firmFlag == 1:
+            return ['echo:Steps per unit:',
+                    'echo:  M92 X{0:.2f} Y{0:.2f} Z{0:.2f} E97.00'.format(self.steps),
+                    'echo:Maximum feedrates (units/s):',
+                    'echo:  M203 X200.00 Y200.00 Z200.00 E30.00',
+                    'echo:Home offset (mm)',
+                    'echo:  M206 X{0:.2f} Y{1:.2f} Z{2:.2f}'.format(*self.home_offset),
+                    'echo:Endstop adjustment (mm):',
+                    'echo:  M666 X{0:.2f} Y{1:.2f} Z{2:.2f}'.format(*f.endstops),
+                    'echo:Delta settings: L=diagonal_rod, R=radius, H=height, S=segments_per_second, ABC=tower_radius_trim, XYZ=tower_angle_trim',
+                    'echo:  M665 L{0:.2f} R{1:.2f} H{2:.2f} S{3:.2f} A{4:.2f} B{5:.2f} C{6:.2f} D{7:.2f} E{8:.2f} F{9:.2f} X{10:.2f} Y{11:.2f} Z{12:.2f}'.format(
+                        f.rod, f.radius, f.height, self.segments, f.radius_trims[0], f.radius_trims[1], f.radius_trims[2],
+                        self.extras['D'], self.extras['E'], self.extras['F'], f.angles[0], f.angles[1], f.angles[2]),
+                    'echo:Z-Probe Offset (mm):',
+                    'echo:  M851 Z{0:.2f}'.format(self.probe_offset)]
+        return ['echo:  G21    ; Units in mm',
+                'echo:; Steps per unit:',
+                'echo: M92 X{0:.2f} Y{0:.2f} Z{0:.2f} E97.00'.format(self.steps),
+                'echo:; Maximum feedrates (units/s):',
+                'echo: M203 X200.00 Y200.00 Z200.00 E30.00',
+                'echo:; Endstop adjustment:',
+                'echo: M666 X{0:.2f} Y{1:.2f} Z{2:.2f}'.format(*f.endstops),
+                'echo:; Delta settings: L<diagonal_rod> R<radius> H<height> S<segments_per_s> V<calibration_radius> XYZ<tower_angle_corrections>',
+                'echo: M665 L{0:.2f} R{1:.2f} H{2:.2f} S{3:.2f} V{4:.2f} X{5:.2f} Y{6:.2f} Z{7:.2f}'.format(
+                    f.rod, f.radius, f.height, self.segments, self.cal_radius, f.angles[0], f.angles[1], f.angles[2]),
+                'echo:; Z-Probe Offset (mm):',
+                'echo: M851 Z{0:.2f}'.format(self.probe_offset)]
+
+    def cmd_M500(self, params, line):
+        return ['echo:Settings Stored'] if self.firmFlag > 0 else []
+
+    def cmd_M501(self, params, line):
+        return []
+
+    def cmd_M502(self, params, line):
+        self.factory_reset()
+        return ['echo:Hardcoded Default Settings Loaded'] if self.firmFlag > 0 else []
+
+    # Everything else the scripts send
+
+    def cmd_M110(self, params, line):
+        self.last_line = int(params.get('N') or 0)
+        return []
+
+    def cmd_M111(self, params, line):
+        return []
+
+    cmd_M17 = cmd_M18 = cmd_M84 = cmd_M111
+
+    def cmd_M400(self, params, line):
+        self.spend(0.0)
+        return []
+
+    def cmd_M114(self, params, line):
+        return ['X:{0:.2f} Y:{1:.2f} Z:{2:.2f} E:0.00'.format(*self.position)]
+
+    def cmd_M115(self, params, line):
+        return [M115_REPLIES[self.firmFlag]]
+
+    def cmd_M118(self, params, line):
+        text = line[4:].strip()
+        if text.upper().startswith('E1'):
+            return ['echo:' + text[2:].strip()]
+        return [text]
+
+    def cmd_M104(self, params, line):
+        if params.get('S') is not None:
+            self.set_heater('T', params['S'], line.upper().startswith('M109'))
+        return []
+
+    cmd_M109 = cmd_M104
+
+    def cmd_M140(self, params, line):
+        if params.get('S') is not None:
+            self.set_heater('B', params['S'], line.upper().startswith('M190'))
+        return []
+
+    cmd_M190 = cmd_M140
+
+    def cmd_M105(self, params, line):
+        return [self.temperature_report()]
+
+    # -------------------------------------------------------------------------
+    # G33 (Odyssey)
+    # -------------------------------------------------------------------------
+
+    def calibration_points(self, points):
+        # Center, tower and opposite points at the calibration radius
+        xy = [(0.0, 0.0)]
+        if points >= 2:
+            xy += [rect(self.cal_radius, a) for a in TOWER_ANGLES]
+        if points >= 3:
+            xy += [rect(self.cal_radius, a + 180.0) for a in TOWER_ANGLES]
+        return xy
+
+    def calibration_params(self, points, towers):
+        # What G33 Pn adjusts: height, then endstops and radius, then tower angles
+        names = ['H']
+        if points >= 2:
+            names += ['EX', 'EY', 'EZ', 'R']
+        if points >= 3 and towers:
+            names += ['TX', 'TY']
+        return names
+
+    def get_param(self, geometry, name):
+        if name == 'H':
+            return geometry.height
+        if name == 'R':
+            return geometry.radius
+        if name[0] == 'E':
+            return geometry.endstops['XYZ'.index(name[1])]
+        return geometry.angles['XYZ'.index(name[1])]
+
+    def set_param(self, geometry, name, value):
+        if name == 'H':
+            geometry.height = value
+        elif name == 'R':
+            geometry.radius = value
+        elif name[0] == 'E':
+            geometry.endstops['XYZ'.index(name[1])] = value
+        else:
+            geometry.angles['XYZ'.index(name[1])] = value
+
+    def ideal_probe(self, geometry, changed, x, y):
+        # Probe result the firmware expects on a flat bed if its settings
+        # were `geometry` and the machine matched `changed`
+        machine, firmware = self.machine, self.firmware
+        tilt, bowl, noise, offset = self.bed_tilt, self.bed_bowl, self.noise, self.probe_offset
+        position, steps = list(self.position), self.steps
+        self.machine, self.firmware = changed, geometry
+        self.bed_tilt, self.bed_bowl, self.noise, self.probe_offset = (0.0, 0.0), 0.0, 0.0, 0.0
+        self.machine.endstops = [0.0, 0.0, 0.0]
+        self.steps = self.true_steps
+        try:
+            return self.probe(x, y)
+        finally:
+            self.machine, self.firmware = machine, firmware
+            self.bed_tilt, self.bed_bowl, self.noise, self.probe_offset = tilt, bowl, noise, offset
+            self.position, self.steps = position, steps
+
+    def auto_calibrate(self, params, no_towers):
+        # Least squares on the firmware's own sensitivities, iterated like
+        # Marlin 1.1.9's G33 until the std dev reaches C or stops improving
+        points = int(params.get('P') if params.get('P') is not None else 4)
+        target = params.get('C') if params.get('C') is not None else 0.01
+        verbose = int(params.get('V') if params.get('V') is not None else 1)
+        xy = self.calibration_points(max(points, 1))
+        names = self.calibration_params(points, not no_towers)
+        out = ['G33 Auto Calibrate']
+        self.travel(0.0, 0.0, 15.0)
+
+        def measure():
+            z = [self.probe_point(x, y) for x, y in xy]
+            self.travel(0.0, 0.0, 15.0)
+            return z, math.sqrt(sum(v*v for v in z)/len(z))
+
+        z, std_dev = measure()
+        if max(abs(v) for v in z) > 20.0:
+            return out + ['Correct delta settings with M665 and M666']
+        out += self.G33_report('Checking... AC', std_dev, no_towers, verbose)
+        best = (std_dev, self.firmware.copy())
+        for iteration in range(1, 11):
+            if std_dev <= target:
+                break
+            self.G33_step(names, xy, z)
+            z, std_dev = measure()
+            if std_dev < best[0]:
+                best = (std_dev, self.firmware.copy())
+                out += self.G33_report('Iteration : {0:02d}'.format(iteration), std_dev, no_towers, verbose)
+            else:
+                self.firmware = best[1].copy()
+                out += self.G33_report('Iteration : {0:02d}'.format(iteration), None, no_towers, verbose)
+                break
+        std_dev = best[0]
+        if std_dev <= target:
+            out += self.G33_report('Calibration OK', std_dev, no_towers, verbose)
+        else:
+            out += self.G33_report('Calibration done', std_dev, no_towers, verbose)
+        out.append('Save with M500 and/or copy to Configuration.h')
+        self.cmd_G28({}, 'G28')
+        return out
+
+    def G33_step(self, names, xy, z):
+        # Solve J * delta = -z for the parameters in `names`
+        base = self.firmware.copy()
+        flat = self.firmware.copy()
+        ideal = [self.ideal_probe(base, flat, x, y) for x, y in xy]
+        step = 0.05
+        columns = []
+        for name in names:
+            changed = base.copy()
+            self.set_param(changed, name, self.get_param(changed, name) + step)
+            columns.append([(self.ideal_probe(changed, flat.copy(), x, y) - ideal[ii])/step
+                            for ii, (x, y) in enumerate(xy)])
+        n = len(names)
+        ata = [[sum(columns[a][k]*columns[b][k] for k in range(len(xy))) + (1e-6 if a == b else 0.0)
+                for b in range(n)] for a in range(n)]
+        atb = [-sum(columns[a][k]*z[k] for k in range(len(xy))) for a in range(n)]
+        delta = solve(ata, atb)
+        for name, d in zip(names, delta):
+            self.set_param(self.firmware, name, self.get_param(self.firmware, name) + d)
+        # Marlin keeps the endstop offsets at or below zero
+        top = max(self.firmware.endstops)
+        self.firmware.endstops = [e - top for e in self.firmware.endstops]
+        self.firmware.height -= top
+
+    def G33_report(self, title, std_dev, no_towers, verbose):
+        f = self.firmware
+        if std_dev is None:
+            out = ['{0:<50}rolling back.'.format(title)]
+        else:
+            out = ['{0:<50}std dev:{1:.3f}'.format(title, std_dev)]
+        out.append('.Height:{0:.2f}    Ex:{1:+.2f}  Ey:{2:+.2f}  Ez:{3:+.2f}    Radius:{4:.2f}'.format(
+            f.height, f.endstops[0], f.endstops[1], f.endstops[2], f.radius))
+        if not no_towers:
+            out.append('.Tower angle :    Tx:{0:+.2f}  Ty:{1:+.2f}  Tz:{2:+.2f}'.format(*f.angles))
+        return out
+
+def solve(a, b):
+    # Gaussian elimination with partial pivoting for the small G33 systems
+    n = len(b)
+    m = [list(a[ii]) + [b[ii]] for ii in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(m[r][col]))
+        m[col], m[pivot] = m[pivot], m[col]
+        if abs(m[col][col]) < 1e-12:
+            continue
+        for r in range(col + 1, n):
+            f = m[r][col]/m[col][col]
+            for c in range(col, n + 1):
+                m[r][c] -= f*m[col][c]
+    x = [0.0]*n
+    for r in range(n - 1, -1, -1):
+        if abs(m[r][r]) < 1e-12:
+            continue
+        x[r] = (m[r][n] - sum(m[r][c]*x[c] for c in range(r + 1, n)))/m[r][r]
+    return x
+
+# Seconds the pty has to stay quiet before the lines read so far count as
+# everything the host sent without waiting for a reply
+SETTLE = 0.002
+
+def serve(printer, master, time_scale=0):
+    # Answer every line written to the pty until it goes away.  With
+    # time_scale > 0 the printer's clock follows the wall clock that many
+    # times faster (1 = real time) and every reply waits until its time
+    # comes, time_scale = 0 answers at once and only counts printer.clock.
+    # Then the first line of every burst is taken to have waited for the
+    # last reply, and costs the printer a round trip of idle time.
+    start = time.monotonic()
+    buf = b''
+    while True:
+        try:
+            data = os.read(master, 4096)
+            while select.select([master], [], [], SETTLE)[0]:
+                more = os.read(master, 4096)
+                if not more:
+                    break
+                data += more
+        except OSError:
+            return
+        if not data:
+            return
+        buf += data.replace(b'\r', b'\n')
+        waited = time_scale == 0
+        while b'\n' in buf:
+            raw, buf = buf.split(b'\n', 1)
+            if time_scale > 0:
+                # Time the host spent between commands passes for the printer too
+                printer.clock = max(printer.clock, (time.monotonic() - start)*time_scale)
+            out = printer.handle(raw.decode(errors='replace'), waited and bool(raw.strip()))
+            if raw.strip():
+                waited = False
+            if time_scale > 0:
+                # Reports sent during a heating wait go out one by one
+                for clock, line in printer.timeline:
+                    delay = start + clock/time_scale - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    os.write(master, (line + '\n').encode())
+            elif out:
+                os.write(master, ('\n'.join(out) + '\n').encode())
+
+def start_virtual_printer(printer, link=None, time_scale=0):
+    # Open a pty for `printer` and answer it on a daemon thread.
+    # Returns the port name to hand to the calibration scripts.
+    import pty
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    name = os.ttyname(slave)
+    if link:
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(name, link)
+        name = link
+    thread = threading.Thread(target=serve, args=(printer, master, time_scale))
+    thread.daemon = True
+    thread.start()
+    # Keep the slave end open so the pty survives the scripts reconnecting
+    printer.pty = (master, slave)
+    return name
+
+def main():
+    parser = argparse.ArgumentParser(description='Virtual Monoprice Mini Delta on a pseudo-terminal')
+    parser.add_argument('-ff','--firmFlag',type=int,default=1,help='Firmware to imitate (0 = Stock; 1 = Marlin4MPMD; 2 = Odyssey)')
+    parser.add_argument('-l','--l_value',type=float,default=122.6,help='Real diagonal rod length')
+    parser.add_argument('-r','--r_value',type=float,default=63.9,help='Real delta radius')
+    parser.add_argument('-H','--height',type=float,default=120.3,help='Real height from the bed to the homed nozzle')
+    parser.add_argument('-ex','--endstop_x',type=float,default=0.25,help='Real X endstop error (mm)')
+    parser.add_argument('-ey','--endstop_y',type=float,default=-0.15,help='Real Y endstop error (mm)')
+    parser.add_argument('-ez','--endstop_z',type=float,default=0.0,help='Real Z endstop error (mm)')
+    parser.add_argument('-ax','--angle_x',type=float,default=0.3,help='Real X tower angle error (degrees)')
+    parser.add_argument('-ay','--angle_y',type=float,default=-0.2,help='Real Y tower angle error (degrees)')
+    parser.add_argument('-az','--angle_z',type=float,default=0.0,help='Real Z tower angle error (degrees)')
+    parser.add_argument('-tx','--tilt_x',type=float,default=0.02,help='Bed rise from X0 to X50 (mm)')
+    parser.add_argument('-ty','--tilt_y',type=float,default=-0.01,help='Bed rise from Y0 to Y50 (mm)')
+    parser.add_argument('-bw','--bowl',type=float,default=0.03,help='Bed rise from the center to 50 mm out (mm)')
+    parser.add_argument('-s','--step_mm',type=float,default=57.14,help='Real steps/mm, set the firmware with M92')
+    parser.add_argument('-n','--noise',type=float,default=0.005,help='Probe repeatability, standard deviation (mm)')
+    parser.add_argument('-sd','--seed',type=int,default=None,help='Random seed for the probe noise')
+    parser.add_argument('-lk','--link',type=str,default=None,help='Also reach the printer through this symlink, e.g. /tmp/ttyMPMD')
+    parser.add_argument('-tm','--timing',type=int,default=1,help='Model how long the printer takes (0 = off, every command is instant; 1 = on)')
+    parser.add_argument('-ts','--time_scale',type=float,default=0,help='Run the printer clock this many times faster than real time (1 = real time, 0 = never wait, only count the time)')
+    parser.add_argument('-fr','--feedrate',type=float,default=100.0,help='Maximum travel feedrate (mm/s)')
+    parser.add_argument('-ac','--acceleration',type=float,default=1000.0,help='Travel acceleration (mm/s^2)')
+    parser.add_argument('-hf','--homing_feedrate',type=float,default=60.0,help='Homing feedrate (mm/s)')
+    parser.add_argument('-pf','--probe_feedrate',type=float,default=5.0,help='Probe descent feedrate (mm/s)')
+    parser.add_argument('-pc','--probe_clearance',type=float,default=5.0,help='Height above the bed the probe starts from (mm)')
+    parser.add_argument('-hr','--hotend_rate',type=float,default=2.0,help='Hotend heating rate (degrees/s)')
+    parser.add_argument('-br','--bed_rate',type=float,default=0.4,help='Bed heating rate (degrees/s)')
+    parser.add_argument('-lat','--latency',type=float,default=2.0,help='Serial round trip latency per command (ms)')
+    parser.add_argument('-bd','--baud',type=int,default=115200,help='Baud rate the serial transfer time is worked out for')
+    parser.add_argument('-bs','--bufsize',type=int,default=4,help='Command slots, Marlin BUFSIZE (0 = unlimited)')
+    parser.add_argument('-le','--line_errors',type=float,default=0.0,help='Share of the numbered lines that arrive corrupted and are asked for again')
+    args = parser.parse_args()
+
+    timing = INSTANT
+    if args.timing > 0:
+        timing = PrinterTiming(args.feedrate, args.acceleration, args.homing_feedrate, args.probe_feedrate,
+                               args.probe_clearance, (args.hotend_rate, args.bed_rate), latency=args.latency/1000.0,
+                               baud=args.baud)
+
+    machine = DeltaGeometry(args.l_value, args.r_value, args.height,
+                            (args.endstop_x, args.endstop_y, args.endstop_z),
+                            (args.angle_x, args.angle_y, args.angle_z))
+    printer = VirtualPrinter(args.firmFlag, machine, args.step_mm, (args.tilt_x, args.tilt_y), args.bowl,
+                             args.noise, args.seed, timing, args.bufsize, args.line_errors)
+    name = start_virtual_printer(printer, args.link, args.time_scale)
+    print('Virtual {0} printer on {1}, Ctrl+C to stop'.format(FIRMWARE_NAMES[args.firmFlag], name))
+    try:
+        while True:
+            threading.Event().wait(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print('Printer time: {0:.1f} s'.format(printer.clock))
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+
+if __name__ == '__main__':
+    main()
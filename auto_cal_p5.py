@@ -1,893 +1,1237 @@
-#!/usr/bin/python
-
-# Updated version of the original script
-
-# Original Project Found here:
-# https://github.com/TechnoSwiss/MPMD-AutoBedLevel-Cal
-# This version was made to be compatible with Dennis Brown's G29 P5 Spreadsheet:
-# https://www.facebook.com/groups/mpminideltaowners/permalink/2186865287995612/
-# G29 P5 V4 Converted to manual probes for cross-firmware compatibility:
-# https://github.com/mcheah/Marlin4MPMD/wiki/Calibration#user-content-m665m666-delta-parameter-calibrations
-#
-# Full Instructions: https://www.facebook.com/groups/mpminideltaowners/permalink/2574670629215074/
-#
-# REQUIRES PYTHON3
-# REQUIRES SCIPY AND SERIAL
-#
-# sudo apt-get install python3-serial
-# sudo apt-get install python3-scipy
-#
-# Stock Firmware <=V41, V45 at 60 degrees C w/ Dennis's Defaults:
-# python3 auto_cal_p5.py -p /dev/ttyACM0 -ff 0 -tf 0 -r 63.5 -l 123.0 -s 57.14 -bt 60
-#
-# Stock V43 & V44 at 60 degrees C w/ Dennis's Defaults:
-# python3 auto_cal_p5.py -p /dev/ttyACM0 -ff 0 -tf 0 -r 63.5 -l 123.0 -s 114.28 -bt 60
-#
-# For Marlin, use the appropriate line for your stock firmware and replace "-ff 0" with "-ff 1"
-
-from serial import Serial, SerialException, PARITY_ODD, PARITY_NONE
-import sys
-import argparse
-import traceback
-import json
-import statistics
-import numpy as np
-from scipy.interpolate import griddata
-
-
-
-def establish_serial_connection(port, speed=115200, timeout=10, writeTimeout=10000):
-    # Hack for USB connection
-    # There must be a way to do it cleaner, but I can't seem to find it
-    try:
-        temp = Serial(port, speed, timeout=timeout, writeTimeout=writeTimeout, parity=PARITY_ODD)
-        if sys.platform == 'win32':
-            temp.close()
-        conn = Serial(port, speed, timeout=timeout, writeTimeout=writeTimeout, parity=PARITY_NONE)
-        conn.setRTS(False)#needed on mac
-        if sys.platform != 'win32':
-            temp.close()
-        return conn
-    except SerialException as e:
-        print ("Could not connect to {0} at baudrate {1}\nSerial error: {2}".format(port, str(speed), e))
-        return None
-    except IOError as e:
-        print ("Could not connect to {0} at baudrate {1}\nIO error: {2}".format(port, str(speed), e))
-        return None
-
-def get_points(port):
-    while True:
-        out = port.readline().decode()
-        if 'Bed ' in out:
-            break
-
-    return out.split(' ')
-
-def get_current_values(port, firmFlag):
-    # Replacing G29 P5 with manual probe points for cross-firmware compatibility
-    # G28 ; home
-    # G1 Z15 F6000; go to safe distance
-    # Start Loop
-    #     G1 X## Y##; go to specified location
-    #     G30 ;probe bed for z values
-    #     G30 ;probe bed again for z values
-    # End Loop
-    # G28 ; return home
-    
-    # Initialize G29 P5 V4 Table
-    number_cols = 7 
-    number_rows = 21
-    x_list = [None]*number_rows
-    y_list = [None]*number_rows
-    z1_list = [None]*number_rows
-    z2_list = [None]*number_rows
-    z_avg_list = [None]*number_rows
-    dtap_list = [None]*number_rows
-    dz_list = [None]*number_rows
-    dz_test = [None]*number_rows
-    
-    # Define Table Indices
-    ix = 0
-    iy = 1
-    iz1 = 2
-    iz2 = 3
-    izavg = 4 
-    idtap = 5
-    idz = 6
-    
-    # Assign X Coordinates (G29 P5)
-    x_list[0] = -25
-    x_list[1] = 0
-    x_list[2] = 25
-    x_list[3] = 50
-    x_list[4] = 25
-    x_list[5] = 0
-    x_list[6] = -25
-    x_list[7] = -50
-    x_list[8] = -50
-    x_list[9] = -25
-    x_list[10] = 0
-    x_list[11] = 25
-    x_list[12] = 50
-    x_list[13] = 50
-    x_list[14] = 25
-    x_list[15] = 0
-    x_list[16] = -25
-    x_list[17] = -50
-    x_list[18] = -25
-    x_list[19] = 0
-    x_list[20] = 25
-    
-    # Assign Y Coordinates (G29 P5)
-    y_list[0] = -50
-    y_list[1] = -50
-    y_list[2] = -50
-    y_list[3] = -25
-    y_list[4] = -25
-    y_list[5] = -25
-    y_list[6] = -25
-    y_list[7] = -25
-    y_list[8] = 0
-    y_list[9] = 0
-    y_list[10] = 0
-    y_list[11] = 0
-    y_list[12] = 0
-    y_list[13] = 25
-    y_list[14] = 25
-    y_list[15] = 25
-    y_list[16] = 25
-    y_list[17] = 25
-    y_list[18] = 50
-    y_list[19] = 50
-    y_list[20] = 50
-
-    # Send Gcodes
-    port.write(('G28\n').encode()) # Home
-    
-    if firmFlag == 1: 
-        # Marlin
-        port.write(('G1 Z15 F6000\n').encode()) # Move to safe distance
-    else:
-        # Stock Firmware
-        port.write(('G29 P5 V4\n').encode())
-
-        while True:
-            out = port.readline().decode()
-            #print("{0}\n".format(out))
-            if 'G29 Auto Bed Leveling' in out:
-                break
-        
-    # Loop through all 
-    for ii in range(len(x_list)):
-        
-        if firmFlag == 1: 
-            # Marlin
-            
-            # Move to desired position
-            port.write(('G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii])).encode()) 
-            #print('Sending G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii]))
-            
-            # Probe Z values
-            port.write(('G30\n').encode())
-            z_axis_1 = get_points(port)
-            port.write(('G30\n').encode())
-            z_axis_2 = get_points(port)
-        else:
-            # Stock Firmware
-            z_axis_1 = get_points(port)
-            z_axis_2 = get_points(port)
-        
-        # Populate most of the table values
-        z1_list[ii] = float(z_axis_1[6])
-        z2_list[ii] = float(z_axis_2[6])
-        z_avg_list[ii] = float("{0:.4f}".format((z1_list[ii] + z2_list[ii]) / 2.0))
-        dtap_list[ii] = z2_list[ii] - z1_list[ii]
-        #print('Received: X:{0} X:{1} Y:{2} Y:{3} Z1:{4} Z2:{5}\n\n'.format(str(x_list[ii]), str(z_axis_1[2]), str(y_list[ii]), str(z_axis_1[4]), z1_list[ii], z2_list[ii]))
-    
-    # Find the Median Reference
-    z_med = statistics.median(z_avg_list)
-    
-    # Calculate z diff
-    for ii in range(len(x_list)):
-        dz_list[ii] = z_avg_list[ii] - z_med
-        
-    # Empty out remaining lines for stock firmware
-    if firmFlag == 0: 
-        for ii in range(6):
-            out = port.readline().decode()
-    
-    return x_list, y_list, z1_list, z2_list, z_avg_list, dtap_list, dz_list
-
-def xyz_list2array(xl,yl,zl):
-    # Create Contour Lookup/Interpolation Function
-    coord_xy_list = []
-    coord_z_list = []
-    for ii in range(len(xl)):
-        coord_xy_list.append([float(xl[ii]),float(yl[ii])])
-        coord_z_list.append(float(zl[ii]))
-        
-    # Convert to Array
-    xy_array = np.array(coord_xy_list)
-    z_array = np.array(coord_z_list)
-    
-    return xy_array, z_array
-
-def linear_interp(x0, x1, z0, z1, xq):
-    zq = z0 + (xq-x0)*(z1-z0)/(x1-x0)
-    return zq
-    
-def calculate_contour(x_list, y_list, dz_list, runs, xhigh, yhigh, zhigh, minterp, tower_flag):
-    
-    # Redefine Lists
-    x_list_new = x_list.copy()
-    y_list_new = y_list.copy()
-    dz_list_new = dz_list.copy()
-    
-    # Define contour boundaries and steps
-    xmin = min(x_list_new)
-    xmax = max(x_list_new)
-    ymin = min(y_list_new)
-    ymax = max(y_list_new)
-    dprobe = 25.0; # Distance Betqeen Probe Points
-    ngrid = 3.0 # Grid Cell Spacing for the Contour
-    dx = dprobe/ngrid
-    dy = dx
-    nmax = int(round((ymax-ymin)/dy))
-    
-    # Create Contour Lookup/Interpolation Function
-    coord_xy, coord_z = xyz_list2array(x_list_new,y_list_new,dz_list_new)
-    
-    # Copy Equations from Dennis's Spreadsheet and put them in the lookup grid
-    # Put inside if statement incase we want to try other interpolation methods
-    # Anything other than 1 simply uses Python's griddata with the probed points.
-    if minterp == 1: 
-    
-        # Fill in based on known values across the horizontal
-        iside = -1
-        nknown = int(round((ymax-ymin)/dprobe))
-        for iy in range(nknown):
-            # Current Fixed Value
-            ytmp = ymin + float(iy)*dprobe
-            y0 = ytmp
-            y1 = ytmp
-            yq = ytmp
-            # Set Start/End indices for circular base
-            if ytmp == ymin or ytmp == ymax:
-                iStart = int(round(ngrid))
-                iEnd = nmax-int(round(ngrid))
-            else:
-                iStart = 0
-                iEnd = nmax-1
-            # Loop through all x-values
-            for ix in range(nmax): 
-                xq = xmin + float(ix)*dx
-                #print("x={0} y={1} ix={2} iy={3} mod={4} iStart = {5} iEnd = {6}\n\n".format(str(xq),str(yq),str(ix),str(iy),str(ix%ngrid),str(iStart),str(iEnd)))
-                if ix >= iStart and ix <= iEnd:
-                    if int(round(ix%ngrid)) == 0: # Set Known Values
-                        if ix == iStart:
-                            x0 = xmin + dx*float(ix)
-                            x1 = x0 + dprobe
-                            #print("iStart={0}\n".format(str(iStart)))
-                            #print("Known Point x0 = {0}".format(str(x0)))
-                        else:
-                            x0 = x1
-                            x1 = x0 + dprobe
-                            #print("Known Point\n")
-                            #print("Known Point x0 = {0}".format(str(x0)))
-                        z0 = float(griddata(coord_xy, coord_z, (x0   , y0)))
-                        z1 = float(griddata(coord_xy, coord_z, (x1   , y1)))
-                    else: #  Interpolate Between Known Values
-                        zq = linear_interp(x0, x1, z0, z1, xq)
-                        x_list_new.append(xq)
-                        y_list_new.append(yq)
-                        dz_list_new.append(zq)
-                        #print("Interp Test: {0} {1} {2}\n".format(str(xq),str(yq),str(zq)))
-                        #print("z0={0} z1={1}".format(str(z0),str(z1)))
-                #else:
-                    #print("Outside of grid\n")
-            
-        # Fill in based on known values across the vertical
-        nknown = int(round((xmax-xmin)/dprobe))
-        for ix in range(nknown):
-            # Current Fixed Value
-            xtmp = xmin + float(ix)*dprobe
-            x0 = xtmp
-            x1 = xtmp
-            xq = xtmp
-            # Set Start/End indices for circular base
-            if xtmp == xmin or xtmp == xmax:
-                iStart = int(round(ngrid))
-                iEnd = nmax-int(round(ngrid))
-            else:
-                iStart = 0
-                iEnd = nmax-1
-            # Loop through all y-values
-            for iy in range(nmax): 
-                yq = ymin + float(iy)*dy
-                #print("x={0} y={1} ix={2} iy={3} mod={4} iStart = {5} iEnd = {6}\n\n".format(str(xq),str(yq),str(ix),str(iy),str(ix%ngrid),str(iStart),str(iEnd)))
-                if iy >= iStart and iy <= iEnd:
-                    if int(round(iy%ngrid)) == 0: # Set Known Values
-                        if iy == iStart:
-                            y0 = ymin + dy*float(iy)
-                            y1 = y0 + dprobe
-                            #print("iStart={0}\n".format(str(iStart)))
-                            #print("Known Point y0 = {0} y1 = {1} yq = {2}".format(str(y0), str(y1), str(yq)))
-                        else:
-                            y0 = y1
-                            y1 = y0 + dprobe
-                            #print("Known Point\n")
-                            #print("Known Point y0 = {0} y1 = {1} yq = {2}".format(str(y0), str(y1), str(yq)))
-                        z0 = float(griddata(coord_xy, coord_z, (x0   , y0)))
-                        #print("x0={0} y0={1} z0={2}".format(str(x0), str(y0), str(z0)))
-                        z1 = float(griddata(coord_xy, coord_z, (x1   , y1)))
-                        #print("x1={0} y1={1} z1={2}".format(str(x1), str(y1), str(z1)))
-                    else: #  Interpolate Between Known Values
-                        zq = linear_interp(y0, y1, z0, z1, yq)
-                        x_list_new.append(xq)
-                        y_list_new.append(yq)
-                        dz_list_new.append(zq)
-                        #if xtmp == 0.0:
-                            #print("Interp Test: {0} {1} {2}".format(str(xq),str(yq),str(zq)))
-                            #print("z0={0} z1={1}\n".format(str(z0),str(z1)))
-                #else:
-                    #print("Outside of grid\n")
-            
-  
-        # Manually set corner points
-        # Top Left
-        L6 = float(griddata(coord_xy, coord_z, (-50.0, 25.0)))
-        O3 = float(griddata(coord_xy, coord_z, (-25.0, 50.0)))
-        x_list_new.append(-50.0+dx)
-        y_list_new.append(25.0+dy)
-        dz_list_new.append((O3-L6)/3.0+L6)
-        x_list_new.append(-50.0+2.0*dx)
-        y_list_new.append(25.0+2.0*dy)
-        dz_list_new.append((L6-O3)/3+O3)
-        # Top Right
-        X6 = float(griddata(coord_xy, coord_z, (50.0, 25.0)))
-        U3 = float(griddata(coord_xy, coord_z, (25.0, 50.0)))
-        x_list_new.append(50.0-dx)
-        y_list_new.append(25.0+dy)
-        dz_list_new.append((U3-X6)/3+X6)
-        x_list_new.append(50.0-2.0*dx)
-        y_list_new.append(25.0+2.0*dy)
-        dz_list_new.append((X6-U3)/3+U3)
-        # Bottom Right
-        X12 = float(griddata(coord_xy, coord_z, (50.0, -25.0)))
-        U15 = float(griddata(coord_xy, coord_z, (25.0, -50.0)))
-        x_list_new.append(50.0-dx)
-        y_list_new.append(-25.0-dy)
-        dz_list_new.append((U15-X12)/3+X12)
-        x_list_new.append(50.0-2.0*dx)
-        y_list_new.append(-25.0-2.0*dy)
-        dz_list_new.append((X12-U15)/3+U15)
-        # Bottom Left
-        L12 = float(griddata(coord_xy, coord_z, (-50.0, -25.0)))
-        O15 = float(griddata(coord_xy, coord_z, (-25.0, -50.0)))
-        x_list_new.append(-50.0+dx)
-        y_list_new.append(-25.0-dy)
-        dz_list_new.append((O15-L12)/3+L12)
-        x_list_new.append(-50.0+2.0*dx)
-        y_list_new.append(-25.0-2.0*dy)
-        dz_list_new.append((L12-O15)/3+O15)
-        
-        # Reset gridddata arrays now that we're using calculated values
-        coord_xy, coord_z = xyz_list2array(x_list_new,y_list_new,dz_list_new)
-        
-        # Fill in remaining points used in actual calculations
-        
-        # Tower X
-        M9 = float(griddata(coord_xy, coord_z, (-50.0+dx, 0.0)))
-        M12 = float(griddata(coord_xy, coord_z, (-50.0+dx, -25.0)))
-        x_list_new.append(-50.0+dx)
-        y_list_new.append(-25.0+dy)
-        dz_list_new.append((M9-M12)/3.0+M12)
-        #print("M9={0} M12={1} x={2} y={3} z={4}".format(str(M9),str(M12),str(-50.0+dx),str(-25.0+dy),str((M9-M12)/3.0+M12)))
-        
-        # Tower Y
-        W9 = float(griddata(coord_xy, coord_z, (50.0-dx, 0.0)))
-        W12 = float(griddata(coord_xy, coord_z, (50.0-dx, -25.0)))
-        x_list_new.append(50.0-dx)
-        y_list_new.append(-25.0+dy)
-        dz_list_new.append((W9-W12)/3.0+W12)
-        #print("W9={0} W12={1} x={2} y={3} z={4}".format(str(W9),str(W12),str(50.0-dx),str(-25.0+dy),str((W9-W12)/3.0+W12)))
-        
-        # Tower Z
-        Q3 = float(griddata(coord_xy, coord_z, (0.0-dx, 50.0)))
-        Q6 = float(griddata(coord_xy, coord_z, (0.0-dx, 25.0)))
-        x_list_new.append(0.0-dx)
-        y_list_new.append(50.0-dy)
-        dz_list_new.append((Q6-Q3)/3.0+Q3)
-        #print("Q3={0} Q6={1} x={2} y={3} z={4}".format(str(Q3),str(Q6),str(0.0-dx),str(50.0-dy),str((Q6-Q3)/3.0+Q3)))
-        S3 = float(griddata(coord_xy, coord_z, (0.0+dx, 50.0)))
-        S6 = float(griddata(coord_xy, coord_z, (0.0+dx, 25.0)))
-        x_list_new.append(0.0+dx)
-        y_list_new.append(50.0-dy)
-        dz_list_new.append((S6-S3)/3.0+S3)
-        #print("S3={0} S6={1} x={2} y={3} z={4}".format(str(Q3),str(Q6),str(0.0+dx),str(50.0-dy),str((S6-S3)/3.0+S3)))
-        
-        # Outside Ring
-        # No additional points
-        
-        # Center
-        Q9 = float(griddata(coord_xy, coord_z, (0.0-dx, 0.0)))
-        S9 = float(griddata(coord_xy, coord_z, (0.0+dx, 0.0)))
-        Q7 = (Q9-Q6)/3.0+Q6
-        S7 = (S9-S6)/3.0+S6
-        Q12 = float(griddata(coord_xy, coord_z, (0.0-dx, -25.0)))
-        S12 = float(griddata(coord_xy, coord_z, (0.0+dx, -25.0)))
-        x_list_new.append(0.0-dx)
-        y_list_new.append(0.0+dy)
-        dz_list_new.append((Q7-Q9)/2.0+Q9)
-        x_list_new.append(0.0+dx)
-        y_list_new.append(0.0+dy)
-        dz_list_new.append((S7-S9)/2.0+S9)
-        x_list_new.append(0.0-dx)
-        y_list_new.append(0.0-dy)
-        dz_list_new.append((Q12-Q9)/3.0+Q9)
-        x_list_new.append(0.0+dx)
-        y_list_new.append(0.0-dy)
-        dz_list_new.append((S12-S9)/3+S9)
-        
-        # Convert final values to Array
-        coord_xy, coord_z = xyz_list2array(x_list_new,y_list_new,dz_list_new)
-
-    
-    # North Tilt (opposite of LCD)
-    x0 = xmin
-    y0 = ymin/2
-    ntower = float(griddata(coord_xy, coord_z, (x0, y0)))
-    TN_list = [None]*5
-    TN_list[0] = float(griddata(coord_xy, coord_z, (x0   , y0)))
-    TN_list[1] = float(griddata(coord_xy, coord_z, (x0   , y0+dy)))
-    TN_list[2] = float(griddata(coord_xy, coord_z, (x0+dx, y0)))
-    TN_list[3] = float(griddata(coord_xy, coord_z, (x0+dx, y0+dy)))
-    TN_list[4] = float(griddata(coord_xy, coord_z, (x0+dx, y0-dy)))
-    #print("TN Values\n")
-    #print(*TN_list, sep='\n\n')
-    #print("\n")
-    TN = float(statistics.mean(TN_list))
-    
-    # West Tilt (left of LCD)
-    x0 = xmax
-    y0 = ymin/2
-    wtower = float(griddata(coord_xy, coord_z, (x0, y0)))
-    TW_list = [None]*5
-    TW_list[0] = float(griddata(coord_xy, coord_z, (x0   , y0)))
-    TW_list[1] = float(griddata(coord_xy, coord_z, (x0   , y0+dy)))
-    TW_list[2] = float(griddata(coord_xy, coord_z, (x0-dx, y0))) # problem
-    TW_list[3] = float(griddata(coord_xy, coord_z, (x0-dx, y0+dy)))
-    TW_list[4] = float(griddata(coord_xy, coord_z, (x0-dx, y0-dy)))
-    #print("TW Values\n")
-    #print(*TW_list, sep='\n\n')
-    #print("\n")
-    TW = float(statistics.mean(TW_list))
-    
-    # East Tilt (right of LCD)
-    x0 = 0.0
-    y0 = ymax
-    etower = float(griddata(coord_xy, coord_z, (x0, y0)))
-    TE_list = [None]*6
-    TE_list[0] = float(griddata(coord_xy, coord_z, (x0-dx, y0)))
-    TE_list[1] = float(griddata(coord_xy, coord_z, (x0   , y0)))
-    TE_list[2] = float(griddata(coord_xy, coord_z, (x0+dx, y0)))
-    TE_list[3] = float(griddata(coord_xy, coord_z, (x0-dx, y0-dy)))
-    TE_list[4] = float(griddata(coord_xy, coord_z, (x0   , y0-dy)))
-    TE_list[5] = float(griddata(coord_xy, coord_z, (x0+dx, y0-dy)))
-    #print("TE Values\n")
-    #print(*TE_list, sep='\n\n')
-    #print("\n")
-    TE = float(statistics.mean(TE_list))
-    
-    # Bowl Stats - Center
-    x0 = 0.0
-    y0 = 0.0
-    BC_list = [None]*9
-    BC_list[0] = float(griddata(coord_xy, coord_z, (x0-dx, y0+dy)))
-    BC_list[1] = float(griddata(coord_xy, coord_z, (x0   , y0+dy)))
-    BC_list[2] = float(griddata(coord_xy, coord_z, (x0+dx, y0+dy)))
-    BC_list[3] = float(griddata(coord_xy, coord_z, (x0-dx, y0)))
-    BC_list[4] = float(griddata(coord_xy, coord_z, (x0   , y0)))
-    BC_list[5] = float(griddata(coord_xy, coord_z, (x0+dx, y0)))
-    BC_list[6] = float(griddata(coord_xy, coord_z, (x0-dx, y0-dy)))
-    BC_list[7] = float(griddata(coord_xy, coord_z, (x0   , y0-dy)))
-    BC_list[8] = float(griddata(coord_xy, coord_z, (x0+dx, y0-dy)))
-    #print("Bowl Center: \n")
-    #print(*BC_list, sep='\n\n')
-    #print("\n")
-    BowlCenter = float(statistics.mean(BC_list))
-    
-    # Bowl Stats - Outside Ring
-    OR_list = [None]*12
-    # Left
-    OR_list[0]  = float(griddata(coord_xy, coord_z, (xmin, ymin/2.0)))
-    OR_list[1]  = float(griddata(coord_xy, coord_z, (xmin,   0.0)))
-    OR_list[2]  = float(griddata(coord_xy, coord_z, (xmin,  ymax/2.0)))
-    # Right
-    OR_list[3]  = float(griddata(coord_xy, coord_z, (xmax, ymin/2.0)))
-    OR_list[4]  = float(griddata(coord_xy, coord_z, (xmax,   0.0)))
-    OR_list[5]  = float(griddata(coord_xy, coord_z, (xmax,  ymax/2.0)))
-    # Top
-    OR_list[6]  = float(griddata(coord_xy, coord_z, (xmin/2.0,  ymax)))
-    OR_list[7]  = float(griddata(coord_xy, coord_z, (   0.0,  ymax)))
-    OR_list[8]  = float(griddata(coord_xy, coord_z, (xmax/2.0,  ymax)))
-    # Bottom
-    OR_list[9]  = float(griddata(coord_xy, coord_z, (xmin/2.0, ymin)))
-    OR_list[10] = float(griddata(coord_xy, coord_z, (   0.0, ymin)))
-    OR_list[11] = float(griddata(coord_xy, coord_z, (xmax/2.0, ymin)))
-    BowlOR = float(statistics.median(OR_list))
-    #print("Outer Ring Values: \n")
-    #print(*OR_list, sep='\n\n')
-    #print("\n")
-    #print("BowlOR = {0:.4f}".format(BowlOR))
-    
-    # Assign Towers to the current Tower X/Y/Z configuration (default is stock)
-    TX = TN
-    xtower = ntower
-    TY = TW
-    ytower = wtower
-    TZ = TE
-    ztower = etower
-    if tower_flag == 1: 
-        TX = TE
-        xtower = etower
-        TY = TN
-        ytower = ntower
-        TZ = TW
-        ztower = wtower
-    elif tower_flag == 2: 
-        TX = TW
-        xtower = wtower
-        TY = TE
-        ytower = etower
-        TZ = TN
-        ztower = ntower
-    
-    # Define Pass # according to the spreadsheet
-    pass_num = runs - 1
-    
-    if pass_num == 0:
-        # Check X Tower
-        if xtower > ytower and xtower > ztower:
-            xhigh[1] = 1
-            
-        # Check Y Tower
-        if ytower > xtower and ytower > ztower:
-            yhigh[1] = 1
-            
-        # Check Z Tower
-        if ztower > xtower and ztower > ytower:
-            zhigh[1] = 1
-            
-        # Save Values
-        xhigh[0] = xhigh[1]
-        yhigh[0] = yhigh[1]
-        zhigh[0] = zhigh[1]
-    else: 
-        xhigh[1] = 0
-        yhigh[1] = 0
-        zhigh[1] = 0
-
-    # Calculate High Parameter
-    iHighTower = -1
-    if xhigh[0] == 1:
-        THigh = TX
-        iHighTower = 0
-    elif yhigh[0] == 1:
-        THigh = TY
-        iHighTower = 1
-    else:
-        THigh = TZ
-        iHighTower = 2
-        
-    # Return Results
-    return TX, TY, TZ, THigh, BowlCenter, BowlOR, xhigh, yhigh, zhigh, iHighTower
-    
-    
-def determine_error(TX, TY, TZ, THigh, BowlCenter, BowlOR):
-    z_error = float("{0:.4f}".format(TZ - THigh))
-    x_error = float("{0:.4f}".format(TX - THigh))
-    y_error = float("{0:.4f}".format(TY - THigh))
-    c_error = float("{0:.4f}".format(BowlCenter - BowlOR))
-    print('Z-Error: ' + str(z_error) + ' X-Error: ' + str(x_error) + ' Y-Error: ' + str(y_error) + ' C-Error: ' + str(c_error) + '\n')
-
-    return z_error, x_error, y_error, c_error
-    
-
-def calibrate(port, z_error, x_error, y_error, c_error, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, max_runs, runs):
-    calibrated = True
-    if abs(z_error) >= 0.02:
-        if iHighTower == 2:
-            new_z = float("{0:.4f}".format(0.0))
-        else:
-            new_z = float("{0:.4f}".format(z_error + trial_z))
-        calibrated = False
-    else:
-        new_z = trial_z
-
-    if abs(x_error) >= 0.02:
-        if iHighTower == 0:
-            new_x = float("{0:.4f}".format(0.0))
-        else:
-            new_x = float("{0:.4f}".format(x_error + trial_x))
-        calibrated = False
-    else:
-        new_x = trial_x
-
-    if abs(y_error) >= 0.02:
-        if iHighTower == 1:
-            new_y = float("{0:.4f}".format(0.0))
-        else:
-            new_y = float("{0:.4f}".format(y_error + trial_y))
-        calibrated = False
-    else:
-        new_y = trial_y
-
-    if abs(c_error) >= 0.02:
-        new_r = float("{0:.4f}".format(r_value - 4.0*c_error))
-        calibrated = False
-    else:
-        new_r = r_value
-        
-    new_l = float("{0:.4f}".format(1.5*(new_r-r_value) + l_value))
-
-    # making sure I am sending the lowest adjustment value
-    #diff = 100
-    #for i in [new_z, new_x ,new_y]:
-    #    if abs(0-i) < diff:
-    #        diff = 0-i
-    #new_z += diff
-    #new_x += diff
-    #new_y += diff
-
-    if calibrated:
-        print ("Final values\nM666 Z{0} X{1} Y{2} \nM665 L{3} R{4}".format(str(new_z),str(new_x),str(new_y),str(new_l),str(new_r)))
-    else:
-        set_M_values(port, new_z, new_x, new_y, new_l, new_r)
-
-    return calibrated, new_z, new_x, new_y, new_l, new_r
-
-def set_M_values(port, z, x, y, l, r):
-
-    print ("Setting values M666 X{0} Y{1} Z{2}, M665 L{3} R{4}".format(str(x),str(y),str(z),str(l),str(r)))
-
-    port.write(('M666 X{0} Y{1} Z{2}\n'.format(str(x), str(y), str(z))).encode())
-    out = port.readline().decode()
-    port.write(('M665 L{0} R{1}\n'.format(str(l),str(r))).encode())
-    out = port.readline().decode()
-    
-def output_pass_text(runs, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, x_list, y_list, z1_list, z2_list): 
-
-    # Get the pass number corresponding to Dennis's spreadsheet
-    pass_num = int(runs-1)
-    
-    # Create the file
-    file_object  = open("auto_cal_p5_pass{0}.txt".format(str(pass_num)), "w")
-    
-    # Output current pass values
-    file_object.write("M666 X{0:.2f} Y{1:.2f} Z{2:.2f}\r\n".format(float(trial_x), float(trial_y), float(trial_z))) 
-    file_object.write("M665 L{0:.4f} R{1:.4f}\r\n".format(float(l_value), float(r_value))) 
-    file_object.write("\r\n") 
-    
-    # Highest Tower Value
-    if int(iHighTower) == 0:
-        file_object.write("Highest Tower: X\r\n") 
-    elif int(iHighTower) == 1:
-        file_object.write("Highest Tower: Y\r\n") 
-    else: 
-        file_object.write("Highest Tower: Z\r\n") 
-    
-    # Output Grid Points
-    file_object.write("\r\n") 
-    file_object.write("\r\n") 
-    file_object.write("< 01:02:03 PM: G29 Auto Bed Leveling\r\n") 
-    for ii in range(len(x_list)):
-        file_object.write("< 01:02:03 PM: Bed X: {0:.3f} Y: {1:.3f} Z: {2:.3f}\r\n".format(float(x_list[ii]), float(y_list[ii]), float(z1_list[ii]))) 
-        file_object.write("< 01:02:03 PM: Bed X: {0:.3f} Y: {1:.3f} Z: {2:.3f}\r\n".format(float(x_list[ii]), float(y_list[ii]), float(z2_list[ii]))) 
-    
-    # Close file stream
-    file_object.close() 
-    
-    return
-
-
-def run_calibration(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, xhigh, yhigh, zhigh, max_runs, max_error, bed_temp, minterp, tower_flag, runs=0):
-    runs += 1
-
-    if runs > max_runs:
-        sys.exit("Too many calibration attempts")
-    print('\nCalibration pass {1}, run {2} out of {0}'.format(str(max_runs), str(runs-1), str(runs)))
-    
-    # Make sure the bed doesn't go cold
-    if bed_temp >= 0: 
-        port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
-    
-    # Read G30 values and calculate values in columns B through H
-    x_list, y_list, z1_list, z2_list, z_avg_list, dtap_list, dz_list = get_current_values(port, firmFlag)
-    
-    # Generate the P5 contour map
-    TX, TY, TZ, THigh, BowlCenter, BowlOR, xhigh, yhigh, zhigh, iHighTower = calculate_contour(x_list, y_list, dz_list, runs, xhigh, yhigh, zhigh, minterp, tower_flag)
-    
-    # Output current pass results
-    output_pass_text(runs, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, x_list, y_list, z1_list, z2_list)
-    
-    # Output Debugging Info
-    #file_object  = open("debug_pass{0:d}.csv".format(int(runs-1)), "w")
-    #file_object.write("X,Y,Z1,Z2,Z avg,Tap diff,Z diff,TX,TY,TZ,THigh,BowlCenter,BowlOR\r\n") 
-    #z_med = statistics.median(z_avg_list)
-    #for ii in range(len(x_list)):
-    #    dz_list[ii] = z_avg_list[ii] - z_med
-    #    file_object.write("{0:.4f},{1:.4f},{2:.4f},{3:.4f},".format(float(x_list[ii]),float(y_list[ii]),float(z1_list[ii]),float(z2_list[ii])))
-    #    file_object.write("{0:.4f},{1:.4f},{2:.4f},".format(float(z_avg_list[ii]),float(dtap_list[ii]),float(dz_list[ii])))
-    #    file_object.write("{0:.4f},{1:.4f},{2:.4f},{3:.4f},{4:.4f},{5:.4f}\r\n".format(float(TX),float(TY),float(TZ),float(THigh),float(BowlCenter),float(BowlOR)))
-    #file_object.close() 
-    
-    # Calculate Error
-    z_error, x_error, y_error, c_error = determine_error(TX, TY, TZ, THigh, BowlCenter, BowlOR)
-    
-    if abs(max([z_error, x_error, y_error, c_error], key=abs)) > max_error and runs > 1:
-        sys.exit("Calibration error on non-first run exceeds set limit")
-
-    calibrated, new_z, new_x, new_y, new_l, new_r = calibrate(port, z_error, x_error, y_error, c_error, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, max_runs, runs)
-    
-    if calibrated:
-        print ("Calibration complete")
-    else:
-        calibrated, new_z, new_x, new_y, new_l, new_r, xhigh, yhigh, zhigh = run_calibration(port, firmFlag, new_x, new_y, new_z, new_l, new_r, xhigh, yhigh, zhigh, max_runs, max_error, bed_temp, minterp, tower_flag, runs)
-
-    return calibrated, new_z, new_x, new_y, new_l, new_r, xhigh, yhigh, zhigh
-
-def main():
-    # Default values
-    max_runs = 14
-    max_error = 1
-
-    x0 = 0.0
-    y0 = 0.0
-    z0 = 0.0
-    trial_x = x0
-    trial_y = y0
-    trial_z = z0
-    r_value = 63.5
-    step_mm = 57.14
-    l_value = 123.0
-    xhigh = [0]*2
-    yhigh = [0]*2
-    zhigh = [0]*2
-    bed_temp = -1
-    minterp = 0
-    firmFlag = 0
-    tower_flag = 0
-
-    parser = argparse.ArgumentParser(description='Auto-Bed Cal. for Monoprice Mini Delta')
-    parser.add_argument('-p','--port',help='Serial port',required=True)
-    parser.add_argument('-x','--x0',type=float,default=x0,help='Starting x-value')
-    parser.add_argument('-y','--y0',type=float,default=y0,help='Starting y-value')
-    parser.add_argument('-z','--z0',type=float,default=z0,help='Starting z-value')
-    parser.add_argument('-r','--r-value',type=float,default=r_value,help='Starting r-value')
-    parser.add_argument('-l','--l-value',type=float,default=l_value,help='Starting l-value')
-    parser.add_argument('-s','--step-mm',type=float,default=step_mm,help='Set steps-/mm')
-    parser.add_argument('-me','--max-error',type=float,default=max_error,help='Maximum acceptable calibration error on non-first run')
-    parser.add_argument('-mr','--max-runs',type=int,default=max_runs,help='Maximum attempts to calibrate printer')
-    parser.add_argument('-bt','--bed-temp',type=int,default=bed_temp,help='Bed Temperature')
-    parser.add_argument('-im','--minterp',type=int,default=minterp,help='Intepolation Method')
-    parser.add_argument('-ff','--firmFlag',type=int,default=firmFlag,help='Firmware Flag (0 = Stock; 1 = Marlin)')
-    parser.add_argument('-tf','--tower_flag',type=int,default=tower_flag,help='Tower Flag (0 = Stock and old Marlin; 1 = Marlin 1.3.3, 2 = experimental)')
-    parser.add_argument('-f','--file',type=str,dest='file',default=None,
-        help='File with settings, will be updated with latest settings at the end of the run')
-    args = parser.parse_args()
-
-    port = establish_serial_connection(args.port)        
-
-    if args.file:
-        try:
-            with open(args.file) as data_file:
-                settings = json.load(data_file)
-            tower_flag = int(settings.get('tower_flag', tower_flag))
-            firmFlag = int(settings.get('firmFlag', firmFlag))
-            minterp = int(settings.get('minterp', minterp))
-            bed_temp = int(settings.get('bed_temp', bed_temp))
-            max_runs = int(settings.get('max_runs', max_runs))
-            max_error = float(settings.get('max_error', max_error))
-            trial_z = float(settings.get('z', trial_z))
-            trial_x = float(settings.get('x', trial_x))
-            trial_y = float(settings.get('y', trial_y))
-            r_value = float(settings.get('r', r_value))
-            l_value = float(settings.get('l', l_value))
-            step_mm = float(settings.get('step', step_mm))
-
-        except:
-            tower_flag = args.tower_flag
-            firmFlag = args.firmFlag
-            minterp = args.minterp
-            bed_temp = args.bed_temp
-            max_error = args.max_error
-            max_runs = args.max_runs
-            trial_z = args.z0
-            trial_x = args.x0
-            trial_y = args.y0
-            r_value = args.r_value
-            step_mm = args.step_mm
-            max_runs = args.max_runs
-            l_value = args.l_value
-            pass
-    else: 
-        tower_flag = args.tower_flag
-        firmFlag = args.firmFlag
-        minterp = args.minterp
-        bed_temp = args.bed_temp
-        max_error = args.max_error
-        max_runs = args.max_runs
-        trial_z = args.z0
-        trial_x = args.x0
-        trial_y = args.y0
-        r_value = args.r_value
-        step_mm = args.step_mm
-        max_runs = args.max_runs
-        l_value = args.l_value
-        
-    if port:
-    
-        # Firmware
-        if firmFlag == 0:
-            print("Using Monoprice Firmware\n")
-        elif firmFlag == 1:
-            print("Using Marlin Firmware\n")
-            
-        # Tower Setup
-        if tower_flag == 0:
-            print("Stock Tower Setup (X opposite of LCD)\n")
-        elif tower_flag == 1:
-            print("Altered Tower Setup (Y opposite of LCD)\n")
-        elif tower_flag == 2:
-            print("Experimental Tower Setup (Z opposite of LCD)\n")
-    
-        #Set Bed Temperature
-        if bed_temp >= 0:
-            print ('Setting bed temperature to {0} C\n'.format(str(bed_temp)))
-            port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
-            out = port.readline().decode()
-            
-        # Display interpolation methods
-        if minterp == 1: 
-            print("Interpolation Method: Dennis's Spreadsheet\n")
-        else:
-            print("Interpolation Method: python3 scipy.interpolate.griddata\n")
-    
-        # Set the proper step/mm
-        print ('Setting up M92 X{0} Y{0} Z{0}\n'.format(str(step_mm)))
-        port.write(('M92 X{0} Y{0} Z{0}\n'.format(str(step_mm))).encode())
-        out = port.readline().decode()
-        
-        print ('Setting up M665 L{0} R{1}\n'.format(str(l_value),str(r_value)))
-        port.write(('M665 L{0} R{1}\n'.format(str(l_value),str(r_value))).encode())
-        out = port.readline().decode()
-
-        if firmFlag == 1:
-            print ('Setting up M206 X0 Y0 Z0\n')
-            port.write('M206 X0 Y0 Z0\n'.encode())
-            out = port.readline().decode()
-        
-            print ('Clearing mesh with M421 C\n')
-            port.write('M421 C\n'.encode())
-            out = port.readline().decode()
-
-        set_M_values(port, trial_z, trial_x, trial_y, l_value, r_value)
-
-        print ('\nStarting calibration')
-
-        calibrated, new_z, new_x, new_y, new_l, new_r, xhigh, yhigh, zhigh = run_calibration(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, xhigh, yhigh, zhigh, max_runs, args.max_error, bed_temp, minterp, tower_flag)
-
-        port.close()
-
-        if calibrated:
-            if firmFlag == 1:
-                print ('Run mesh bed leveling before printing: G29\n')
-            if args.file:
-                data = {'z':new_z, 'x':new_x, 'y':new_y, 'r':new_r, 'l': new_l, 'step':step_mm, 'max_runs':max_runs, 'max_error':max_error, 'bed_temp':bed_temp}
-                with open(args.file, "w") as text_file:
-                    text_file.write(json.dumps(data))
-
-
-if __name__ == '__main__':
-    main()
+#!/usr/bin/python
+
+# Updated version of the original script
+
+# Original Project Found here:
+# https://github.com/TechnoSwiss/MPMD-AutoBedLevel-Cal
+# This version was made to be compatible with Dennis Brown's G29 P5 Spreadsheet:
+# https://www.facebook.com/groups/mpminideltaowners/permalink/2186865287995612/
+# G29 P5 V4 Converted to manual probes for cross-firmware compatibility:
+# https://github.com/mcheah/Marlin4MPMD/wiki/Calibration#user-content-m665m666-delta-parameter-calibrations
+#
+# Full Instructions: https://www.facebook.com/groups/mpminideltaowners/permalink/2574670629215074/
+#
+# REQUIRES PYTHON3
+# REQUIRES SCIPY AND SERIAL
+# REQUIRES advanced/auto_cal_common.py NEXT TO THIS SCRIPT (keep the repository layout)
+#
+# sudo apt-get install python3-serial
+# sudo apt-get install python3-scipy
+#
+# Stock Firmware <=V41, V45 at 60 degrees C w/ Dennis's Defaults:
+# python3 auto_cal_p5.py -p /dev/ttyACM0 -ff 0 -tf 0 -r 63.5 -l 123.0 -s 57.14 -bt 60
+#
+# Stock V43 & V44 at 60 degrees C w/ Dennis's Defaults:
+# python3 auto_cal_p5.py -p /dev/ttyACM0 -ff 0 -tf 0 -r 63.5 -l 123.0 -s 114.28 -bt 60
+#
+# For Marlin, use the appropriate line for your stock firmware and replace "-ff 0" with "-ff 1"
+
+import sys
+import argparse
+import traceback
+import json
+import os
+import statistics
+import asyncio
+from collections import deque, namedtuple
+import numpy as np
+from scipy.interpolate import LinearNDInterpolator
+from scipy.spatial import Delaunay
+
+# The printer connection is shared with advanced/auto_cal_generic.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'advanced'))
+from auto_cal_common import (establish_serial_connection, PrinterSession, SettingsShadow, classify_line, parse_probe,
+                             LINE_PROBE, LINE_ACK, LINE_TEMPERATURE, LINE_SETTINGS, LINE_OTHER, LINE_KINDS, line_flag,
+                             PORT_CACHE, FIRMWARE_NAMES, BAUD_RATES, classify_firmware, load_port_cache,
+                             OPERATOR_CACHE, operator_key, cached_operator,
+                             discover_printers, print_discovered, cached_firmware, negotiate_baud, get_points,
+                             report_timing, write_metrics)
+
+
+
+def get_probe_points():
+    # G29 P5 probe locations
+    number_rows = 21
+    x_list = [None]*number_rows
+    y_list = [None]*number_rows
+    
+    # Assign X Coordinates (G29 P5)
+    x_list[0] = -25
+    x_list[1] = 0
+    x_list[2] = 25
+    x_list[3] = 50
+    x_list[4] = 25
+    x_list[5] = 0
+    x_list[6] = -25
+    x_list[7] = -50
+    x_list[8] = -50
+    x_list[9] = -25
+    x_list[10] = 0
+    x_list[11] = 25
+    x_list[12] = 50
+    x_list[13] = 50
+    x_list[14] = 25
+    x_list[15] = 0
+    x_list[16] = -25
+    x_list[17] = -50
+    x_list[18] = -25
+    x_list[19] = 0
+    x_list[20] = 25
+    
+    # Assign Y Coordinates (G29 P5)
+    y_list[0] = -50
+    y_list[1] = -50
+    y_list[2] = -50
+    y_list[3] = -25
+    y_list[4] = -25
+    y_list[5] = -25
+    y_list[6] = -25
+    y_list[7] = -25
+    y_list[8] = 0
+    y_list[9] = 0
+    y_list[10] = 0
+    y_list[11] = 0
+    y_list[12] = 0
+    y_list[13] = 25
+    y_list[14] = 25
+    y_list[15] = 25
+    y_list[16] = 25
+    y_list[17] = 25
+    y_list[18] = 50
+    y_list[19] = 50
+    y_list[20] = 50
+
+    return x_list, y_list
+
+def get_current_values(port, firmFlag):
+    # Replacing G29 P5 with manual probe points for cross-firmware compatibility
+    # G28 ; home
+    # G1 Z15 F6000; go to safe distance
+    # Start Loop
+    #     G1 X## Y##; go to specified location
+    #     G30 ;probe bed for z values
+    #     G30 ;probe bed again for z values
+    # End Loop
+    # G28 ; return home
+    
+    x_list, y_list = get_probe_points()
+    number_rows = len(x_list)
+    z1_list = [None]*number_rows
+    z2_list = [None]*number_rows
+
+    # Pipelined Marlin: queue every move and probe up front. The port only
+    # blocks when the printer's command buffer is full, so the Bed lines
+    # stream back while later commands are still being sent.
+    pipelined = firmFlag == 1 and port.window > 0
+
+    # Send Gcodes
+    with port.timer.phase('homing'):
+        port.write(('G28\n').encode()) # Home
+        
+        if firmFlag == 1: 
+            # Marlin
+            port.write(('G1 Z15 F6000\n').encode()) # Move to safe distance
+            # Pipelined homing is timed with the probing, waiting here would
+            # empty the command buffer
+            if not pipelined:
+                port.drain()
+        else:
+            # Stock Firmware
+            port.write(('G29 P5 V4\n').encode())
+            port.wait_for(LINE_OTHER, b'G29 Auto Bed Leveling')
+        
+    with port.timer.phase('probing'):
+        if pipelined:
+            for ii in range(len(x_list)):
+                port.write(('G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii])).encode()) 
+                port.write(('G30\n').encode())
+                port.write(('G30\n').encode())
+
+        # Loop through all 
+        for ii in range(len(x_list)):
+            
+            if pipelined:
+                z_axis_1 = get_points(port)
+                z_axis_2 = get_points(port)
+            elif firmFlag == 1: 
+                # Marlin
+                
+                # Move to desired position
+                port.write(('G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii])).encode()) 
+                #print('Sending G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii]))
+                
+                # Probe Z values
+                port.write(('G30\n').encode())
+                z_axis_1 = get_points(port)
+                port.write(('G30\n').encode())
+                z_axis_2 = get_points(port)
+            else:
+                # Stock Firmware
+                z_axis_1 = get_points(port)
+                z_axis_2 = get_points(port)
+            
+            # Populate most of the table values
+            z1_list[ii] = z_axis_1.z
+            z2_list[ii] = z_axis_2.z
+            #print('Received: X:{0} X:{1} Y:{2} Y:{3} Z1:{4} Z2:{5}\n\n'.format(str(x_list[ii]), str(z_axis_1[2]), str(y_list[ii]), str(z_axis_1[4]), z1_list[ii], z2_list[ii]))
+    
+        # Let the stock firmware finish G29 before sending anything else
+        if firmFlag == 0: 
+            port.drain()
+
+    z_avg_list, dtap_list, dz_list = summarize_points(z1_list, z2_list)
+    
+    return x_list, y_list, z1_list, z2_list, z_avg_list, dtap_list, dz_list
+
+def summarize_points(z1_list, z2_list):
+    # Tap average, tap difference and offset from the median for each point
+    number_rows = len(z1_list)
+    z_avg_list = [None]*number_rows
+    dtap_list = [None]*number_rows
+    dz_list = [None]*number_rows
+    for ii in range(number_rows):
+        z_avg_list[ii] = float("{0:.4f}".format((z1_list[ii] + z2_list[ii]) / 2.0))
+        dtap_list[ii] = z2_list[ii] - z1_list[ii]
+    
+    # Find the Median Reference
+    z_med = statistics.median(z_avg_list)
+    
+    # Calculate z diff
+    for ii in range(number_rows):
+        dz_list[ii] = z_avg_list[ii] - z_med
+        
+    return z_avg_list, dtap_list, dz_list
+
+def xyz_list2array(xl,yl,zl):
+    # Create Contour Lookup/Interpolation Function
+    coord_xy_list = []
+    coord_z_list = []
+    for ii in range(len(xl)):
+        coord_xy_list.append([float(xl[ii]),float(yl[ii])])
+        coord_z_list.append(float(zl[ii]))
+        
+    # Convert to Array
+    xy_array = np.array(coord_xy_list)
+    z_array = np.array(coord_z_list)
+    
+    return xy_array, z_array
+
+def linear_interp(x0, x1, z0, z1, xq):
+    zq = z0 + (xq-x0)*(z1-z0)/(x1-x0)
+    return zq
+    
+def contour_lookup(coord_xy, coord_z, points):
+    # griddata() for every (x, y) in points with a single triangulation,
+    # coord_xy may also be that triangulation
+    interpolate = LinearNDInterpolator(coord_xy, coord_z)
+    return [float(z) for z in interpolate(np.array(points, dtype=float))]
+
+SpreadsheetStencil = namedtuple('SpreadsheetStencil', ['probe_tri', 'known', 'lo', 'hi', 'q', 'q0', 'q1',
+                                                       'corner_a', 'corner_b', 'corner_tri', 'lookups',
+                                                       'center_a', 'center_b', 'final_a', 'final_b', 'final_d', 'final_tri'])
+spreadsheet_stencils = {}
+
+def spreadsheet_stencil(x_list, y_list):
+    # Everything in Dennis's spreadsheet that only depends on the probe
+    # pattern: the points every stage interpolates at, which values they come
+    # from and the triangulation each stage looks them up in
+    key = tuple(zip(x_list, y_list))
+    if key in spreadsheet_stencils:
+        return spreadsheet_stencils[key]
+    
+    # Same grid as the original -im 1 loop (advanced/check_spreadsheet.py),
+    # so the segments come out in the same order
+    xmin = min(x_list)
+    xmax = max(x_list)
+    ymin = min(y_list)
+    ymax = max(y_list)
+    dprobe = 25.0
+    ngrid = 3.0
+    dx = dprobe/ngrid
+    dy = dx
+    nmax = int(round((ymax-ymin)/dy))
+    segments = []
+    for horizontal in (True, False):
+        fixed_min, fixed_max = (ymin, ymax) if horizontal else (xmin, xmax)
+        run_min = xmin if horizontal else ymin
+        for ifixed in range(int(round((fixed_max-fixed_min)/dprobe))):
+            fixed = fixed_min + float(ifixed)*dprobe
+            if fixed == fixed_min or fixed == fixed_max:
+                iStart = int(round(ngrid))
+                iEnd = nmax-int(round(ngrid))
+            else:
+                iStart = 0
+                iEnd = nmax-1
+            for irun in range(iStart, iEnd + 1):
+                run = run_min + float(irun)*dx
+                if int(round(irun%ngrid)) == 0:
+                    # A segment starts where the one before it on this line ended
+                    start = run_min + dx*float(irun) if irun == iStart else segments[-1][1]
+                    segments.append((start, start + dprobe, fixed, horizontal, []))
+                else:
+                    segments[-1][4].append(run)
+    
+    # Known values at both ends of every segment, then the corner points L6, O3, X6, U3, X12, U15, L12, O15
+    known = []
+    lo, hi, q, q0, q1, segment_xy = [], [], [], [], [], []
+    for start, end, fixed, horizontal, runs in segments:
+        known += [(start, fixed), (end, fixed)] if horizontal else [(fixed, start), (fixed, end)]
+        for run in runs:
+            lo.append(len(known) - 2)
+            hi.append(len(known) - 1)
+            q.append(run)
+            q0.append(start)
+            q1.append(end)
+            segment_xy.append((run, fixed) if horizontal else (fixed, run))
+    L6, O3, X6, U3, X12, U15, L12, O15 = range(len(known), len(known) + 8)
+    known += [(-50.0, 25.0), (-25.0, 50.0), (50.0, 25.0), (25.0, 50.0),
+              (50.0, -25.0), (25.0, -50.0), (-50.0, -25.0), (-25.0, -50.0)]
+    
+    # Corner point values are (a - b)/3 + b
+    corner_xy = [(-50.0+dx, 25.0+dy), (-50.0+2.0*dx, 25.0+2.0*dy), (50.0-dx, 25.0+dy), (50.0-2.0*dx, 25.0+2.0*dy),
+                 (50.0-dx, -25.0-dy), (50.0-2.0*dx, -25.0-2.0*dy), (-50.0+dx, -25.0-dy), (-50.0+2.0*dx, -25.0-2.0*dy)]
+    corner_a = [O3, L6, U3, X6, U15, X12, O15, L12]
+    corner_b = [L6, O3, X6, U3, X12, U15, L12, O15]
+    probe_xy = [(float(x), float(y)) for x, y in zip(x_list, y_list)]
+    
+    # Lookups against the probe, segment and corner points, then Q7 and S7 from them
+    M9, M12, W9, W12, Q3, Q6, S3, S6, Q9, S9, Q12, S12, Q7, S7 = range(14)
+    lookups = [(-50.0+dx, 0.0), (-50.0+dx, -25.0), (50.0-dx, 0.0), (50.0-dx, -25.0),
+               (0.0-dx, 50.0), (0.0-dx, 25.0), (0.0+dx, 50.0), (0.0+dx, 25.0),
+               (0.0-dx, 0.0), (0.0+dx, 0.0), (0.0-dx, -25.0), (0.0+dx, -25.0)]
+    
+    # Tower X, Tower Y, Tower Z and center values are (a - b)/d + b
+    final_xy = [(-50.0+dx, -25.0+dy), (50.0-dx, -25.0+dy), (0.0-dx, 50.0-dy), (0.0+dx, 50.0-dy),
+                (0.0-dx, 0.0+dy), (0.0+dx, 0.0+dy), (0.0-dx, 0.0-dy), (0.0+dx, 0.0-dy)]
+    final_a = [M9, W9, Q6, S6, Q7, S7, Q12, S12]
+    final_b = [M12, W12, Q3, S3, Q9, S9, Q9, S9]
+    final_d = [3.0, 3.0, 3.0, 3.0, 2.0, 2.0, 3.0, 3.0]
+    
+    stencil = SpreadsheetStencil(Delaunay(np.array(probe_xy)), np.array(known), np.array(lo), np.array(hi),
+                                 np.array(q), np.array(q0), np.array(q1), np.array(corner_a), np.array(corner_b),
+                                 Delaunay(np.array(probe_xy + segment_xy + corner_xy)), np.array(lookups),
+                                 np.array([Q9, S9]), np.array([Q6, S6]), np.array(final_a), np.array(final_b), np.array(final_d),
+                                 Delaunay(np.array(probe_xy + segment_xy + corner_xy + final_xy)))
+    spreadsheet_stencils[key] = stencil
+    return stencil
+
+def spreadsheet_points(x_list, y_list, dz_list):
+    # Dennis's spreadsheet points and values, a stage at a time through the
+    # stencil for this pattern.  The points come back as their triangulation,
+    # which contour_lookup() takes in place of the coordinates.
+    stencil = spreadsheet_stencil(x_list, y_list)
+    dz = np.array(dz_list, dtype=float)
+    zknown = LinearNDInterpolator(stencil.probe_tri, dz)(stencil.known)
+    z0 = zknown[stencil.lo]
+    z1 = zknown[stencil.hi]
+    z = np.concatenate((dz, z0 + (stencil.q-stencil.q0)*(z1-z0)/(stencil.q1-stencil.q0),
+                        (zknown[stencil.corner_a]-zknown[stencil.corner_b])/3.0+zknown[stencil.corner_b]))
+    zs = LinearNDInterpolator(stencil.corner_tri, z)(stencil.lookups)
+    zs = np.concatenate((zs, (zs[stencil.center_a]-zs[stencil.center_b])/3.0+zs[stencil.center_b]))
+    z_final = (zs[stencil.final_a]-zs[stencil.final_b])/stencil.final_d+zs[stencil.final_b]
+    return stencil.final_tri, np.concatenate((z, z_final))
+
+def contour_samples(x_list, y_list, dz_list, minterp):
+    # The 37 contour heights the tower and bowl metrics are taken from
+    
+    # Define contour boundaries and steps
+    xmin = min(x_list)
+    xmax = max(x_list)
+    ymin = min(y_list)
+    ymax = max(y_list)
+    dprobe = 25.0; # Distance Betqeen Probe Points
+    ngrid = 3.0 # Grid Cell Spacing for the Contour
+    dx = dprobe/ngrid
+    dy = dx
+    
+    # Dennis's Spreadsheet fills in the points the samples are interpolated from.
+    # Anything other than 1 simply uses Python's griddata with the probed points.
+    if minterp == 1:
+        coord_xy, coord_z = spreadsheet_points(x_list, y_list, dz_list)
+    else:
+        coord_xy, coord_z = xyz_list2array(x_list, y_list, dz_list)
+
+    # Tower and bowl samples, all from the final points
+    # North Tilt (opposite of LCD)
+    x0 = xmin
+    y0 = ymin/2
+    TN_points = [(x0, y0), (x0, y0+dy), (x0+dx, y0), (x0+dx, y0+dy), (x0+dx, y0-dy)]
+    
+    # West Tilt (left of LCD)
+    x0 = xmax
+    y0 = ymin/2
+    TW_points = [(x0, y0), (x0, y0+dy), (x0-dx, y0), (x0-dx, y0+dy), (x0-dx, y0-dy)]
+    
+    # East Tilt (right of LCD)
+    x0 = 0.0
+    y0 = ymax
+    TE_points = [(x0-dx, y0), (x0, y0), (x0+dx, y0), (x0-dx, y0-dy), (x0, y0-dy), (x0+dx, y0-dy)]
+    
+    # Bowl Stats - Center
+    x0 = 0.0
+    y0 = 0.0
+    BC_points = [(x0-dx, y0+dy), (x0, y0+dy), (x0+dx, y0+dy),
+                 (x0-dx, y0),    (x0, y0),    (x0+dx, y0),
+                 (x0-dx, y0-dy), (x0, y0-dy), (x0+dx, y0-dy)]
+    
+    # Bowl Stats - Outside Ring: left, right, top, bottom
+    OR_points = [(xmin, ymin/2.0), (xmin, 0.0), (xmin, ymax/2.0),
+                 (xmax, ymin/2.0), (xmax, 0.0), (xmax, ymax/2.0),
+                 (xmin/2.0, ymax), (0.0, ymax), (xmax/2.0, ymax),
+                 (xmin/2.0, ymin), (0.0, ymin), (xmax/2.0, ymin)]
+    
+    return contour_lookup(coord_xy, coord_z, TN_points + TW_points + TE_points + BC_points + OR_points)
+
+def contour_rows(samples):
+    # Tower and bowl rows from the contour samples, BowlOR is the median of the OR rows
+    TN_list = samples[0:5]
+    TW_list = samples[5:10]
+    TE_list = samples[10:16]
+    BC_list = samples[16:25]
+    OR_list = samples[25:37]
+    
+    # Tower heights are the first sample of TN/TW and the middle one of TE
+    return [statistics.mean(TN_list), statistics.mean(TW_list), statistics.mean(TE_list), statistics.mean(BC_list),
+            TN_list[0], TW_list[0], TE_list[1]] + list(OR_list)
+
+# calculate_contour() is one product with the weight matrix of the probe
+# pattern and interpolation method, see CONTOUR_ROWS in auto_cal_common.py
+CONTOUR_METHODS = {0: 'p5-griddata', 1: 'p5-spreadsheet'}
+contour_operators = {}
+
+def contour_operator(x_list, y_list, minterp, cache_file=OPERATOR_CACHE):
+    # Weight matrix for this pattern and method, from memory, the cache file or built
+    method = CONTOUR_METHODS.get(minterp, CONTOUR_METHODS[0])
+    key = operator_key(method, x_list, y_list)
+    if key not in contour_operators:
+        minterp = 1 if method == 'p5-spreadsheet' else 0
+        contour_operators[key] = np.array(cached_operator(method, x_list, y_list, lambda dz_list:
+            contour_rows(contour_samples(list(x_list), list(y_list), dz_list, minterp)), cache_file))
+    return contour_operators[key]
+
+def apply_contour_operator(weights, dz):
+    # TN, TW, TE, BowlCenter, ntower, wtower, etower, BowlOR for one probe set,
+    # or as columns for a (sets, points) array of them
+    rows = np.asarray(dz, dtype=float).dot(weights.T)
+    return tuple(rows[..., :7].T) + (np.median(rows[..., 7:], axis=-1),)
+
+def calculate_contour(x_list, y_list, dz_list, runs, xhigh, yhigh, zhigh, minterp, tower_flag):
+    
+    # One product with the precompiled operator for this pattern
+    weights = contour_operator(x_list, y_list, minterp)
+    TN, TW, TE, BowlCenter, ntower, wtower, etower, BowlOR = [float(v) for v in apply_contour_operator(weights, dz_list)]
+    TX, TY, TZ, xtower, ytower, ztower = rotate_tower_values(TN, TW, TE, ntower, wtower, etower, tower_flag)
+    
+    # Define Pass # according to the spreadsheet
+    pass_num = runs - 1
+    
+    if pass_num == 0:
+        # Check X Tower
+        if xtower > ytower and xtower > ztower:
+            xhigh[1] = 1
+            
+        # Check Y Tower
+        if ytower > xtower and ytower > ztower:
+            yhigh[1] = 1
+            
+        # Check Z Tower
+        if ztower > xtower and ztower > ytower:
+            zhigh[1] = 1
+            
+        # Save Values
+        xhigh[0] = xhigh[1]
+        yhigh[0] = yhigh[1]
+        zhigh[0] = zhigh[1]
+    else: 
+        xhigh[1] = 0
+        yhigh[1] = 0
+        zhigh[1] = 0
+
+    # Calculate High Parameter
+    iHighTower = -1
+    if xhigh[0] == 1:
+        THigh = TX
+        iHighTower = 0
+    elif yhigh[0] == 1:
+        THigh = TY
+        iHighTower = 1
+    else:
+        THigh = TZ
+        iHighTower = 2
+        
+    # Return Results
+    return TX, TY, TZ, THigh, BowlCenter, BowlOR, xhigh, yhigh, zhigh, iHighTower
+
+# Rotate the towers according to M665 X Y Z
+def rotate_tower_values(TN, TW, TE, ntower, wtower, etower, tower_flag): 
+    # Assign Towers to the current Tower X/Y/Z configuration (default is stock)
+    TX = TN
+    xtower = ntower
+    TY = TW
+    ytower = wtower
+    TZ = TE
+    ztower = etower
+    if tower_flag == 1: 
+        TX = TE
+        xtower = etower
+        TY = TN
+        ytower = ntower
+        TZ = TW
+        ztower = wtower
+    elif tower_flag == 2: 
+        TX = TW
+        xtower = wtower
+        TY = TE
+        ytower = etower
+        TZ = TN
+        ztower = ntower
+    return TX, TY, TZ, xtower, ytower, ztower
+
+ContourBatch = namedtuple('ContourBatch', ['TX', 'TY', 'TZ', 'THigh', 'BowlCenter', 'BowlOR', 'iHighTower'])
+
+def calculate_contour_batch(x_list, y_list, dz_array, minterp, tower_flag, iHighTower=None):
+    # calculate_contour() for a (sets, points) array of dz values probed on
+    # one pattern, every field a (sets,) array, and no xhigh/yhigh/zhigh to
+    # update.  The high tower is found as on the first pass unless
+    # iHighTower gives it, for all sets or one per set.
+    weights = contour_operator(x_list, y_list, minterp)
+    TN, TW, TE, BowlCenter, ntower, wtower, etower, BowlOR = apply_contour_operator(weights, np.atleast_2d(dz_array))
+    TX, TY, TZ, xtower, ytower, ztower = rotate_tower_values(TN, TW, TE, ntower, wtower, etower, tower_flag)
+    if iHighTower is None:
+        iHighTower = np.where((xtower > ytower) & (xtower > ztower), 0,
+                              np.where((ytower > xtower) & (ytower > ztower), 1, 2))
+    iHighTower = np.broadcast_to(np.asarray(iHighTower), TX.shape)
+    THigh = np.choose(iHighTower, (TX, TY, TZ))
+    return ContourBatch(TX, TY, TZ, THigh, BowlCenter, BowlOR, iHighTower)
+    
+    
+def determine_error(TX, TY, TZ, THigh, BowlCenter, BowlOR):
+    z_error = float("{0:.4f}".format(TZ - THigh))
+    x_error = float("{0:.4f}".format(TX - THigh))
+    y_error = float("{0:.4f}".format(TY - THigh))
+    c_error = float("{0:.4f}".format(BowlCenter - BowlOR))
+    print('Z-Error: ' + str(z_error) + ' X-Error: ' + str(x_error) + ' Y-Error: ' + str(y_error) + ' C-Error: ' + str(c_error) + '\n')
+
+    return z_error, x_error, y_error, c_error
+    
+
+def calibrate_values(z_error, x_error, y_error, c_error, trial_x, trial_y, trial_z, l_value, r_value, iHighTower):
+    # New M666/M665 values for the measured errors, no printer I/O
+    calibrated = True
+    if abs(z_error) >= 0.02:
+        if iHighTower == 2:
+            new_z = float("{0:.4f}".format(0.0))
+        else:
+            new_z = float("{0:.4f}".format(z_error + trial_z))
+        calibrated = False
+    else:
+        new_z = trial_z
+
+    if abs(x_error) >= 0.02:
+        if iHighTower == 0:
+            new_x = float("{0:.4f}".format(0.0))
+        else:
+            new_x = float("{0:.4f}".format(x_error + trial_x))
+        calibrated = False
+    else:
+        new_x = trial_x
+
+    if abs(y_error) >= 0.02:
+        if iHighTower == 1:
+            new_y = float("{0:.4f}".format(0.0))
+        else:
+            new_y = float("{0:.4f}".format(y_error + trial_y))
+        calibrated = False
+    else:
+        new_y = trial_y
+
+    if abs(c_error) >= 0.02:
+        new_r = float("{0:.4f}".format(r_value - 4.0*c_error))
+        calibrated = False
+    else:
+        new_r = r_value
+        
+    new_l = float("{0:.4f}".format(1.5*(new_r-r_value) + l_value))
+
+    # making sure I am sending the lowest adjustment value
+    #diff = 100
+    #for i in [new_z, new_x ,new_y]:
+    #    if abs(0-i) < diff:
+    #        diff = 0-i
+    #new_z += diff
+    #new_x += diff
+    #new_y += diff
+
+    return calibrated, new_z, new_x, new_y, new_l, new_r
+
+def calibrate(port, z_error, x_error, y_error, c_error, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, max_runs, runs):
+    with port.timer.phase('calibrate', compute=True):
+        calibrated, new_z, new_x, new_y, new_l, new_r = calibrate_values(z_error, x_error, y_error, c_error, trial_x, trial_y, trial_z, l_value, r_value, iHighTower)
+
+    if calibrated:
+        print ("Final values\nM666 Z{0} X{1} Y{2} \nM665 L{3} R{4}".format(str(new_z),str(new_x),str(new_y),str(new_l),str(new_r)))
+    else:
+        with port.timer.phase('settings'):
+            set_M_values(port, new_z, new_x, new_y, new_l, new_r)
+
+    return calibrated, new_z, new_x, new_y, new_l, new_r
+
+def set_M_values(port, z, x, y, l, r):
+
+    print ("Setting values M666 X{0} Y{1} Z{2}, M665 L{3} R{4}".format(str(x),str(y),str(z),str(l),str(r)))
+
+    for gcode in M_values_gcode(z, x, y, l, r):
+        port.write(gcode)
+        if port.window == 0:
+            port.drain()
+
+def M_values_gcode(z, x, y, l, r):
+    return [('M666 X{0} Y{1} Z{2}\n'.format(str(x), str(y), str(z))).encode(),
+            ('M665 L{0} R{1}\n'.format(str(l),str(r))).encode()]
+    
+def output_pass_text(runs, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, x_list, y_list, z1_list, z2_list, prefix='', repeat=0): 
+
+    # Get the pass number corresponding to Dennis's spreadsheet
+    pass_num = int(runs-1)
+    
+    # Create the file, repeat calibrations (-rc) get their own numbering
+    repeat_tag = '_r{0}'.format(str(repeat)) if repeat > 0 else ''
+    file_object  = open("{0}auto_cal_p5{1}_pass{2}.txt".format(prefix, repeat_tag, str(pass_num)), "w")
+    
+    # Output current pass values
+    file_object.write("M666 X{0:.2f} Y{1:.2f} Z{2:.2f}\r\n".format(float(trial_x), float(trial_y), float(trial_z))) 
+    file_object.write("M665 L{0:.4f} R{1:.4f}\r\n".format(float(l_value), float(r_value))) 
+    file_object.write("\r\n") 
+    
+    # Highest Tower Value
+    if int(iHighTower) == 0:
+        file_object.write("Highest Tower: X\r\n") 
+    elif int(iHighTower) == 1:
+        file_object.write("Highest Tower: Y\r\n") 
+    else: 
+        file_object.write("Highest Tower: Z\r\n") 
+    
+    # Output Grid Points
+    file_object.write("\r\n") 
+    file_object.write("\r\n") 
+    file_object.write("< 01:02:03 PM: G29 Auto Bed Leveling\r\n") 
+    for ii in range(len(x_list)):
+        file_object.write("< 01:02:03 PM: Bed X: {0:.3f} Y: {1:.3f} Z: {2:.3f}\r\n".format(float(x_list[ii]), float(y_list[ii]), float(z1_list[ii]))) 
+        file_object.write("< 01:02:03 PM: Bed X: {0:.3f} Y: {1:.3f} Z: {2:.3f}\r\n".format(float(x_list[ii]), float(y_list[ii]), float(z2_list[ii]))) 
+    
+    # Close file stream
+    file_object.close() 
+    
+    return
+
+
+def run_calibration(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, xhigh, yhigh, zhigh, max_runs, max_error, bed_temp, minterp, tower_flag, runs=0, repeat=0):
+    runs += 1
+
+    if runs > max_runs:
+        sys.exit("Too many calibration attempts")
+    print('\nCalibration pass {1}, run {2} out of {0}'.format(str(max_runs), str(runs-1), str(runs)))
+    port.timer.next_pass('{0}pass {1}'.format('r{0} '.format(str(repeat)) if repeat > 0 else '', str(runs-1)))
+    if runs == 1:
+        port.timer.eta.new_calibration()
+    
+    # Make sure the bed doesn't go cold
+    if bed_temp >= 0: 
+        with port.timer.phase('heating'):
+            port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
+    
+    # Read G30 values and calculate values in columns B through H
+    x_list, y_list, z1_list, z2_list, z_avg_list, dtap_list, dz_list = get_current_values(port, firmFlag)
+    
+    # Generate the P5 contour map
+    with port.timer.phase('contour', compute=True):
+        TX, TY, TZ, THigh, BowlCenter, BowlOR, xhigh, yhigh, zhigh, iHighTower = calculate_contour(x_list, y_list, dz_list, runs, xhigh, yhigh, zhigh, minterp, tower_flag)
+    
+    # Output current pass results
+    with port.timer.phase('output'):
+        output_pass_text(runs, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, x_list, y_list, z1_list, z2_list, repeat=repeat)
+    
+    # Output Debugging Info
+    #file_object  = open("debug_pass{0:d}.csv".format(int(runs-1)), "w")
+    #file_object.write("X,Y,Z1,Z2,Z avg,Tap diff,Z diff,TX,TY,TZ,THigh,BowlCenter,BowlOR\r\n") 
+    #z_med = statistics.median(z_avg_list)
+    #for ii in range(len(x_list)):
+    #    dz_list[ii] = z_avg_list[ii] - z_med
+    #    file_object.write("{0:.4f},{1:.4f},{2:.4f},{3:.4f},".format(float(x_list[ii]),float(y_list[ii]),float(z1_list[ii]),float(z2_list[ii])))
+    #    file_object.write("{0:.4f},{1:.4f},{2:.4f},".format(float(z_avg_list[ii]),float(dtap_list[ii]),float(dz_list[ii])))
+    #    file_object.write("{0:.4f},{1:.4f},{2:.4f},{3:.4f},{4:.4f},{5:.4f}\r\n".format(float(TX),float(TY),float(TZ),float(THigh),float(BowlCenter),float(BowlOR)))
+    #file_object.close() 
+    
+    # Calculate Error
+    with port.timer.phase('calibrate', compute=True):
+        z_error, x_error, y_error, c_error = determine_error(TX, TY, TZ, THigh, BowlCenter, BowlOR)
+    port.timer.counter('error', x=x_error, y=y_error, z=z_error, c=c_error)
+    port.timer.eta.report(*port.timer.eta.update([z_error, x_error, y_error, c_error], max_runs - runs))
+    
+    if abs(max([z_error, x_error, y_error, c_error], key=abs)) > max_error and runs > 1:
+        sys.exit("Calibration error on non-first run exceeds set limit")
+
+    calibrated, new_z, new_x, new_y, new_l, new_r = calibrate(port, z_error, x_error, y_error, c_error, trial_x, trial_y, trial_z, l_value, r_value, iHighTower, max_runs, runs)
+    
+    if calibrated:
+        print ("Calibration complete")
+    else:
+        calibrated, new_z, new_x, new_y, new_l, new_r, xhigh, yhigh, zhigh = run_calibration(port, firmFlag, new_x, new_y, new_z, new_l, new_r, xhigh, yhigh, zhigh, max_runs, max_error, bed_temp, minterp, tower_flag, runs, repeat)
+
+    return calibrated, new_z, new_x, new_y, new_l, new_r, xhigh, yhigh, zhigh
+
+class AsyncPrinterLink(object):
+    """asyncio counterpart of PrinterLink.
+
+    The serial port is read from the event loop itself (add_reader on POSIX,
+    a short polling task elsewhere), so one loop can stream probe results,
+    temperature reports and logging for several printers without a thread
+    per device.  Lines are sorted into the same LINE_* kinds, the same ok
+    counting limits the commands in flight and oks and temperature reports
+    are only queued while held.  Line numbers and checksums are not
+    supported here.
+    """
+
+    def __init__(self, conn, window=0):
+        self.conn = conn
+        self.window = window
+        self.in_flight = 0
+        self.queues = dict((kind, deque()) for kind in LINE_KINDS)
+        self.held = set()
+        self.seq = 0
+        self.closed = False
+        self.shadow = SettingsShadow()
+        self.buffer = b''
+        self.changed = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
+        self.poller = None
+
+    def start(self):
+        self.conn.timeout = 0
+        try:
+            self.loop.add_reader(self.conn.fileno(), self._read)
+        except (NotImplementedError, AttributeError):
+            self.poller = self.loop.create_task(self._poll())
+
+    async def _poll(self):
+        while not self.closed:
+            self._read()
+            await asyncio.sleep(0.01)
+
+    def _read(self):
+        try:
+            data = self.conn.read(self.conn.in_waiting or 1)
+        except Exception:
+            print('Lost the serial connection to {0}'.format(self.conn.port))
+            self.close()
+            return
+        self.buffer += data
+        while b'\n' in self.buffer:
+            out, self.buffer = self.buffer.split(b'\n', 1)
+            out += b'\n'
+            kind = classify_line(out)
+            if kind == LINE_ACK:
+                self.in_flight = max(self.in_flight - 1, 0)
+            elif kind == LINE_SETTINGS:
+                self.shadow.update(out)
+            if kind in (LINE_ACK, LINE_TEMPERATURE) and kind not in self.held:
+                continue
+            self.seq += 1
+            self.queues[kind].append((self.seq, out))
+        self.changed.set()
+
+    async def _changed(self, timeout=None):
+        # Event-loop callbacks cannot run between a check and this clear()
+        self.changed.clear()
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def write(self, data):
+        while self.window > 0 and self.in_flight >= self.window and not self.closed:
+            await self._changed()
+        self.in_flight += 1
+        self.shadow.update_command(data)
+        return self.conn.write(data)
+
+    async def wait_for(self, kinds, match=None, timeout=None):
+        # Next line of the given kind(s) containing `match`, b'' on timeout
+        if not isinstance(kinds, tuple):
+            kinds = (kinds,)
+        deadline = None if timeout is None else self.loop.time() + timeout
+        while True:
+            oldest = None
+            for kind in kinds:
+                if self.queues[kind] and (oldest is None or self.queues[kind][0][0] < self.queues[oldest][0][0]):
+                    oldest = kind
+            if oldest is not None:
+                seq, out = self.queues[oldest].popleft()
+                if match is None or match in out:
+                    return out
+                continue
+            if self.closed or (deadline is not None and self.loop.time() >= deadline):
+                return b''
+            await self._changed(None if deadline is None else deadline - self.loop.time())
+
+    async def drain(self, timeout=None):
+        # Wait until the printer has acknowledged everything we sent
+        deadline = None if timeout is None else self.loop.time() + timeout
+        while self.in_flight > 0 and not self.closed:
+            if deadline is not None and self.loop.time() >= deadline:
+                return False
+            await self._changed(None if deadline is None else deadline - self.loop.time())
+        return True
+
+    async def wait_ready(self, timeout=30, interval=1):
+        # PrinterLink.wait_ready() without the latency samples: returns the
+        # M115 FIRMWARE_NAME line ('' if none), or None without an answer
+        deadline = self.loop.time() + timeout
+        self.held.add(LINE_ACK)
+        while self.loop.time() < deadline and not self.closed:
+            self.conn.write(b'M115\n')
+            if await self.wait_for(LINE_ACK, timeout=interval):
+                break
+        else:
+            self.held.discard(LINE_ACK)
+            self.queues[LINE_ACK].clear()
+            return None
+        self.held.discard(LINE_ACK)
+        firmware = ''
+        for kind in LINE_KINDS:
+            for seq, out in self.queues[kind]:
+                if b'FIRMWARE_NAME' in out:
+                    firmware = out.decode(errors='replace').strip()
+            self.queues[kind].clear()
+        self.in_flight = 0
+        return firmware
+
+    def close(self):
+        self.closed = True
+        if self.poller is not None:
+            self.poller.cancel()
+        else:
+            try:
+                self.loop.remove_reader(self.conn.fileno())
+            except Exception:
+                pass
+        self.conn.close()
+        self.changed.set()
+
+async def get_points_async(port):
+    # get_points() on an AsyncPrinterLink, None once the connection is gone
+    # (or for an unreadable line)
+    return parse_probe(await port.wait_for(LINE_PROBE))
+
+async def get_current_values_async(port, firmFlag):
+    # get_current_values() on an AsyncPrinterLink, None if the connection
+    # was lost while probing
+    x_list, y_list = get_probe_points()
+    z1_list = [None]*len(x_list)
+    z2_list = [None]*len(x_list)
+
+    await port.write(('G28\n').encode()) # Home
+    if firmFlag == 1:
+        await port.write(('G1 Z15 F6000\n').encode()) # Move to safe distance
+    else:
+        await port.write(('G29 P5 V4\n').encode())
+        await port.wait_for(LINE_OTHER, b'G29 Auto Bed Leveling')
+
+    pipelined = firmFlag == 1 and port.window > 0
+    if pipelined:
+        for ii in range(len(x_list)):
+            await port.write(('G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii])).encode())
+            await port.write(('G30\n').encode())
+            await port.write(('G30\n').encode())
+
+    for ii in range(len(x_list)):
+        if firmFlag == 1 and not pipelined:
+            await port.write(('G1 X{0} Y{1}\n'.format(x_list[ii], y_list[ii])).encode())
+            await port.write(('G30\n').encode())
+            z_axis_1 = await get_points_async(port)
+            await port.write(('G30\n').encode())
+            z_axis_2 = await get_points_async(port)
+        else:
+            z_axis_1 = await get_points_async(port)
+            z_axis_2 = await get_points_async(port)
+        if z_axis_1 is None or z_axis_2 is None:
+            return None
+        z1_list[ii] = z_axis_1.z
+        z2_list[ii] = z_axis_2.z
+
+    z_avg_list, dtap_list, dz_list = summarize_points(z1_list, z2_list)
+    await port.drain()
+
+    return x_list, y_list, z1_list, z2_list, z_avg_list, dtap_list, dz_list
+
+async def send_async(port, gcode):
+    # Without a window, wait for every command's ok like the setup in main()
+    await port.write(gcode)
+    if port.window == 0:
+        await port.drain()
+
+async def set_M_values_async(port, z, x, y, l, r, label=''):
+    print ("{5}Setting values M666 X{0} Y{1} Z{2}, M665 L{3} R{4}".format(str(x),str(y),str(z),str(l),str(r),label))
+    for gcode in M_values_gcode(z, x, y, l, r):
+        await send_async(port, gcode)
+
+async def run_calibration_async(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, max_runs, max_error, bed_temp, minterp, tower_flag, name=''):
+    # run_calibration() as a loop on an AsyncPrinterLink.  Failures return
+    # calibrated = False instead of exiting, the other printers keep going.
+    # With several printers, `name` tags the output and the pass files.
+    label = '[{0}] '.format(name) if name else ''
+    prefix = '{0}_'.format(name) if name else ''
+    xhigh = [0]*2
+    yhigh = [0]*2
+    zhigh = [0]*2
+    new_z, new_x, new_y, new_l, new_r = trial_z, trial_x, trial_y, l_value, r_value
+    for runs in range(1, max_runs + 1):
+        print('\n{3}Calibration pass {1}, run {2} out of {0}'.format(str(max_runs), str(runs-1), str(runs), label))
+
+        # Make sure the bed doesn't go cold
+        if bed_temp >= 0:
+            await port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
+
+        values = await get_current_values_async(port, firmFlag)
+        if values is None:
+            print('{0}Lost connection to printer while probing'.format(label))
+            return False, new_z, new_x, new_y, new_l, new_r
+        x_list, y_list, z1_list, z2_list, z_avg_list, dtap_list, dz_list = values
+        TX, TY, TZ, THigh, BowlCenter, BowlOR, xhigh, yhigh, zhigh, iHighTower = calculate_contour(x_list, y_list, dz_list, runs, xhigh, yhigh, zhigh, minterp, tower_flag)
+        output_pass_text(runs, new_x, new_y, new_z, new_l, new_r, iHighTower, x_list, y_list, z1_list, z2_list, prefix)
+
+        z_error, x_error, y_error, c_error = determine_error(TX, TY, TZ, THigh, BowlCenter, BowlOR)
+        if abs(max([z_error, x_error, y_error, c_error], key=abs)) > max_error and runs > 1:
+            print('{0}Calibration error on non-first run exceeds set limit'.format(label))
+            return False, new_z, new_x, new_y, new_l, new_r
+
+        calibrated, new_z, new_x, new_y, new_l, new_r = calibrate_values(z_error, x_error, y_error, c_error, new_x, new_y, new_z, new_l, new_r, iHighTower)
+        if calibrated:
+            print ("{5}Final values\nM666 Z{0} X{1} Y{2} \nM665 L{3} R{4}".format(str(new_z),str(new_x),str(new_y),str(new_l),str(new_r),label))
+            return True, new_z, new_x, new_y, new_l, new_r
+        await set_M_values_async(port, new_z, new_x, new_y, new_l, new_r, label)
+
+    print('{0}Too many calibration attempts'.format(label))
+    return False, new_z, new_x, new_y, new_l, new_r
+
+async def calibrate_printer_async(port_name, session_args, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, step_mm, max_runs, max_error, bed_temp, minterp, tower_flag, speed=115200, name=''):
+    # Connect, set up and calibrate one printer on the running event loop
+    label = '[{0}] '.format(name) if name else ''
+    conn = establish_serial_connection(port_name, speed, parity_hack=session_args.get('parity_hack', True),
+                                       dtr=session_args.get('dtr'), rts=session_args.get('rts', False))
+    if conn is None:
+        return False, trial_z, trial_x, trial_y, l_value, r_value
+    port = AsyncPrinterLink(conn, session_args.get('window', 0))
+    port.start()
+    try:
+        firmware = await port.wait_ready(session_args.get('ready_timeout') or 30)
+        if firmware is None:
+            print('{0}No reply to M115, skipping this printer'.format(label))
+            return False, trial_z, trial_x, trial_y, l_value, r_value
+        if firmFlag < 0:
+            firmFlag = min(classify_firmware(firmware, []), 1)
+        print('{0}{1}, using {2} firmware'.format(label, firmware, 'Marlin' if firmFlag == 1 else 'Monoprice'))
+
+        if bed_temp >= 0:
+            await send_async(port, 'M140 S{0}\n'.format(str(bed_temp)).encode())
+        await send_async(port, ('M92 X{0} Y{0} Z{0}\n'.format(str(step_mm))).encode())
+        await send_async(port, ('M665 L{0} R{1}\n'.format(str(l_value),str(r_value))).encode())
+        if firmFlag == 1:
+            await send_async(port, 'M206 X0 Y0 Z0\n'.encode())
+            await send_async(port, 'M421 C\n'.encode())
+        await set_M_values_async(port, trial_z, trial_x, trial_y, l_value, r_value, label)
+
+        return await run_calibration_async(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, max_runs, max_error, bed_temp, minterp, tower_flag, name)
+    finally:
+        port.close()
+
+async def calibrate_printers_async(port_names, speeds, *args, **kwargs):
+    # Every printer on one event loop at its own baud rate, results in the order of port_names
+    names = [os.path.basename(port_name) if len(port_names) > 1 else '' for port_name in port_names]
+    return await asyncio.gather(*[calibrate_printer_async(port_name, *args, speed=speed, name=name, **kwargs)
+                                  for port_name, speed, name in zip(port_names, speeds, names)])
+
+def main():
+    # Default values
+    max_runs = 14
+    max_error = 1
+
+    x0 = 0.0
+    y0 = 0.0
+    z0 = 0.0
+    trial_x = x0
+    trial_y = y0
+    trial_z = z0
+    r_value = 63.5
+    step_mm = 57.14
+    l_value = 123.0
+    xhigh = [0]*2
+    yhigh = [0]*2
+    zhigh = [0]*2
+    bed_temp = -1
+    minterp = 0
+    firmFlag = 0
+    tower_flag = 0
+
+    parser = argparse.ArgumentParser(description='Auto-Bed Cal. for Monoprice Mini Delta')
+    parser.add_argument('-p','--port',help='Serial port, auto = the only printer found by -dp',required=False)
+    parser.add_argument('-x','--x0',type=float,default=x0,help='Starting x-value')
+    parser.add_argument('-y','--y0',type=float,default=y0,help='Starting y-value')
+    parser.add_argument('-z','--z0',type=float,default=z0,help='Starting z-value')
+    parser.add_argument('-r','--r-value',type=float,default=r_value,help='Starting r-value')
+    parser.add_argument('-l','--l-value',type=float,default=l_value,help='Starting l-value')
+    parser.add_argument('-s','--step-mm',type=float,default=step_mm,help='Set steps-/mm')
+    parser.add_argument('-me','--max-error',type=float,default=max_error,help='Maximum acceptable calibration error on non-first run')
+    parser.add_argument('-mr','--max-runs',type=int,default=max_runs,help='Maximum attempts to calibrate printer')
+    parser.add_argument('-bt','--bed-temp',type=int,default=bed_temp,help='Bed Temperature')
+    parser.add_argument('-im','--minterp',type=int,default=minterp,help='Intepolation Method')
+    parser.add_argument('-ff','--firmFlag',type=int,default=firmFlag,help='Firmware Flag (0 = Stock; 1 = Marlin; -1 = detect with M115/M503, cached per port)')
+    parser.add_argument('-tf','--tower_flag',type=int,default=tower_flag,help='Tower Flag (0 = Stock and old Marlin; 1 = Marlin 1.3.3, 2 = experimental)')
+    parser.add_argument('-w','--window',type=int,default=0,help='Marlin commands kept in flight, counted by ok replies (0 = wait on every reply, 4 = default Marlin BUFSIZE)')
+    parser.add_argument('-cs','--checksum',type=int,default=0,help='Send line numbers and checksums and resend corrupted lines (0 = off, 1 = on, Marlin only)')
+    parser.add_argument('-ph','--parity_hack',type=int,default=1,help='Open the port with odd parity first, needed by some USB drivers (0 = off, 1 = on)')
+    parser.add_argument('-dtr','--dtr',type=int,default=-1,help='DTR while opening the port (-1 = driver default, 0 = low, avoids the Marlin reboot with -ph 0, 1 = high)')
+    parser.add_argument('-rts','--rts',type=int,default=0,help='RTS after opening the port (-1 = driver default, 0 = low, needed on mac, 1 = high)')
+    parser.add_argument('-rt','--ready_timeout',type=float,default=30,help='Seconds to wait for the firmware to answer M115 after the port opens (0 = do not wait)')
+    parser.add_argument('-dp','--discover',type=int,default=0,help='Scan /dev/ttyACM* and /dev/ttyUSB* in parallel, list the printers and their firmware, then exit (0 = off, 1 = on)')
+    parser.add_argument('-pc','--port_cache',type=str,default=PORT_CACHE,help='File with the firmware fingerprint of every port seen so far')
+    parser.add_argument('-bd','--baud',type=int,default=115200,help='Baud rate (0 = the rate cached by -nb for this port)')
+    parser.add_argument('-nb','--negotiate_baud',type=int,default=0,help='Try the -br baud rates fastest first and keep the first that passes an M118 burst test (0 = off, 1 = on)')
+    parser.add_argument('-br','--baud_rates',type=str,default=','.join(str(rate) for rate in BAUD_RATES),help='Comma separated baud rates tried by -nb')
+    parser.add_argument('-rc','--repeat_cal',type=int,default=1,help='Calibrations run back to back on one connection, later ones start from the last result and write auto_cal_p5_r#_pass#.txt')
+    parser.add_argument('-ap','--asyncio',type=int,default=0,help='Run on one asyncio event loop, -p may list several ports separated by commas or be auto for every printer found, not with -nb -rc -tj -prof -pm -eta -tr (0 = off, 1 = on)')
+    parser.add_argument('-rec','--record',type=str,default=None,help='Record every byte sent and received, with timestamps, to this JSONL transcript')
+    parser.add_argument('-rp','--replay',type=str,default=None,help='Run against a transcript recorded with -rec instead of a printer, -p is not needed')
+    parser.add_argument('-rps','--replay_scale',type=float,default=0,help='Replay speed (1 = recorded printer timing, 2 = twice as fast, 0 = no waiting)')
+    parser.add_argument('-tj','--timing_json',type=str,default=None,help='Write the time spent in each phase of every pass, and the command latency histograms, to this JSON file')
+    parser.add_argument('-prof','--profile',type=str,default=None,help='Profile the contour and calibration math with cProfile and write the stats to this file')
+    parser.add_argument('-pm','--prometheus',type=str,default=None,help='Write the result as node_exporter textfile metrics (passes, errors, M665/M666, failure reason) to this .prom file')
+    parser.add_argument('-eta','--eta_log',type=str,default=None,help='Append the time left estimated after every pass, and what it really was, as a JSON line to this file')
+    parser.add_argument('-tr','--trace',type=str,default=None,help='Write a trace-event timeline of the session (commands, probes, phases, temperatures) to this JSON file')
+    parser.add_argument('-f','--file',type=str,dest='file',default=None,
+        help='File with settings, will be updated with latest settings at the end of the run')
+    args = parser.parse_args()
+    if args.port is None and args.discover != 1 and not args.replay:
+        parser.error('the following arguments are required: -p/--port')
+    if args.asyncio == 1:
+        # The event loop path has no session timer, latency or baud test
+        unsupported = [flag for flag, used in (('-nb', args.negotiate_baud == 1), ('-rc', args.repeat_cal > 1),
+                                               ('-tj', args.timing_json), ('-prof', args.profile), ('-pm', args.prometheus),
+                                               ('-eta', args.eta_log), ('-tr', args.trace)) if used]
+        if unsupported:
+            parser.error('{0} cannot be used with -ap 1'.format(', '.join(unsupported)))
+
+    session_args = dict(window=args.window, checksum=args.checksum == 1, parity_hack=args.parity_hack == 1,
+                        dtr=line_flag(args.dtr), rts=line_flag(args.rts), ready_timeout=args.ready_timeout)
+
+    # Port discovery
+    port_name = args.port
+    if args.replay:
+        port_name = args.replay
+    elif args.discover == 1 or port_name == 'auto':
+        found = discover_printers(args.port_cache, **session_args)
+        print_discovered(found)
+        if args.discover == 1:
+            return
+        if len(found) != 1 and not (args.asyncio == 1 and found):
+            sys.exit('Found {0} printers, choose one with -p'.format(str(len(found))))
+        port_name = ','.join(sorted(found))
+    elif ',' in port_name and args.asyncio != 1:
+        parser.error('several ports need -ap 1')
+
+
+    if args.file:
+        try:
+            with open(args.file) as data_file:
+                settings = json.load(data_file)
+            tower_flag = int(settings.get('tower_flag', tower_flag))
+            firmFlag = int(settings.get('firmFlag', firmFlag))
+            minterp = int(settings.get('minterp', minterp))
+            bed_temp = int(settings.get('bed_temp', bed_temp))
+            max_runs = int(settings.get('max_runs', max_runs))
+            max_error = float(settings.get('max_error', max_error))
+            trial_z = float(settings.get('z', trial_z))
+            trial_x = float(settings.get('x', trial_x))
+            trial_y = float(settings.get('y', trial_y))
+            r_value = float(settings.get('r', r_value))
+            l_value = float(settings.get('l', l_value))
+            step_mm = float(settings.get('step', step_mm))
+
+        except:
+            tower_flag = args.tower_flag
+            firmFlag = args.firmFlag
+            minterp = args.minterp
+            bed_temp = args.bed_temp
+            max_error = args.max_error
+            max_runs = args.max_runs
+            trial_z = args.z0
+            trial_x = args.x0
+            trial_y = args.y0
+            r_value = args.r_value
+            step_mm = args.step_mm
+            max_runs = args.max_runs
+            l_value = args.l_value
+            pass
+    else: 
+        tower_flag = args.tower_flag
+        firmFlag = args.firmFlag
+        minterp = args.minterp
+        bed_temp = args.bed_temp
+        max_error = args.max_error
+        max_runs = args.max_runs
+        trial_z = args.z0
+        trial_x = args.x0
+        trial_y = args.y0
+        r_value = args.r_value
+        step_mm = args.step_mm
+        max_runs = args.max_runs
+        l_value = args.l_value
+        
+    # One event loop for every printer
+    if args.asyncio == 1:
+        port_names = port_name.split(',')
+        if args.checksum == 1:
+            print ('Line numbers and checksums are not used with -ap 1\n')
+        if args.record or args.replay:
+            print ('Transcripts are not recorded or replayed with -ap 1\n')
+        # -bd 0 takes each port's baud rate from the port cache, like a single printer
+        port_cache = load_port_cache(args.port_cache)
+        speeds = [args.baud or int(port_cache.get(name, {}).get('baud', 115200)) for name in port_names]
+        results = asyncio.run(calibrate_printers_async(port_names, speeds, session_args, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, step_mm, max_runs, max_error, bed_temp, minterp, tower_flag))
+        for name, result in zip(port_names, results):
+            print ('{0}: {1}'.format(name, 'calibrated' if result[0] else 'not calibrated'))
+        if len(results) == 1 and results[0][0] and args.file:
+            calibrated, new_z, new_x, new_y, new_l, new_r = results[0]
+            data = {'z':new_z, 'x':new_x, 'y':new_y, 'r':new_r, 'l': new_l, 'step':step_mm, 'max_runs':max_runs, 'max_error':max_error, 'bed_temp':bed_temp}
+            with open(args.file, "w") as text_file:
+                text_file.write(json.dumps(data))
+        return
+
+    # Baud rate
+    session = None
+    speed = args.baud
+    if args.negotiate_baud == 1 and not args.replay:
+        rates = [int(rate) for rate in args.baud_rates.split(',')]
+        session, throughput = negotiate_baud(port_name, rates, args.port_cache, **session_args)
+        if session is not None:
+            print ('Using {0} baud, {1:.0f} bytes/s in the M118 burst\n'.format(str(session.speed), throughput))
+        else:
+            print ('No baud rate passed the M118 burst test\n')
+    elif speed == 0:
+        speed = int(load_port_cache(args.port_cache).get(port_name, {}).get('baud', 115200))
+    if session is None:
+        session = PrinterSession(port_name, speed=speed, record=args.record, replay=args.replay,
+                                 replay_scale=args.replay_scale, **session_args)
+    elif args.record:
+        session.start_recording(args.record)
+    if args.profile:
+        session.timer.start_profile()
+    if args.trace:
+        session.timer.start_trace()
+    port = session.open()
+
+    if port:
+    
+        # Firmware readiness
+        if session.ready is not None:
+            print ('Printer ready after {0:.1f} s, M115 round trip {1:.0f} ms'.format(session.ready.wait, (session.ready.latency or 0)*1000))
+            if session.ready.firmware:
+                print (session.ready.firmware)
+            print ('')
+        elif session.ready_timeout > 0:
+            print ('No reply to M115 within {0} s, sending setup anyway\n'.format(str(session.ready_timeout)))
+
+        # Firmware
+        if firmFlag < 0:
+            # This script drives Odyssey the same way as Marlin4MPMD
+            firmFlag = min(cached_firmware(session, args.port_cache), 1)
+        if firmFlag == 0:
+            print("Using Monoprice Firmware\n")
+        elif firmFlag == 1:
+            print("Using Marlin Firmware\n")
+            
+        # Tower Setup
+        if tower_flag == 0:
+            print("Stock Tower Setup (X opposite of LCD)\n")
+        elif tower_flag == 1:
+            print("Altered Tower Setup (Y opposite of LCD)\n")
+        elif tower_flag == 2:
+            print("Experimental Tower Setup (Z opposite of LCD)\n")
+    
+        #Set Bed Temperature
+        if bed_temp >= 0:
+            print ('Setting bed temperature to {0} C\n'.format(str(bed_temp)))
+            port.write('M140 S{0}\n'.format(str(bed_temp)).encode())
+            port.drain()
+            
+        # Display interpolation methods
+        if minterp == 1: 
+            print("Interpolation Method: Dennis's Spreadsheet\n")
+        else:
+            print("Interpolation Method: python3 scipy.interpolate.griddata\n")
+    
+        # Set the proper step/mm
+        print ('Setting up M92 X{0} Y{0} Z{0}\n'.format(str(step_mm)))
+        port.write(('M92 X{0} Y{0} Z{0}\n'.format(str(step_mm))).encode())
+        port.drain()
+        
+        print ('Setting up M665 L{0} R{1}\n'.format(str(l_value),str(r_value)))
+        port.write(('M665 L{0} R{1}\n'.format(str(l_value),str(r_value))).encode())
+        port.drain()
+
+        if firmFlag == 1:
+            print ('Setting up M206 X0 Y0 Z0\n')
+            port.write('M206 X0 Y0 Z0\n'.encode())
+            port.drain()
+        
+            print ('Clearing mesh with M421 C\n')
+            port.write('M421 C\n'.encode())
+            port.drain()
+
+        set_M_values(port, trial_z, trial_x, trial_y, l_value, r_value)
+
+        print ('\nStarting calibration')
+
+        calibrated = False
+        reason = ''
+        try:
+            calibrated, new_z, new_x, new_y, new_l, new_r, xhigh, yhigh, zhigh = run_calibration(port, firmFlag, trial_x, trial_y, trial_z, l_value, r_value, xhigh, yhigh, zhigh, max_runs, args.max_error, bed_temp, minterp, tower_flag)
+
+            # Repeat calibrations start from the last result on the open connection,
+            # but track the high tower from scratch like a fresh calibration
+            for repeat in range(1, args.repeat_cal):
+                print ('\nRepeat calibration {0} out of {1}'.format(str(repeat), str(args.repeat_cal-1)))
+                xhigh = [0]*2
+                yhigh = [0]*2
+                zhigh = [0]*2
+                calibrated, new_z, new_x, new_y, new_l, new_r, xhigh, yhigh, zhigh = run_calibration(port, firmFlag, new_x, new_y, new_z, new_l, new_r, xhigh, yhigh, zhigh, max_runs, args.max_error, bed_temp, minterp, tower_flag, repeat=repeat)
+        except SystemExit as e:
+            reason = str(e.code)
+            raise
+        except Exception as e:
+            reason = '{0}: {1}'.format(type(e).__name__, str(e))
+            raise
+        finally:
+            # Also when the calibration gives up with sys.exit()
+            report_timing(session, args.timing_json, args.profile, args.trace)
+            if args.prometheus:
+                write_metrics(args.prometheus, session, FIRMWARE_NAMES.get(firmFlag, 'unknown'), 'P5', calibrated, reason)
+            if args.eta_log:
+                session.timer.eta.save(args.eta_log, port=session.port, pattern='P5', calibrated=calibrated, reason=reason)
+
+        session.close()
+
+        if calibrated:
+            if firmFlag == 1:
+                print ('Run mesh bed leveling before printing: G29\n')
+            if args.file:
+                data = {'z':new_z, 'x':new_x, 'y':new_y, 'r':new_r, 'l': new_l, 'step':step_mm, 'max_runs':max_runs, 'max_error':max_error, 'bed_temp':bed_temp}
+                with open(args.file, "w") as text_file:
+                    text_file.write(json.dumps(data))
+
+    elif args.prometheus:
+        write_metrics(args.prometheus, session, FIRMWARE_NAMES.get(firmFlag, 'unknown'), 'P5', False, 'Could not open the port')
+
+
+if __name__ == '__main__':
+    main()